@@ -1,9 +1,29 @@
 from flask import Flask, request, render_template_string
 import boto3
 import botocore.exceptions
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
+AWS_MAX_WORKERS = 8     # 同時に呼び出す AWS API 数の上限 (全リクエストで共有)
+IAM_PAGE_SIZE = 1000    # IAM の一覧系 API の 1 ページの件数 (上限は 1000)
+
+CLIENT_CACHE_TTL = 15 * 60     # 認証情報ごとのセッション・クライアントを使い回す秒数
+CLIENT_CACHE_MAX_ENTRIES = 64
+RESULT_CACHE_TTL = 5 * 60      # 同じ認証情報の確認結果を使い回す秒数
+RESULT_CACHE_MAX_ENTRIES = 256
+
+# 互いに依存しない AWS API の呼び出しを並行して行うスレッドプール
+aws_executor = ThreadPoolExecutor(max_workers=AWS_MAX_WORKERS, thread_name_prefix="aws")
+# キャッシュのキーにする認証情報のハッシュの鍵 (プロセスごとに作成し、保存しない)
+credential_hash_key = os.urandom(32)
+
 # Bootstrap 5 を利用した HTML テンプレート
 FORM_TEMPLATE = '''
 <!doctype html>
@@ -31,6 +51,10 @@ FORM_TEMPLATE = '''
           <input type="text" class="form-control" id="session_token" name="session_token">
         </div>
         <!-- 固定リージョン（必要ならフォームに追加可） -->
+        <div class="mb-3 form-check">
+          <input type="checkbox" class="form-check-input" id="no_cache" name="no_cache" value="1">
+          <label for="no_cache" class="form-check-label">キャッシュを使わずに確認する</label>
+        </div>
         <button type="submit" class="btn btn-primary">確認する</button>
       </form>
 
@@ -41,6 +65,12 @@ FORM_TEMPLATE = '''
       {% endif %}
 
       {% if result %}
+        {% if cached_age is not none %}
+          <div class="alert alert-info mt-4" role="alert">
+            {{ cached_age | int }} 秒前に確認した結果です。再度確認する場合は「キャッシュを使わずに確認する」を選択してください。
+          </div>
+        {% endif %}
+        {% if result.identity %}
         <div class="mt-4">
           <h2>基本情報</h2>
           <ul class="list-group">
@@ -49,6 +79,7 @@ FORM_TEMPLATE = '''
             <li class="list-group-item"><strong>ARN:</strong> {{ result.identity.Arn }}</li>
           </ul>
         </div>
+        {% endif %}
 
         {% if result.strong_privileges %}
           <div class="alert alert-warning mt-4" role="alert">
@@ -115,6 +146,26 @@ FORM_TEMPLATE = '''
             {% endif %}
           </div>
         {% endif %}
+
+        {% if result.calls %}
+          <div class="mt-4">
+            <h2>API 呼び出し</h2>
+            <table class="table table-sm">
+              <thead>
+                <tr><th>API</th><th>所要時間 (秒)</th><th>エラー</th></tr>
+              </thead>
+              <tbody>
+                {% for call in result.calls %}
+                  <tr>
+                    <td>{{ call.name }}</td>
+                    <td>{{ '%.3f' % call.seconds }}</td>
+                    <td>{{ call.error or '' }}</td>
+                  </tr>
+                {% endfor %}
+              </tbody>
+            </table>
+          </div>
+        {% endif %}
       {% endif %}
     </div>
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
@@ -122,106 +173,234 @@ FORM_TEMPLATE = '''
 </html>
 '''
 
-def get_permissions_info(session, caller_identity):
+class TTLCache:
+    """有効期限 (ttl 秒) と件数の上限付きのキャッシュ (上限を超えた場合は古いものから捨てる)"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # key -> (保存した時刻, 値)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """(値, 保存してからの秒数) を返す (ないか期限切れの場合は (None, None))"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            age = time.time() - entry[0]
+            if age > self.ttl:
+                del self.entries[key]
+                return None, None
+            return entry[1], age
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time(), value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class CredentialClients:
+    """
+    1 つの認証情報の boto3 セッションと、サービスごとのクライアント
+    boto3 のセッションはスレッドセーフではないため、クライアントの作成は 1 スレッドずつ行う
+    (作成したクライアントはスレッド間で共有してよい)
+    client() は boto3.Session.client() と同じように使える
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def client(self, service_name):
+        with self.lock:
+            if service_name not in self.clients:
+                self.clients[service_name] = self.session.client(service_name)
+            return self.clients[service_name]
+
+
+# 認証情報のハッシュ -> CredentialClients / 確認結果
+client_cache = TTLCache(CLIENT_CACHE_TTL, CLIENT_CACHE_MAX_ENTRIES)
+result_cache = TTLCache(RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES)
+
+def credential_fingerprint(access_key, secret_key, session_token, region):
+    """
+    キャッシュのキーにする認証情報のハッシュ (HMAC-SHA256)
+    シークレットが異なる場合に別の認証情報のキャッシュを使わないように、シークレットも含めてハッシュにする
+    (キャッシュにはシークレットをそのまま保存しない)
+    """
+    message = "\0".join([access_key or "", secret_key or "", session_token or "", region])
+    return hmac.new(credential_hash_key, message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def get_credential_clients(fingerprint, access_key, secret_key, session_token, region):
+    """認証情報のセッションとクライアントを、キャッシュにあれば使い回し、なければ作成する"""
+    clients, _ = client_cache.get(fingerprint)
+    if clients is None:
+        # 認証情報とリージョンを指定して boto3 セッションを作成
+        clients = CredentialClients(boto3.Session(
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            aws_session_token=session_token if session_token else None,
+            region_name=region
+        ))
+        client_cache.put(fingerprint, clients)
+    return clients
+
+def timed_call(name, func):
+    """
+    func を呼び出し、(戻り値, {"name", "seconds", "error"}) を返す
+    例外が発生した場合は戻り値を None とし、error に例外のメッセージを入れる
+    """
+    start = time.perf_counter()
+    try:
+        value = func()
+        error = None
+    except Exception as e:
+        value = None
+        error = str(e)
+    return value, {"name": name, "seconds": time.perf_counter() - start, "error": error}
+
+def run_parallel(calls, timings=None):
+    """
+    互いに依存しない AWS API の呼び出し [(name, func)] を aws_executor で並行して行い、
+    成功したものの {name: 戻り値} と、呼び出しごとの所要時間・エラーの一覧を返す
+    timings を指定した場合は、所要時間・エラーを追加する
+    ※aws_executor のスレッドの中からは呼び出さないこと (プールを使い切ると待ち続けるため)
+    """
+    futures = [aws_executor.submit(timed_call, name, func) for name, func in calls]
+    values, call_timings = {}, []
+    for (name, _), future in zip(calls, futures):
+        value, timing = future.result()
+        call_timings.append(timing)
+        if timing["error"] is None:
+            values[name] = value
+    if timings is not None:
+        timings.extend(call_timings)
+    return values, call_timings
+
+def paginate_all(client, operation_name, result_key, **kwargs):
+    """paginator で全ページを取得し、各ページの result_key の一覧をつなげて返す"""
+    items = []
+    paginator = client.get_paginator(operation_name)
+    for page in paginator.paginate(PaginationConfig={"PageSize": IAM_PAGE_SIZE}, **kwargs):
+        items.extend(page.get(result_key, []))
+    return items
+
+def get_permissions_info(session, caller_identity, timings=None):
     """
     IAM の API を用いて、ユーザーまたはロールのポリシー情報を取得する。
-    権限が不足している場合は例外をキャッチし、エラーメッセージを返します。
+    詳細・アタッチされたポリシー・インラインポリシーの取得は並行して行い、一覧は全ページを取得します。
+    権限が不足している場合は例外をキャッチし、エラーメッセージを返します (取得できた情報は残します)。
     """
     permissions = {}
     iam_client = session.client('iam')
     arn = caller_identity.get("Arn", "")
-    try:
-        if "assumed-role" in arn:
-            # arn:aws:sts::<account>:assumed-role/<roleName>/<sessionName>
-            parts = arn.split('/')
-            if len(parts) >= 3:
-                role_name = parts[1]
+    # (permissions のキー, API 名, 呼び出し)
+    calls = []
+    if "assumed-role" in arn:
+        # arn:aws:sts::<account>:assumed-role/<roleName>/<sessionName>
+        parts = arn.split('/')
+        if len(parts) >= 3:
+            role_name = parts[1]
+            calls = [
                 # ロールの詳細取得
-                role_response = iam_client.get_role(RoleName=role_name)
-                permissions["RoleDetails"] = role_response.get("Role", {})
+                ("RoleDetails", "iam:GetRole",
+                 lambda: iam_client.get_role(RoleName=role_name).get("Role", {})),
                 # アタッチされたロールポリシーの取得
-                attached_response = iam_client.list_attached_role_policies(RoleName=role_name)
-                permissions["AttachedRolePolicies"] = attached_response.get("AttachedPolicies", [])
+                ("AttachedRolePolicies", "iam:ListAttachedRolePolicies",
+                 lambda: paginate_all(iam_client, "list_attached_role_policies", "AttachedPolicies",
+                                      RoleName=role_name)),
                 # インラインポリシーの取得
-                inline_response = iam_client.list_role_policies(RoleName=role_name)
-                permissions["InlineRolePolicies"] = inline_response.get("PolicyNames", [])
-            else:
-                permissions["message"] = "ARN の解析に失敗しました。"
-        elif "user" in arn:
-            # arn:aws:iam::<account>:user/<username>
-            user_response = iam_client.get_user()
-            user = user_response.get("User", {})
-            permissions["UserDetails"] = user
-            user_name = user.get("UserName")
+                ("InlineRolePolicies", "iam:ListRolePolicies",
+                 lambda: paginate_all(iam_client, "list_role_policies", "PolicyNames", RoleName=role_name)),
+            ]
+        else:
+            permissions["message"] = "ARN の解析に失敗しました。"
+    elif "user" in arn:
+        # arn:aws:iam::<account>:user/<path>/<username>
+        # get_user の結果を待たずに一覧を取得できるように、ユーザー名は ARN から取り出す
+        user_name = arn.rsplit('/', 1)[-1]
+        calls = [
+            # ユーザーの詳細取得
+            ("UserDetails", "iam:GetUser", lambda: iam_client.get_user().get("User", {})),
             # アタッチされたユーザーポリシーの取得
-            attached_response = iam_client.list_attached_user_policies(UserName=user_name)
-            permissions["AttachedUserPolicies"] = attached_response.get("AttachedPolicies", [])
+            ("AttachedUserPolicies", "iam:ListAttachedUserPolicies",
+             lambda: paginate_all(iam_client, "list_attached_user_policies", "AttachedPolicies",
+                                  UserName=user_name)),
             # インラインポリシーの取得
-            inline_response = iam_client.list_user_policies(UserName=user_name)
-            permissions["InlineUserPolicies"] = inline_response.get("PolicyNames", [])
-        else:
-            permissions["message"] = "不明な ARN 形式です。"
-    except Exception as e:
-        permissions["error"] = str(e)
+            ("InlineUserPolicies", "iam:ListUserPolicies",
+             lambda: paginate_all(iam_client, "list_user_policies", "PolicyNames", UserName=user_name)),
+        ]
+    else:
+        permissions["message"] = "不明な ARN 形式です。"
+
+    values, call_timings = run_parallel([(name, func) for _, name, func in calls], timings)
+    for key, name, _ in calls:
+        if name in values:
+            permissions[key] = values[name]
+    errors = [timing["error"] for timing in call_timings if timing["error"] is not None]
+    if errors:
+        permissions["error"] = errors[0]
     return permissions
 
-def simulate_policy(session, policy_source_arn):
+def simulate_policy(session, policy_source_arn, timings=None):
     """
     IAM Policy Simulator API を用いて、代表的なアクションに対する評価結果を取得する。
     ※呼び出しには iam:SimulatePrincipalPolicy の権限が必要です。
     """
     iam_client = session.client('iam')
     actions = ["s3:ListBuckets", "ec2:DescribeInstances", "iam:ListUsers", "cloudwatch:ListMetrics"]
-    try:
-        response = iam_client.simulate_principal_policy(
-            PolicySourceArn=policy_source_arn,
-            ActionNames=actions
-        )
-        simulation_results = {}
-        for res in response.get("EvaluationResults", []):
-            action = res.get("EvalActionName", "unknown")
-            decision = res.get("EvalDecision", "unknown")
-            simulation_results[action] = decision
-        return simulation_results
-    except Exception as e:
-        return {"error": str(e)}
+    evaluation_results, timing = timed_call(
+        "iam:SimulatePrincipalPolicy",
+        lambda: paginate_all(iam_client, "simulate_principal_policy", "EvaluationResults",
+                             PolicySourceArn=policy_source_arn, ActionNames=actions))
+    if timings is not None:
+        timings.append(timing)
+    if timing["error"] is not None:
+        return {"error": timing["error"]}
+    simulation_results = {}
+    for res in evaluation_results:
+        action = res.get("EvalActionName", "unknown")
+        decision = res.get("EvalDecision", "unknown")
+        simulation_results[action] = decision
+    return simulation_results
 
-def simulate_read_operations(session):
+def simulate_read_operations(session, timings=None):
     """
-    S3, EC2, IAM の代表的な読み取り系 API を実際に呼び出し、実行可能かどうか試行する。
+    S3, EC2, IAM の代表的な読み取り系 API を実際に並行して呼び出し、実行可能かどうか試行する。
     """
-    simulation_results = {}
-    
-    # S3: ListBuckets
     s3_client = session.client('s3')
-    try:
-        s3_client.list_buckets()
-        simulation_results["s3:ListBuckets"] = "Success"
-    except Exception as e:
-        simulation_results["s3:ListBuckets"] = f"Error: {str(e)}"
-    
-    # EC2: DescribeInstances
     ec2_client = session.client('ec2')
-    try:
-        ec2_client.describe_instances(MaxResults=5)
-        simulation_results["ec2:DescribeInstances"] = "Success"
-    except Exception as e:
-        simulation_results["ec2:DescribeInstances"] = f"Error: {str(e)}"
-    
-    # IAM: ListUsers
     iam_client = session.client('iam')
-    try:
-        iam_client.list_users(MaxItems=5)
-        simulation_results["iam:ListUsers"] = "Success"
-    except Exception as e:
-        simulation_results["iam:ListUsers"] = f"Error: {str(e)}"
-    
+    _, call_timings = run_parallel([
+        # S3: ListBuckets
+        ("s3:ListBuckets", lambda: s3_client.list_buckets()),
+        # EC2: DescribeInstances
+        ("ec2:DescribeInstances", lambda: ec2_client.describe_instances(MaxResults=5)),
+        # IAM: ListUsers
+        ("iam:ListUsers", lambda: iam_client.list_users(MaxItems=5)),
+    ], timings)
+
+    simulation_results = {}
+    for timing in call_timings:
+        if timing["error"] is None:
+            simulation_results[timing["name"]] = "Success"
+        else:
+            simulation_results[timing["name"]] = f"Error: {timing['error']}"
     return simulation_results
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     result = {}
     error = None
+    cached_age = None
 
     if request.method == 'POST':
         access_key = request.form.get('access_key')
@@ -229,21 +408,34 @@ def index():
         session_token = request.form.get('session_token')
         # 固定のリージョン（必要に応じてフォームから入力させることも可）
         region = 'us-east-1'
+        fingerprint = credential_fingerprint(access_key, secret_key, session_token, region)
+        # 同じ認証情報を RESULT_CACHE_TTL 秒以内に確認した場合は、その結果を返す
+        if not request.form.get('no_cache'):
+            cached_result, cached_age = result_cache.get(fingerprint)
+            if cached_result is not None:
+                return render_template_string(FORM_TEMPLATE, result=cached_result, error=None, cached_age=cached_age)
 
         try:
-            # 認証情報とリージョンを指定して boto3 セッションを作成
-            session = boto3.Session(
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                aws_session_token=session_token if session_token else None,
-                region_name=region
-            )
+            # セッションとクライアントは認証情報ごとに CLIENT_CACHE_TTL 秒使い回す
+            session = get_credential_clients(fingerprint, access_key, secret_key, session_token, region)
+            # API ごとの所要時間・エラー
+            timings = []
             sts = session.client('sts')
-            identity = sts.get_caller_identity()
+            start = time.perf_counter()
+            try:
+                identity = sts.get_caller_identity()
+            except Exception as e:
+                # 失敗した呼び出しも API 呼び出しの一覧に表示する (基本情報は表示しない)
+                timings.append({"name": "sts:GetCallerIdentity", "seconds": time.perf_counter() - start,
+                                "error": str(e)})
+                result["calls"] = timings
+                raise
+            timings.append({"name": "sts:GetCallerIdentity", "seconds": time.perf_counter() - start, "error": None})
             result["identity"] = identity
+            result["calls"] = timings
 
             # IAM の権限情報取得を試行
-            permissions = get_permissions_info(session, identity)
+            permissions = get_permissions_info(session, identity, timings)
             result["permissions"] = permissions
 
             # attached policies を解析して、強力な権限があるかチェック
@@ -263,19 +455,26 @@ def index():
                 result["strong_privileges"] = list(set(strong_policies))
 
             # もし権限情報取得に失敗（例外・エラー）した場合はシミュレーション処理を実行
+            # (Policy Simulator と読み取り操作の試行は並行して行う)
             if permissions.get("error"):
-                sim_policy = simulate_policy(session, identity.get("Arn"))
-                sim_read = simulate_read_operations(session)
+                sim_policy_future = aws_executor.submit(simulate_policy, session, identity.get("Arn"), timings)
+                sim_read = simulate_read_operations(session, timings)
+                sim_policy = sim_policy_future.result()
                 result["simulation"] = {
                     "policy_simulator": sim_policy,
                     "read_operations": sim_read
                 }
+            result_cache.put(fingerprint, result)
         except botocore.exceptions.ClientError as e:
             error = f"AWS API エラー: {e}"
+            # 無効な認証情報のセッションは使い回さない
+            client_cache.pop(fingerprint)
         except Exception as e:
             error = f"エラー: {e}"
+            client_cache.pop(fingerprint)
 
-    return render_template_string(FORM_TEMPLATE, result=result if result else None, error=error)
+    return render_template_string(FORM_TEMPLATE, result=result if result else None, error=error,
+                                  cached_age=cached_age)
 
 if __name__ == '__main__':
     # Docker コンテナ内で外部アクセス可能にするためホストを 0.0.0.0 に指定
@@ -1,61 +1,407 @@
 import feedparser
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, request, render_template, redirect, url_for, jsonify, Response
 import threading
+import queue
+from contextlib import contextmanager
 import os
+import sys
+import socket
+import argparse
+import subprocess
+import time
+import hashlib
+import calendar
+import uuid
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 import re
-from googletrans import Translator  # Google翻訳API（googletransライブラリを利用）
+import csv
+import io
+from xml.etree import ElementTree
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # データベースを設定する
 DB_PATH = 'app.db'
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
+
+# フィード取得の設定
+FETCH_MAX_WORKERS = 16       # 同時に取得するフィード数の上限
+FETCH_PER_HOST_LIMIT = 2     # 同一ホストへの同時接続数の上限
+FETCH_TIMEOUT = 20           # 1フィードあたりのタイムアウト（秒）
+FETCH_USER_AGENT = 'sendtoslackwtrans/1.0 (+feedparser)'
+
+# フィードごとのポーリング間隔の設定（秒）
+FEED_SCHEDULER_TICK_MINUTES = 1     # 取得時刻になったフィードがあるかを確認する間隔（分）
+FEED_MIN_INTERVAL = 5 * 60          # 更新の多いフィードでもこれより短い間隔では取得しない
+FEED_MAX_INTERVAL = 24 * 60 * 60    # 更新のないフィードでも1日に1回は取得する
+FEED_BACKOFF_FACTOR = 1.5           # 更新がなかった場合に間隔を延ばす倍率
+FEED_RATE_SMOOTHING = 0.3           # 公開ペースの指数移動平均の重み
+
+# 複数プロセスで同じ app.db を共有する場合の設定
+# 各プロセスはフィードを借用（リース）してから取得するため、同じフィードを二重に処理しない
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+FEED_CLAIM_LIMIT = 200              # 1回のフィード処理で借用するフィード数の上限
+FEED_LEASE_SECONDS = 10 * 60        # 借用の有効期限（プロセスが異常終了した場合はこの時間後に他のプロセスが取得する）
+SLACK_DRAIN_LEASE_SECONDS = 5 * 60  # Slackへの送信を担当するプロセスの有効期限
+
+# キーワード照合の設定
+KEYWORD_IGNORE_CASE = False     # 大文字・小文字を区別せずに照合する
+KEYWORD_WORD_BOUNDARY = False   # 英単語の途中に一致した場合は無視する（日本語には影響しない）
+
+# 翻訳の設定
+TRANSLATION_BATCH_SIZE = 20             # 1回の翻訳リクエストにまとめるテキスト数
+TRANSLATION_CACHE_MAX_ROWS = 20000      # 翻訳キャッシュの最大件数
+TRANSLATION_CACHE_MAX_AGE_DAYS = 30     # この日数使われなかった翻訳キャッシュは削除する
+
+# Slack送信の設定
+SLACK_API_URL = os.environ.get('SLACK_API_URL', 'https://slack.com/api/chat.postMessage')
+SLACK_TIMEOUT = 10          # 1リクエストあたりのタイムアウト（秒）
+SLACK_MIN_INTERVAL = 1.1    # 投稿の最小間隔（秒）。chat.postMessage はチャンネルあたり1秒1件程度が上限
+SLACK_MAX_ATTEMPTS = 5      # この回数失敗したメッセージは再送をやめ、dead としてキューに残す
+# トークンやチャンネルの設定を直すまで成功しないエラー（試行回数を増やさずに送信を止める）
+SLACK_CONFIG_ERRORS = ('invalid_auth', 'not_authed', 'account_inactive', 'token_revoked', 'token_expired',
+                       'channel_not_found', 'not_in_channel', 'is_archived', 'missing_scope')
+# メッセージの内容によるエラー（再送しても成功しないため、すぐに dead にする）
+SLACK_MESSAGE_ERRORS = ('invalid_blocks', 'msg_too_long', 'no_text', 'too_many_attachments')
+SLACK_BACKOFF_BASE = 30     # 再送までの待ち時間（秒）。失敗するごとに倍にする
+SLACK_BACKOFF_MAX = 3600    # 再送までの待ち時間の上限（秒）
+SLACK_COALESCE_SIZE = 1     # 2以上にすると、複数の記事を1つのBlock Kitメッセージにまとめて送信する
+
+# フィード処理のパイプラインの設定
+PIPELINE_QUEUE_SIZE = 100       # ステージ間のキューの上限（一杯になると前のステージは空くまで待つ）
+PIPELINE_TRANSLATE_WAIT = 0.5   # 翻訳をまとめるために、後続の記事を待つ最大秒数
+PIPELINE_DELIVER_BATCH = 20     # 送信待ちキューにまとめて追加するメッセージ数
+
+# 管理画面の設定
+LIST_CACHE_TTL = 30         # 設定・キーワード・フィードの一覧をメモリに保持する秒数（他のプロセスの変更はこの時間内に反映される）
+ADMIN_PAGE_SIZE = 50        # 管理画面の一覧の1ページあたりの件数
+ADMIN_MAX_PAGE_SIZE = 500   # /api/keywords, /api/rss_urls で指定できる1ページあたりの件数の上限
+
+# 既読の記事の判定
+ENTRY_ID_HASH_BYTES = 8     # フィードごとに保存する記事IDのハッシュのバイト数
+URL_HASH_BYTES = 16         # 送信済みURLのハッシュのバイト数
+
+# 送信済みURLの保持期間の設定
+SENT_URL_MIN_RETENTION_DAYS = 30    # フィードの記事の期間が分からない場合も、最低この日数は保持する
+SENT_URL_RETENTION_MARGIN = 2       # フィードに残っている最も古い記事の期間の何倍まで保持するか
+
+# データベース接続
+# スレッド（Flaskのリクエスト処理、スケジューラ、フィード取得）ごとに接続を分け、
+# 同じカーソルを複数のスレッドで共有しないようにする
+DB_TIMEOUT = 30         # ロックが解放されるまで待つ秒数
+SQL_BATCH_SIZE = 500    # SQLiteの1クエリあたりのパラメータ数の上限に収まるように分割する
+
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+
+def get_db():
+    """現在のスレッド用のデータベース接続を取得する（初回は接続を作成する）"""
+    db = getattr(_db_local, 'conn', None)
+    if db is None:
+        # isolation_level=None で自動コミットにし、複数の文をまとめる場合は transaction() を使う
+        db = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, isolation_level=None,
+                             check_same_thread=False, cached_statements=256)
+        # WALモードにして、書き込み中でも読み込みをブロックしないようにする
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(f'PRAGMA busy_timeout={DB_TIMEOUT * 1000}')
+        _db_local.conn = db
+        _db_local.in_transaction = False
+        with _db_connections_lock:
+            _db_connections.append(db)
+    return db
+
+def close_db():
+    """
+    現在のスレッドのデータベース接続を閉じる
+    スレッドごとに接続を作成するため、処理を終えたスレッドやリクエストで呼び出さないと接続が残り続ける
+    """
+    db = getattr(_db_local, 'conn', None)
+    if db is None:
+        return
+    _db_local.conn = None
+    with _db_connections_lock:
+        if db in _db_connections:
+            _db_connections.remove(db)
+    db.close()
+
+def closing_db(func):
+    """func の終了時に、実行したスレッドのデータベース接続を閉じる（スレッドやジョブの関数に付ける）"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_db()
+    return wrapper
+
+def close_db_connections():
+    """全てのスレッドのデータベース接続を閉じる（終了時に呼び出す）"""
+    with _db_connections_lock:
+        for db in _db_connections:
+            db.close()
+        _db_connections.clear()
+
+@contextmanager
+def transaction():
+    """
+    複数の文を1つのトランザクションで実行する
+    BEGIN IMMEDIATE で最初に書き込みロックを取得し、途中で "database is locked" にならないようにする
+    ネストした場合は外側のトランザクションにまとめる
+    """
+    db = get_db()
+    if _db_local.in_transaction:
+        yield db
+        return
+    db.execute('BEGIN IMMEDIATE')
+    _db_local.in_transaction = True
+    try:
+        yield db
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    finally:
+        _db_local.in_transaction = False
+
+def db_query(sql, params=()):
+    return get_db().execute(sql, params).fetchall()
+
+def db_query_one(sql, params=()):
+    return get_db().execute(sql, params).fetchone()
+
+def db_query_in(sql, values, params=()):
+    """
+    sql 中の {placeholders} を IN 句のプレースホルダに置き換え、values を分割して検索する
+    例: db_query_in('SELECT keyword FROM keywords WHERE keyword IN ({placeholders})', keywords)
+    """
+    values = list(values)
+    rows = []
+    for i in range(0, len(values), SQL_BATCH_SIZE):
+        chunk = values[i:i + SQL_BATCH_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows.extend(db_query(sql.format(placeholders=placeholders), tuple(params) + tuple(chunk)))
+    return rows
+
+def db_execute(sql, params=()):
+    return get_db().execute(sql, params)
+
+def db_executemany(sql, rows):
+    with transaction() as db:
+        return db.executemany(sql, rows)
+
+# メトリクス（/metrics でPrometheusのテキスト形式で出力する）
+class Metric:
+    """ラベルごとの値を保持するメトリクス（counter / gauge / histogram）"""
+
+    def __init__(self, name, help_text, kind, buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.buckets = tuple(buckets) if buckets else ()
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, samples):
+        """全ての値を samples（(値, ラベルのdict) のリスト）に置き換える。データベースから読み込むgauge用"""
+        values = {self._key(labels): value for value, labels in samples}
+        with self._lock:
+            self._values = values
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [n + (value <= bound) for n, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                   for k, v in labels)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            if self.kind != 'histogram':
+                lines.append(f'{self.name}{self._format_labels(labels)} {value}')
+                continue
+            counts, total, count = value
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{self._format_labels(labels + (("le", bound),))} {n}')
+            lines.append(f'{self.name}_bucket{self._format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{self._format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{self._format_labels(labels)} {count}')
+        return '\n'.join(lines)
+
+METRICS = []
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RUN_DURATION_SECONDS = Metric('rss_run_duration_seconds', 'フィード処理1回の所要時間', 'histogram',
+                              (1, 5, 15, 30, 60, 120, 300, 600, 1800))
+FEED_FETCH_SECONDS = Metric('rss_feed_fetch_seconds', 'フィード取得の所要時間', 'histogram', LATENCY_BUCKETS)
+FEED_FETCH_LAST_SECONDS = Metric('rss_feed_fetch_last_seconds', '登録中のフィードごとの直近の取得時間（ラベルは rss_urls の id）',
+                                 'gauge')
+FEED_FETCHES = Metric('rss_feed_fetches_total', 'フィードの取得回数（結果別）', 'counter')
+ENTRIES_PARSED = Metric('rss_entries_parsed_total', '解析した記事数', 'counter')
+ENTRIES_SEEN = Metric('rss_entries_seen_total', '前回の取得時にもフィードにあったためスキップした記事数', 'counter')
+DEDUP_CHECKS = Metric('rss_dedup_checks_total', '送信済みURLと照合した記事数', 'counter')
+DEDUP_HITS = Metric('rss_dedup_hits_total', '送信済みとしてスキップした記事数', 'counter')
+KEYWORD_MATCHES = Metric('rss_keyword_matches_total', 'キーワードに合致した記事数', 'counter')
+TRANSLATION_CACHE_HITS = Metric('rss_translation_cache_hits_total', '翻訳キャッシュのヒット数', 'counter')
+TRANSLATION_CACHE_MISSES = Metric('rss_translation_cache_misses_total', '翻訳キャッシュのミス数', 'counter')
+SLACK_SEND_SECONDS = Metric('rss_slack_send_seconds', 'Slackへの送信の所要時間', 'histogram', LATENCY_BUCKETS)
+SLACK_MESSAGES_SENT = Metric('rss_slack_messages_sent_total', 'Slackに送信したメッセージ数', 'counter')
+SLACK_SEND_FAILURES = Metric('rss_slack_send_failures_total', 'Slackへの送信の失敗回数（理由別）', 'counter')
+SLACK_QUEUE_MESSAGES = Metric('rss_slack_queue_messages', '送信待ちキューのメッセージ数（状態別）', 'gauge')
+SLACK_DELIVERY_BLOCKED = Metric('rss_slack_delivery_blocked', 'Slackの設定の問題で送信を止めているか（1: 停止中）', 'gauge')
+STAGE_ITEMS = Metric('rss_pipeline_stage_items_total', 'パイプラインのステージごとの処理件数', 'counter')
+STAGE_BUSY_SECONDS = Metric('rss_pipeline_stage_busy_seconds_total', 'パイプラインのステージごとの処理時間', 'counter')
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+def normalize_url(url):
+    """重複判定用にURLを正規化する（スキーム・ホストの小文字化、フラグメントとutm_*パラメータの除去）"""
+    parts = urlsplit(url.strip())
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                       if not k.lower().startswith('utm_')])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+def url_hash(url):
+    """正規化したURLの16バイトのハッシュ（sent_urls のキー）"""
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).digest()[:URL_HASH_BYTES]
 
 # テーブルの作成とマイグレーション
 def init_db():
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY,
-            slack_token TEXT,
-            slack_channel TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS keywords (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            keyword TEXT UNIQUE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS rss_urls (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            url TEXT UNIQUE
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sent_urls (
-            url TEXT PRIMARY KEY
-        )
-    ''')
-
-    # settingsテーブルに新しいカラムを追加する
-    c.execute("PRAGMA table_info(settings)")
-    columns = [column[1] for column in c.fetchall()]
-    if 'schedule_interval' not in columns:
-        c.execute('ALTER TABLE settings ADD COLUMN schedule_interval INTEGER DEFAULT 30')
-        logging.info("schedule_intervalカラムをsettingsテーブルに追加しました。")
-    if 'last_run_time' not in columns:
-        c.execute('ALTER TABLE settings ADD COLUMN last_run_time TEXT')
-        logging.info("last_run_timeカラムをsettingsテーブルに追加しました。")
-
-    conn.commit()
+    with transaction() as db:
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY,
+                slack_token TEXT,
+                slack_channel TEXT
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS keywords (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                keyword TEXT UNIQUE
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS rss_urls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS sent_urls (
+                url_hash BLOB PRIMARY KEY,
+                first_seen INTEGER
+            ) WITHOUT ROWID
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS translation_cache (
+                source_hash TEXT PRIMARY KEY,
+                translated TEXT,
+                created_at REAL,
+                last_used_at REAL
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_translation_cache_last_used_at ON translation_cache (last_used_at)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS slack_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                link TEXT,
+                message TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL,
+                last_error TEXT,
+                created_at REAL,
+                status TEXT DEFAULT 'pending'
+            )
+        ''')
+
+        # 旧形式（URLの文字列をそのまま保存）の sent_urls をハッシュ形式に移行する
+        columns = [column[1] for column in db.execute("PRAGMA table_info(sent_urls)").fetchall()]
+        if 'url' in columns:
+            db.execute('ALTER TABLE sent_urls RENAME TO sent_urls_old')
+            db.execute('''
+                CREATE TABLE sent_urls (
+                    url_hash BLOB PRIMARY KEY,
+                    first_seen INTEGER
+                ) WITHOUT ROWID
+            ''')
+            now = int(time.time())
+            db.executemany('INSERT OR IGNORE INTO sent_urls (url_hash, first_seen) VALUES (?, ?)',
+                           ((url_hash(row[0]), now) for row in db.execute('SELECT url FROM sent_urls_old')))
+            db.execute('DROP TABLE sent_urls_old')
+            logging.info("sent_urlsテーブルをハッシュ形式に移行しました。")
+        db.execute('CREATE INDEX IF NOT EXISTS idx_sent_urls_first_seen ON sent_urls (first_seen)')
+
+        # slack_queueテーブルに状態（pending: 送信待ち / dead: 再送をやめたメッセージ）のカラムを追加する
+        columns = [column[1] for column in db.execute("PRAGMA table_info(slack_queue)").fetchall()]
+        if 'status' not in columns:
+            db.execute("ALTER TABLE slack_queue ADD COLUMN status TEXT DEFAULT 'pending'")
+            logging.info("statusカラムをslack_queueテーブルに追加しました。")
+
+        # settingsテーブルに新しいカラムを追加する
+        columns = [column[1] for column in db.execute("PRAGMA table_info(settings)").fetchall()]
+        if 'schedule_interval' not in columns:
+            db.execute('ALTER TABLE settings ADD COLUMN schedule_interval INTEGER DEFAULT 30')
+            logging.info("schedule_intervalカラムをsettingsテーブルに追加しました。")
+        if 'last_run_time' not in columns:
+            db.execute('ALTER TABLE settings ADD COLUMN last_run_time TEXT')
+            logging.info("last_run_timeカラムをsettingsテーブルに追加しました。")
+
+        # rss_urlsテーブルに条件付きGETと取得時間記録用のカラムを追加する
+        columns = [column[1] for column in db.execute("PRAGMA table_info(rss_urls)").fetchall()]
+        for name, column_type in [('etag', 'TEXT'), ('last_modified', 'TEXT'),
+                                  ('last_status', 'INTEGER'), ('last_fetch_ms', 'REAL'),
+                                  ('last_fetched_at', 'TEXT'), ('next_due_at', 'REAL'),
+                                  ('poll_interval', 'REAL'), ('publish_rate', 'REAL'),
+                                  ('unchanged_count', 'INTEGER DEFAULT 0'), ('last_checked_at', 'REAL'),
+                                  ('history_window', 'REAL'), ('lease_owner', 'TEXT'), ('lease_until', 'REAL'),
+                                  ('high_water_mark', 'REAL'), ('seen_entry_ids', 'BLOB'),
+                                  ('seen_url_hashes', 'BLOB')]:
+            if name not in columns:
+                db.execute(f'ALTER TABLE rss_urls ADD COLUMN {name} {column_type}')
+                logging.info(f"{name}カラムをrss_urlsテーブルに追加しました。")
 
 init_db()
 
@@ -63,144 +409,1253 @@ def contains_japanese(text):
     """日本語が含まれているかどうかを判定する"""
     return bool(re.search('[\u3040-\u30FF\u4E00-\u9FFF]', text))
 
+class GoogleTranslateBackend:
+    """googletransライブラリを利用した翻訳バックエンド（Translatorは使い回す）"""
+
+    def __init__(self, src='en', dest='ja'):
+        from googletrans import Translator  # Google翻訳API（googletransライブラリを利用）
+        self.src = src
+        self.dest = dest
+        self.translator = Translator()
+
+    def translate_batch(self, texts):
+        """複数のテキストを1回のリクエストで翻訳し、同じ順序で返す"""
+        results = self.translator.translate(list(texts), src=self.src, dest=self.dest)
+        return [result.text for result in results]
+
+# 翻訳バックエンド（テスト時は set_translation_backend() で差し替える）
+_translation_backend = None
+_translation_backend_lock = threading.Lock()
+
+def get_translation_backend():
+    global _translation_backend
+    with _translation_backend_lock:
+        if _translation_backend is None:
+            _translation_backend = GoogleTranslateBackend()
+        return _translation_backend
+
+def set_translation_backend(backend):
+    """translate_batch(texts) を持つ任意のオブジェクトを翻訳バックエンドとして設定する"""
+    global _translation_backend
+    with _translation_backend_lock:
+        _translation_backend = backend
+
+def _translation_cache_key(text):
+    return hashlib.sha256(f"en:ja:{text}".encode('utf-8')).hexdigest()
+
+def _get_cached_translations(keys):
+    return dict(db_query_in('SELECT source_hash, translated FROM translation_cache WHERE source_hash IN ({placeholders})',
+                            keys))
+
+def evict_translation_cache():
+    """古い翻訳キャッシュと、上限件数を超えた分のキャッシュを削除する"""
+    expire_before = time.time() - TRANSLATION_CACHE_MAX_AGE_DAYS * 86400
+    with transaction() as db:
+        db.execute('DELETE FROM translation_cache WHERE last_used_at < ?', (expire_before,))
+        db.execute('''
+            DELETE FROM translation_cache WHERE source_hash IN (
+                SELECT source_hash FROM translation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (TRANSLATION_CACHE_MAX_ROWS,))
+
+def translate_texts(texts, stats=None):
+    """
+    英語のテキストをまとめて日本語に翻訳し、{元のテキスト: 翻訳結果} を返す
+    翻訳キャッシュにないテキストだけを TRANSLATION_BATCH_SIZE 件ずつバックエンドに送る
+    stats ({'hits': int, 'misses': int}) を渡した場合は、ログに出さずにヒット数・ミス数を加算する
+    """
+    unique_texts = list(dict.fromkeys(text for text in texts if text))
+    if not unique_texts:
+        return {}
+    keys = {text: _translation_cache_key(text) for text in unique_texts}
+    cached = _get_cached_translations(keys.values())
+    translations = {}
+    misses = []
+    for text in unique_texts:
+        if keys[text] in cached:
+            translations[text] = cached[keys[text]]
+        else:
+            misses.append(text)
+
+    now = time.time()
+    db_executemany('UPDATE translation_cache SET last_used_at = ? WHERE source_hash = ?',
+                   [(now, keys[text]) for text in translations])
+    new_rows = []
+    for i in range(0, len(misses), TRANSLATION_BATCH_SIZE):
+        batch = misses[i:i + TRANSLATION_BATCH_SIZE]
+        try:
+            # バックエンドの読み込みや作成に失敗した場合も、翻訳せずに処理を続ける
+            results = get_translation_backend().translate_batch(batch)
+        except Exception as e:
+            logging.error(f"翻訳に失敗しました: {e}")
+            continue  # 翻訳に失敗した場合は元のテキストを使う（キャッシュはしない）
+        for text, translated in zip(batch, results):
+            translations[text] = translated
+            new_rows.append((keys[text], translated, now, now))
+    db_executemany('INSERT OR REPLACE INTO translation_cache (source_hash, translated, created_at, last_used_at) VALUES (?, ?, ?, ?)',
+                   new_rows)
+    if new_rows:
+        evict_translation_cache()
+    TRANSLATION_CACHE_HITS.inc(len(unique_texts) - len(misses))
+    TRANSLATION_CACHE_MISSES.inc(len(misses))
+    if stats is not None:
+        stats['hits'] += len(unique_texts) - len(misses)
+        stats['misses'] += len(misses)
+    else:
+        logging.info(f"翻訳キャッシュ: ヒット {len(unique_texts) - len(misses)} 件 / ミス {len(misses)} 件")
+    return translations
+
 def translate_to_japanese(text):
     """英語のテキストを日本語に翻訳する"""
-    translator = Translator()
-    try:
-        result = translator.translate(text, src='en', dest='ja')
-        return result.text
-    except Exception as e:
-        logging.error(f"翻訳に失敗しました: {e}")
-        return text  # 翻訳に失敗した場合は元のテキストを返す
+    return translate_texts([text]).get(text, text)  # 翻訳に失敗した場合は元のテキストを返す
+
+class KeywordMatcher:
+    """
+    Aho-Corasick法で複数のキーワードを一度に照合するマッチャー
+    テキストを1回走査するだけで、含まれる全てのキーワードを返す
+    """
+
+    def __init__(self, keywords, ignore_case=False, word_boundary=False):
+        self.ignore_case = ignore_case
+        self.word_boundary = word_boundary
+        # 空文字と重複を除外し、元の順序を保持する
+        self.keywords = list(dict.fromkeys(kw for kw in keywords if kw))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, keyword in enumerate(self.keywords):
+            self._add(self._normalize(keyword), index)
+        self._build_failure_links()
+
+    def _normalize(self, text):
+        return text.lower() if self.ignore_case else text
+
+    def _add(self, pattern, index):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((index, len(pattern)))
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    @staticmethod
+    def _is_word_char(ch):
+        # 日本語は単語を空白で区切らないため、英数字のみを単語の構成文字とみなす
+        return ch.isascii() and (ch.isalnum() or ch == '_')
+
+    def _on_boundary(self, text, start, end):
+        if start > 0 and self._is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and self._is_word_char(text[end]):
+            return False
+        return True
+
+    def match(self, text):
+        """テキストに含まれるキーワードを、登録順のリストで返す"""
+        text = self._normalize(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index, length in output[state]:
+                if index in found:
+                    continue
+                if self.word_boundary and not self._on_boundary(text, position - length + 1, position + 1):
+                    continue
+                found.add(index)
+        return [self.keywords[index] for index in sorted(found)]
+
+# キーワードが変更されるまで使い回すマッチャー
+_keyword_matcher = None         # (構築に使ったキーワード一覧, マッチャー)
+_keyword_matcher_lock = threading.Lock()
+
+def get_keyword_matcher():
+    """キーワードのマッチャーを取得する（キーワードが変更された場合のみ再構築）"""
+    global _keyword_matcher
+    keywords = _cached('keywords', _load_keywords)
+    with _keyword_matcher_lock:
+        # 他のプロセスでキーワードが変更された場合も、一覧のキャッシュが更新された時点で再構築する
+        if _keyword_matcher is None or _keyword_matcher[0] != keywords:
+            matcher = KeywordMatcher(keywords,
+                                     ignore_case=KEYWORD_IGNORE_CASE,
+                                     word_boundary=KEYWORD_WORD_BOUNDARY)
+            _keyword_matcher = (keywords, matcher)
+            logging.info(f"キーワードのマッチャーを構築しました（{len(matcher.keywords)}件）")
+        return _keyword_matcher[1]
+
+def invalidate_keyword_matcher():
+    global _keyword_matcher
+    with _keyword_matcher_lock:
+        _keyword_matcher = None
+
+# 設定・キーワード・フィードの一覧のキャッシュ
+# 管理画面の表示やフィード処理のたびにテーブル全体を読み込まないように、変更されるまで使い回す
+_list_cache = {}            # 名前 → (読み込んだ時刻, 値)
+_list_cache_generation = 0  # 無効化するたびに増やし、読み込み中に無効化された値を保存しないようにする
+_list_cache_lock = threading.Lock()
+
+def _cached(name, loader):
+    """キャッシュした値を返す（ない場合や LIST_CACHE_TTL 秒を過ぎた場合は loader() で読み込む）"""
+    now = time.monotonic()
+    with _list_cache_lock:
+        entry = _list_cache.get(name)
+        if entry is not None and now - entry[0] < LIST_CACHE_TTL:
+            return entry[1]
+        generation = _list_cache_generation
+    value = loader()
+    with _list_cache_lock:
+        if generation == _list_cache_generation:
+            _list_cache[name] = (now, value)
+    return value
+
+def invalidate_list_cache(*names):
+    global _list_cache_generation
+    with _list_cache_lock:
+        _list_cache_generation += 1
+        for name in names:
+            _list_cache.pop(name, None)
+
+def _load_keywords():
+    return tuple(row[0] for row in db_query('SELECT keyword FROM keywords ORDER BY id'))
+
+def _load_rss_urls():
+    return tuple(row[0] for row in db_query('SELECT url FROM rss_urls ORDER BY id'))
 
 def get_settings():
-    c.execute('SELECT slack_token, slack_channel, schedule_interval, last_run_time FROM settings WHERE id = 1')
-    return c.fetchone()
+    return _cached('settings', lambda: db_query_one(
+        'SELECT slack_token, slack_channel, schedule_interval, last_run_time FROM settings WHERE id = 1'))
 
 def get_keywords():
-    c.execute('SELECT keyword FROM keywords')
-    return [row[0] for row in c.fetchall()]
+    return list(_cached('keywords', _load_keywords))
 
 def get_rss_urls():
-    c.execute('SELECT url FROM rss_urls')
-    return [row[0] for row in c.fetchall()]
+    return list(_cached('rss_urls', _load_rss_urls))
+
+def paginate(items, query='', page=1, per_page=ADMIN_PAGE_SIZE):
+    """一覧を部分一致（大文字・小文字を区別しない）で絞り込み、指定したページの分だけ返す"""
+    if query:
+        lowered = query.lower()
+        items = [item for item in items if lowered in item.lower()]
+    per_page = min(max(per_page, 1), ADMIN_MAX_PAGE_SIZE)
+    pages = max(1, -(-len(items) // per_page))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * per_page
+    return {
+        'items': list(items[start:start + per_page]),
+        'total': len(items),
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'q': query,
+    }
+
+def claim_feeds(due_only=False, limit=FEED_CLAIM_LIMIT, checked_before=None):
+    """
+    他のプロセスが処理中でないフィードを最大 limit 件借用し、URLと前回取得時のETag / Last-Modifiedを返す
+    due_only=True の場合は、次回の取得時刻を過ぎたフィードのみを対象にする
+    checked_before を指定した場合は、その時刻以降に処理したフィードを除く（同じ実行で処理済みのフィードを再び借用しない）
+    借用は update_feed_schedules() で解除される（処理に失敗した場合は release_feeds()）
+    """
+    now = time.time()
+    condition = 'lease_until IS NULL OR lease_until < ?'
+    params = [now]
+    if due_only:
+        condition = f'({condition}) AND (next_due_at IS NULL OR next_due_at <= ?)'
+        params.append(now)
+    if checked_before is not None:
+        condition = f'({condition}) AND (last_checked_at IS NULL OR last_checked_at < ?)'
+        params.append(checked_before)
+    with transaction() as db:
+        rows = db.execute(f'SELECT url, etag, last_modified FROM rss_urls WHERE {condition} ORDER BY next_due_at LIMIT ?',
+                          params + [limit]).fetchall()
+        db.executemany('UPDATE rss_urls SET lease_owner = ?, lease_until = ? WHERE url = ?',
+                       [(WORKER_ID, now + FEED_LEASE_SECONDS, row[0]) for row in rows])
+    return rows
+
+def release_feeds(urls, owner=WORKER_ID):
+    """
+    次回の取得時刻や既読の目印を変えずにフィードの借用を解除する
+    処理に失敗したフィードを、借用の期限切れを待たずに次回の実行で処理し直すために使う
+    """
+    db_executemany('UPDATE rss_urls SET lease_owner = NULL, lease_until = NULL WHERE url = ? AND lease_owner = ?',
+                   [(url, owner) for url in urls])
+
+def acquire_lease(name, ttl, owner=WORKER_ID):
+    """
+    プロセス間で共有するリースを取得（または延長）する
+    他のプロセスが有効なリースを持っている場合は False を返す
+    """
+    now = time.time()
+    with transaction() as db:
+        row = db.execute('SELECT owner, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+        if row is not None and row[0] != owner and row[1] >= now:
+            return False
+        db.execute('INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)', (name, owner, now + ttl))
+        return True
+
+def release_lease(name, owner=WORKER_ID):
+    db_execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+def update_feed_fetch_states(results):
+    """
+    フィードの取得結果（ETag / Last-Modified / ステータス / 取得時間）と既読の目印を保存する
+    取得に失敗したフィードや更新のなかったフィードは、既読の目印を変更しない
+    既読の目印を保存した記事は次回から処理されないため、全ての記事を送信待ちキューに追加した後で呼び出す
+    """
+    fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    for r in results:
+        high_water_mark = r.get('high_water_mark')
+        rows.append((r['etag'], r['last_modified'], r['status'], r['elapsed_ms'], fetched_at,
+                     r.get('history_window'), high_water_mark, high_water_mark, r.get('seen_entry_ids'),
+                     r.get('seen_url_hashes'), r['url']))
+    db_executemany('''
+        UPDATE rss_urls
+        SET etag = ?, last_modified = ?, last_status = ?, last_fetch_ms = ?, last_fetched_at = ?,
+            history_window = COALESCE(?, history_window),
+            high_water_mark = COALESCE(MAX(high_water_mark, ?), ?, high_water_mark),
+            seen_entry_ids = COALESCE(?, seen_entry_ids),
+            seen_url_hashes = COALESCE(?, seen_url_hashes)
+        WHERE url = ?
+    ''', rows)
+
+def entry_timestamp(entry):
+    """記事の公開時刻（UNIX時間）。公開時刻も更新時刻もない場合は None"""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    return calendar.timegm(parsed) if parsed else None
+
+def entry_id_hash(entry):
+    """
+    記事IDとURLのハッシュ
+    全記事に同じIDを付けるフィードもあるため、IDだけでなくURLも含める
+    """
+    key = f"{entry.get('id', '')}\n{entry.link}"
+    return hashlib.sha256(key.encode('utf-8')).digest()[:ENTRY_ID_HASH_BYTES]
+
+def get_feed_marks(urls):
+    """
+    フィードごとの既読の目印を取得する
+    戻り値: {URL: (これまでに見た最新の公開時刻, 前回の取得時にフィードにあった記事IDのハッシュの集合)}
+    """
+    marks = {}
+    for url, high_water_mark, seen_entry_ids in db_query_in('''
+        SELECT url, high_water_mark, seen_entry_ids FROM rss_urls WHERE url IN ({placeholders})
+    ''', urls):
+        seen = seen_entry_ids or b''
+        marks[url] = (high_water_mark, {seen[i:i + ENTRY_ID_HASH_BYTES] for i in range(0, len(seen), ENTRY_ID_HASH_BYTES)})
+    return marks
+
+def update_feed_schedules(results, new_counts, base_interval_minutes):
+    """
+    フィードごとの更新頻度から、次回の取得時刻を決める
+    - 新しい記事があった場合は、観測した公開ペース（件/時）から約1件ごとに取得する間隔にする
+    - 更新がなかった場合は、連続で変化がなかった回数に応じて間隔を FEED_BACKOFF_FACTOR 倍ずつ延ばす
+    """
+    now = time.time()
+    base_interval = base_interval_minutes * 60
+    urls = [r['url'] for r in results]
+    states = {row[0]: row[1:] for row in db_query_in('''
+        SELECT url, poll_interval, publish_rate, unchanged_count, last_checked_at
+        FROM rss_urls WHERE url IN ({placeholders})
+    ''', urls)}
+    rows = []
+    for url in urls:
+        poll_interval, publish_rate, unchanged_count, last_checked_at = states.get(url, (None, None, 0, None))
+        poll_interval = poll_interval or base_interval
+        unchanged_count = unchanged_count or 0
+        elapsed_hours = (now - last_checked_at) / 3600 if last_checked_at else None
+        new_count = new_counts.get(url, 0)
+        if elapsed_hours:
+            observed_rate = new_count / elapsed_hours
+            if publish_rate is None:
+                publish_rate = observed_rate
+            else:
+                publish_rate += (observed_rate - publish_rate) * FEED_RATE_SMOOTHING
+        if new_count:
+            unchanged_count = 0
+            if publish_rate:
+                poll_interval = 3600 / publish_rate
+        else:
+            unchanged_count += 1
+            poll_interval *= FEED_BACKOFF_FACTOR
+        poll_interval = min(max(poll_interval, FEED_MIN_INTERVAL), FEED_MAX_INTERVAL)
+        rows.append((poll_interval, publish_rate, unchanged_count, now, now + poll_interval, url))
+    # 次回の取得時刻を決めると同時に、フィードの借用を解除する
+    db_executemany('''
+        UPDATE rss_urls
+        SET poll_interval = ?, publish_rate = ?, unchanged_count = ?, last_checked_at = ?, next_due_at = ?,
+            lease_owner = NULL, lease_until = NULL
+        WHERE url = ?
+    ''', rows)
 
 def set_settings(slack_token, slack_channel, schedule_interval):
-    c.execute('''
+    db_execute('''
         INSERT OR REPLACE INTO settings (id, slack_token, slack_channel, schedule_interval)
         VALUES (1, ?, ?, ?)
     ''', (slack_token, slack_channel, schedule_interval))
-    conn.commit()
+    invalidate_list_cache('settings')
     # スケジュールを更新
     update_scheduler(schedule_interval)
 
 def update_last_run_time():
     last_run_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute('UPDATE settings SET last_run_time = ? WHERE id = 1', (last_run_time,))
-    conn.commit()
+    db_execute('UPDATE settings SET last_run_time = ? WHERE id = 1', (last_run_time,))
+    invalidate_list_cache('settings')
 
 def add_keyword(keyword):
     try:
-        c.execute('INSERT INTO keywords (keyword) VALUES (?)', (keyword,))
-        conn.commit()
+        db_execute('INSERT INTO keywords (keyword) VALUES (?)', (keyword,))
+        invalidate_list_cache('keywords')
+        invalidate_keyword_matcher()
         return True
     except sqlite3.IntegrityError:
         return False
 
 def delete_keyword(keyword):
-    c.execute('DELETE FROM keywords WHERE keyword = ?', (keyword,))
-    conn.commit()
+    db_execute('DELETE FROM keywords WHERE keyword = ?', (keyword,))
+    invalidate_list_cache('keywords')
+    invalidate_keyword_matcher()
 
 def add_rss_url(url):
     try:
-        c.execute('INSERT INTO rss_urls (url) VALUES (?)', (url,))
-        conn.commit()
+        db_execute('INSERT INTO rss_urls (url) VALUES (?)', (url,))
+        invalidate_list_cache('rss_urls')
         return True
     except sqlite3.IntegrityError:
         return False
 
 def delete_rss_url(url):
-    c.execute('DELETE FROM rss_urls WHERE url = ?', (url,))
-    conn.commit()
+    db_execute('DELETE FROM rss_urls WHERE url = ?', (url,))
+    invalidate_list_cache('rss_urls')
+
+def _import_values(table, column, values, replace):
+    """
+    値をまとめて登録する（1つのトランザクションで行い、途中で失敗した場合は何も変更しない）
+    replace=True の場合は、values にない既存の値を削除する
+    戻り値: (追加した件数, 削除した件数)
+    """
+    values = list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+    with transaction() as db:
+        removed = 0
+        if replace:
+            keep = set(values)
+            stale = [(row[0],) for row in db.execute(f'SELECT {column} FROM {table}') if row[0] not in keep]
+            removed = db.executemany(f'DELETE FROM {table} WHERE {column} = ?', stale).rowcount if stale else 0
+        added = db.executemany(f'INSERT OR IGNORE INTO {table} ({column}) VALUES (?)',
+                               [(value,) for value in values]).rowcount if values else 0
+    return added, removed
+
+def import_keywords(keywords, replace=False):
+    """キーワードをまとめて登録し、(追加した件数, 削除した件数) を返す"""
+    result = _import_values('keywords', 'keyword', keywords, replace)
+    invalidate_list_cache('keywords')
+    invalidate_keyword_matcher()
+    return result
+
+def import_rss_urls(urls, replace=False):
+    """RSSフィードのURLをまとめて登録し、(追加した件数, 削除した件数) を返す"""
+    result = _import_values('rss_urls', 'url', urls, replace)
+    invalidate_list_cache('rss_urls')
+    return result
+
+def parse_keyword_list(text):
+    """1行に1つのキーワードを書いたテキストからキーワードの一覧を取り出す"""
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def parse_feed_list(text):
+    """
+    CSV（1列目がURL）またはOPMLのテキストからフィードURLの一覧を取り出す
+    OPMLとして解析できない場合は ValueError を送出する
+    """
+    if text.lstrip().startswith('<'):
+        try:
+            root = ElementTree.fromstring(text)
+        except ElementTree.ParseError as e:
+            raise ValueError(f"OPMLを解析できません: {e}")
+        return [outline.get('xmlUrl').strip() for outline in root.iter('outline') if outline.get('xmlUrl')]
+    # ヘッダー行など、URLでない行は無視する
+    return [row[0].strip() for row in csv.reader(io.StringIO(text)) if row and '://' in row[0]]
+
+def export_feed_list(feed_format='csv'):
+    """登録済みのフィードをCSVまたはOPMLのテキストで返す"""
+    urls = get_rss_urls()
+    if feed_format == 'opml':
+        root = ElementTree.Element('opml', version='2.0')
+        ElementTree.SubElement(ElementTree.SubElement(root, 'head'), 'title').text = 'sendtoslackwtrans feeds'
+        body = ElementTree.SubElement(root, 'body')
+        for url in urls:
+            ElementTree.SubElement(body, 'outline', type='rss', text=url, xmlUrl=url)
+        return ElementTree.tostring(root, encoding='unicode', xml_declaration=True)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['url'])
+    writer.writerows([url] for url in urls)
+    return output.getvalue()
 
 def is_url_sent(url):
-    c.execute('SELECT 1 FROM sent_urls WHERE url = ?', (url,))
-    return c.fetchone() is not None
+    return db_query_one('SELECT 1 FROM sent_urls WHERE url_hash = ?', (url_hash(url),)) is not None
 
 def mark_url_as_sent(url):
-    c.execute('INSERT OR IGNORE INTO sent_urls (url) VALUES (?)', (url,))
-    conn.commit()
+    db_execute('INSERT OR IGNORE INTO sent_urls (url_hash, first_seen) VALUES (?, ?)', (url_hash(url), int(time.time())))
 
-def send_to_slack(message, slack_token, slack_channel):
+def get_sent_urls(urls):
+    """渡されたURLのうち、送信済みのものをまとめて検索して集合で返す"""
+    hashes = {}
+    for url in urls:
+        hashes.setdefault(url_hash(url), []).append(url)
+    sent = set()
+    for row in db_query_in('SELECT url_hash FROM sent_urls WHERE url_hash IN ({placeholders})', hashes):
+        sent.update(hashes[row[0]])
+    return sent
+
+def _sent_url_rows(urls):
+    now = int(time.time())
+    return [(url_hash(url), now) for url in urls]
+
+def mark_urls_as_sent(urls):
+    """複数のURLを1つのトランザクションで送信済みにマークする"""
+    db_executemany('INSERT OR IGNORE INTO sent_urls (url_hash, first_seen) VALUES (?, ?)', _sent_url_rows(urls))
+
+def get_sent_url_retention():
+    """
+    送信済みURLの保持期間（秒）
+    フィードに残っている最も古い記事の期間（history_window）の最大値の SENT_URL_RETENTION_MARGIN 倍とし、
+    その期間を過ぎた記事はどのフィードにも再び現れないとみなす
+    """
+    row = db_query_one('SELECT MAX(history_window) FROM rss_urls')
+    longest_window = row[0] if row and row[0] else 0
+    return max(longest_window * SENT_URL_RETENTION_MARGIN, SENT_URL_MIN_RETENTION_DAYS * 86400)
+
+def get_feed_url_hashes():
+    """登録中の各フィードの前回の取得結果にあった記事のURLのハッシュの集合"""
+    hashes = set()
+    for (seen,) in db_query('SELECT seen_url_hashes FROM rss_urls WHERE seen_url_hashes IS NOT NULL'):
+        hashes.update(seen[i:i + URL_HASH_BYTES] for i in range(0, len(seen), URL_HASH_BYTES))
+    return hashes
+
+def prune_sent_urls():
+    """
+    保持期間を過ぎた送信済みURLを削除し、削除した件数を返す
+    保持期間を過ぎても、登録中のフィードの前回の取得結果に残っている記事のURLは削除しない
+    （古い記事を残し続けるフィードで、削除したURLの記事が再送されないようにする）
+    """
+    expire_before = int(time.time() - get_sent_url_retention())
+    in_feeds = get_feed_url_hashes()
+    expired = [(row[0],) for row in db_query('SELECT url_hash FROM sent_urls WHERE first_seen < ?', (expire_before,))
+               if row[0] not in in_feeds]
+    deleted = db_executemany('DELETE FROM sent_urls WHERE url_hash = ?', expired).rowcount if expired else 0
+    if deleted:
+        logging.info(f"保持期間を過ぎた送信済みURLを削除しました: {deleted} 件")
+    return deleted
+
+def get_storage_stats():
+    """テーブルごとの件数とデータベースのサイズを返す"""
+    tables = {}
+    for name in ['settings', 'keywords', 'rss_urls', 'sent_urls', 'translation_cache', 'slack_queue']:
+        tables[name] = {'rows': db_query_one(f'SELECT COUNT(*) FROM {name}')[0]}
+        try:
+            # dbstat が有効なSQLiteの場合はテーブルとインデックスのサイズも返す
+            row = db_query_one('SELECT SUM(pgsize) FROM dbstat WHERE name = ? OR name IN '
+                               '(SELECT name FROM sqlite_master WHERE type = \'index\' AND tbl_name = ?)', (name, name))
+            tables[name]['bytes'] = row[0]
+        except sqlite3.OperationalError:
+            pass
+    oldest = db_query_one('SELECT MIN(first_seen) FROM sent_urls')[0]
+    last_error = db_query_one("SELECT last_error FROM slack_queue WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT 1")
+    page_size = db_query_one('PRAGMA page_size')[0]
+    return {
+        'database_bytes': db_query_one('PRAGMA page_count')[0] * page_size,
+        'freelist_bytes': db_query_one('PRAGMA freelist_count')[0] * page_size,
+        'tables': tables,
+        'sent_urls': {
+            'oldest_first_seen': datetime.fromtimestamp(oldest).strftime('%Y-%m-%d %H:%M:%S') if oldest else None,
+            'retention_days': round(get_sent_url_retention() / 86400, 1),
+        },
+        'slack_queue': dict(get_slack_queue_counts(), last_error=last_error[0] if last_error else None),
+    }
+
+def get_slack_queue_counts():
+    """送信待ちキューの状態ごとのメッセージ数を返す（dead: 再送をやめたメッセージ）"""
+    counts = {'pending': 0, 'dead': 0}
+    counts.update(db_query('SELECT status, COUNT(*) FROM slack_queue GROUP BY status'))
+    return counts
+
+def requeue_dead_slack_messages():
+    """dead のメッセージを送信待ちに戻し、戻した件数を返す（Slackの設定や障害を直した後に使う）"""
+    with transaction() as db:
+        return db.execute('''
+            UPDATE slack_queue SET status = 'pending', attempts = 0, next_attempt_at = ?
+            WHERE status = 'dead'
+        ''', (time.time(),)).rowcount
+
+# Slack APIとの通信はセッションを使い回して接続を再利用する
+slack_session = requests.Session()
+slack_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+slack_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+_slack_drain_lock = threading.Lock()
+
+def _post_to_slack(data, slack_token):
+    """
+    chat.postMessage を呼び出す
+
+    戻り値: (成功したか, Retry-After の秒数 or None, エラー内容)
+    """
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {slack_token}',
     }
+    started = time.monotonic()
+    try:
+        response = slack_session.post(SLACK_API_URL, json=data, headers=headers, timeout=SLACK_TIMEOUT)
+    except requests.RequestException as e:
+        SLACK_SEND_FAILURES.inc(reason='request_error')
+        return False, None, str(e)
+    finally:
+        SLACK_SEND_SECONDS.observe(time.monotonic() - started)
+    if response.status_code == 429:
+        SLACK_SEND_FAILURES.inc(reason='ratelimited')
+        return False, int(response.headers.get('Retry-After', 1)), 'ratelimited'
+    try:
+        body = response.json()
+    except ValueError:
+        SLACK_SEND_FAILURES.inc(reason=f'http_{response.status_code}')
+        return False, None, f"HTTP {response.status_code}: {response.text[:200]}"
+    if not body.get('ok'):
+        SLACK_SEND_FAILURES.inc(reason=body.get('error', 'unknown'))
+        return False, None, body.get('error', response.text)
+    return True, None, None
+
+def send_to_slack(message, slack_token, slack_channel):
     data = {
         'channel': slack_channel,
         'text': message,
     }
-    response = requests.post('https://slack.com/api/chat.postMessage', json=data, headers=headers)
-    if not response.json().get('ok'):
-        logging.error(f"Slackへのメッセージ送信に失敗しました: {response.text}")
+    ok, _, error = _post_to_slack(data, slack_token)
+    if not ok:
+        logging.error(f"Slackへのメッセージ送信に失敗しました: {error}")
+    return ok
 
-def process_feeds():
-    logging.info("========== フィード処理開始 ==========")
+def build_slack_payload(messages, slack_channel):
+    """キューのメッセージから送信内容を作成する（複数ある場合はBlock Kitで1つにまとめる）"""
+    if len(messages) == 1:
+        return {'channel': slack_channel, 'text': messages[0]}
+    blocks = []
+    for message in messages:
+        if blocks:
+            blocks.append({'type': 'divider'})
+        # sectionのテキストは3000文字まで
+        blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': message[:3000]}})
+    return {
+        'channel': slack_channel,
+        'text': f"{len(messages)} 件の記事がキーワードに合致しました",
+        'blocks': blocks,
+    }
+
+def enqueue_slack_messages(messages):
+    """
+    (URL, メッセージ) を送信待ちキューに追加し、追加した件数を返す
+    URLの送信済みマークも同じトランザクションで行い、送信に失敗してもメッセージが失われないようにする
+    他のプロセスが既に送信済みにマークしたURLのメッセージは追加しない
+    """
+    now = time.time()
+    enqueued = 0
+    with transaction() as db:
+        for link, message in messages:
+            cursor = db.execute('INSERT OR IGNORE INTO sent_urls (url_hash, first_seen) VALUES (?, ?)',
+                                (url_hash(link), int(now)))
+            if cursor.rowcount:
+                db.execute('INSERT INTO slack_queue (link, message, created_at, next_attempt_at) VALUES (?, ?, ?, ?)',
+                           (link, message, now, now))
+                enqueued += 1
+    return enqueued
+
+def drain_slack_queue(slack_token, slack_channel):
+    """
+    送信待ちキューのメッセージを古い順にSlackへ送信する
+    - 429 が返った場合は Retry-After の間、残りの送信を止める
+    - 失敗した場合は指数バックオフで再送し、SLACK_MAX_ATTEMPTS 回失敗したら dead にしてキューに残す
+      （URLは送信済みにマーク済みのため、削除すると記事が通知されないまま失われる）
+    - 内容によるエラー（SLACK_MESSAGE_ERRORS）はすぐに dead にする
+    - 設定の問題によるエラー（SLACK_CONFIG_ERRORS）は試行回数を増やさずに送信を止める
+    戻り値: 送信したメッセージ数
+    """
+    if not _slack_drain_lock.acquire(blocking=False):
+        return 0  # 他のスレッドが送信中
+    try:
+        sent = 0
+        last_post = 0.0
+        batch_size = max(1, min(SLACK_COALESCE_SIZE, 25))  # Block Kitのブロック数は50まで
+        # 送信は1つのプロセスだけが担当し、投稿レートの上限をプロセス全体で守る
+        while acquire_lease('slack_drain', SLACK_DRAIN_LEASE_SECONDS):
+            rows = db_query('''
+                SELECT id, message, attempts FROM slack_queue
+                WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?
+            ''', (time.time(), batch_size))
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            # チャンネルあたりの投稿レートを超えないように間隔をあける
+            wait = last_post + SLACK_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            ok, retry_after, error = _post_to_slack(build_slack_payload([row[1] for row in rows], slack_channel), slack_token)
+            last_post = time.monotonic()
+            placeholders = ','.join('?' * len(ids))
+            if ok:
+                db_execute(f'DELETE FROM slack_queue WHERE id IN ({placeholders})', ids)
+                SLACK_MESSAGES_SENT.inc(len(ids))
+                SLACK_DELIVERY_BLOCKED.set(0)
+                sent += len(ids)
+                continue
+            if retry_after is not None:
+                logging.warning(f"Slackのレート制限に達しました。{retry_after} 秒後に再送します。")
+                db_execute("UPDATE slack_queue SET next_attempt_at = MAX(next_attempt_at, ?) WHERE status = 'pending'",
+                           (time.time() + retry_after,))
+                break
+            if error in SLACK_CONFIG_ERRORS:
+                # 次回の送信時刻は変えず、設定を直せば次の送信（1分ごと）で再開する
+                logging.error(f"Slackの設定に問題があるため送信を止めます（Slack設定を確認してください）: {error}")
+                SLACK_DELIVERY_BLOCKED.set(1)
+                db_execute(f'UPDATE slack_queue SET last_error = ? WHERE id IN ({placeholders})', [error] + ids)
+                break
+            attempts = max(row[2] for row in rows) + 1
+            if attempts >= SLACK_MAX_ATTEMPTS or error in SLACK_MESSAGE_ERRORS:
+                logging.error(f"Slackへのメッセージ送信に {attempts} 回失敗したため再送をやめます"
+                              f"（/admin/slack_queue/requeue で送信待ちに戻せます）: {error}")
+                db_execute(f'''
+                    UPDATE slack_queue SET status = 'dead', attempts = ?, last_error = ?
+                    WHERE id IN ({placeholders})
+                ''', [attempts, error] + ids)
+            else:
+                delay = min(SLACK_BACKOFF_BASE * 2 ** (attempts - 1), SLACK_BACKOFF_MAX)
+                logging.error(f"Slackへのメッセージ送信に失敗しました（{delay} 秒後に再送）: {error}")
+                db_execute(f'''
+                    UPDATE slack_queue SET attempts = ?, next_attempt_at = ?, last_error = ?
+                    WHERE id IN ({placeholders})
+                ''', [attempts, time.time() + delay, error] + ids)
+        return sent
+    finally:
+        release_lease('slack_drain')
+        _slack_drain_lock.release()
+
+@closing_db
+def drain_slack_queue_job():
+    """スケジューラから定期的に呼び出し、再送待ちのメッセージを送信する"""
     settings = get_settings()
-    if not settings:
-        logging.error("Slackの設定が未設定です。")
+    if settings:
+        drain_slack_queue(settings[0], settings[1])
+
+# ホストごとの同時接続数を制限するセマフォ
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+def _get_host_semaphore(url):
+    host = urlparse(url).netloc.lower()
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(FETCH_PER_HOST_LIMIT)
+        return _host_semaphores[host]
+
+def fetch_feed(url, etag=None, last_modified=None):
+    """
+    フィードを条件付きGETで取得する。
+    前回のETag / Last-Modifiedを送信し、304が返った場合は本文を取得しない。
+    """
+    headers = {'User-Agent': FETCH_USER_AGENT}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    result = {
+        'url': url,
+        'status': None,
+        'etag': etag,
+        'last_modified': last_modified,
+        'content': None,
+        'headers': {},
+        'elapsed_ms': None,
+        'error': None,
+    }
+    started = time.monotonic()
+    try:
+        with _get_host_semaphore(url):
+            response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+        result['status'] = response.status_code
+        if response.status_code == 200:
+            result['content'] = response.content
+            result['headers'] = dict(response.headers)
+            # サーバーが検証子を返さなくなった場合は古い値を捨てる
+            result['etag'] = response.headers.get('ETag')
+            result['last_modified'] = response.headers.get('Last-Modified')
+        elif response.status_code != 304:
+            result['error'] = f"HTTP {response.status_code}"
+    except requests.RequestException as e:
+        result['error'] = str(e)
+    elapsed = time.monotonic() - started
+    result['elapsed_ms'] = elapsed * 1000
+    FEED_FETCH_SECONDS.observe(elapsed)
+    FEED_FETCHES.inc(result='error' if result['error'] else str(result['status']))
+    return result
+
+def fetch_feeds(feed_states):
+    """
+    複数のフィードを並列に取得し、取得が完了した順に結果を返す
+    取得済みで未処理の結果が溜まりすぎないように、同時に取得するのは FETCH_MAX_WORKERS 件までにする
+    """
+    if not feed_states:
         return
-    slack_token, slack_channel, _, _ = settings
-    keywords = get_keywords()
-    rss_urls = get_rss_urls()
-    logging.info(f"読み込んだキーワード: {keywords}")
-    logging.info(f"読み込んだRSSフィードのURL: {rss_urls}")
-    new_items = []
-    for url in rss_urls:
-        logging.info(f"フィードを取得中: {url}")
-        feed = feedparser.parse(url)
-        for entry in feed.entries:
-            link = entry.link
-            logging.info(f"記事のURLを処理中: {link}")
-            if is_url_sent(link):
-                logging.info("既に処理済みのURLです。スキップします。")
+    pending_states = iter(feed_states)
+    max_workers = min(FETCH_MAX_WORKERS, len(feed_states))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='feed-fetch') as executor:
+        futures = set()
+        for url, etag, last_modified in pending_states:
+            futures.add(executor.submit(fetch_feed, url, etag, last_modified))
+            if len(futures) >= max_workers:
+                break
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                # 1件取り出すごとに次のフィードの取得を開始する
+                for url, etag, last_modified in pending_states:
+                    futures.add(executor.submit(fetch_feed, url, etag, last_modified))
+                    break
+                yield future.result()
+
+# フィード処理の実行状況
+RUN_HISTORY_SIZE = 50   # /runs/<id> で参照できる実行履歴の件数
+
+class FeedRun:
+    """1回のフィード処理の進捗を記録する"""
+
+    def __init__(self, trigger):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger        # 'manual' / 'schedule'
+        self.status = 'queued'        # queued → running → finished / failed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.feeds_total = 0
+        self.feeds_fetched = 0
+        self.entries_processed = 0
+        self.matches = 0
+        self.messages_sent = 0
+        self.stages = {}
+
+    def to_dict(self):
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'status': self.status,
+            'created_at': datetime.fromtimestamp(self.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed_seconds': round(elapsed, 3),
+            'feeds_total': self.feeds_total,
+            'feeds_fetched': self.feeds_fetched,
+            'entries_processed': self.entries_processed,
+            'matches': self.matches,
+            'messages_sent': self.messages_sent,
+            'error': self.error,
+            'stages': {name: stats.to_dict() for name, stats in self.stages.items()},
+        }
+
+_runs = OrderedDict()
+_runs_lock = threading.Lock()
+_active_run = None
+
+def _claim_run(trigger):
+    """
+    実行中の処理がなければ新しい FeedRun を登録する
+    戻り値: (FeedRun, 新しく登録したかどうか)。実行中の場合は実行中の FeedRun を返す
+    確認と登録を同じロックの中で行うため、実行中の FeedRun が途中で終了しても None を返すことはない
+    """
+    global _active_run
+    with _runs_lock:
+        if _active_run is not None:
+            return _active_run, False
+        run = FeedRun(trigger)
+        _runs[run.id] = run
+        while len(_runs) > RUN_HISTORY_SIZE:
+            _runs.popitem(last=False)
+        _active_run = run
+        return run, True
+
+def _execute_run(run, due_only):
+    global _active_run
+    run.status = 'running'
+    run.started_at = time.time()
+    try:
+        process_feeds(due_only=due_only, run=run)
+        run.status = 'finished'
+    except Exception as e:
+        logging.exception("フィード処理中にエラーが発生しました。")
+        run.status = 'failed'
+        run.error = str(e)
+    finally:
+        run.finished_at = time.time()
+        with _runs_lock:
+            _active_run = None
+            # 取得時刻になったフィードがなかった定期実行は履歴に残さない
+            if run.trigger == 'schedule' and run.feeds_total == 0 and run.status == 'finished':
+                _runs.pop(run.id, None)
+
+def start_feed_run(trigger='manual', due_only=False):
+    """
+    フィード処理をバックグラウンドで開始する
+    既に実行中の場合は新しく開始せず、実行中の FeedRun を返す
+    戻り値: (FeedRun, 新しく開始したかどうか)
+    """
+    run, claimed = _claim_run(trigger)
+    if not claimed:
+        return run, False
+    threading.Thread(target=closing_db(_execute_run), args=(run, due_only), name=f'feed-run-{run.id[:8]}', daemon=True).start()
+    return run, True
+
+def get_feed_run(run_id):
+    with _runs_lock:
+        return _runs.get(run_id)
+
+# パイプラインの各ステージ間で受け渡す終了の合図
+_STAGE_END = object()
+
+class StageStats:
+    """パイプラインの1ステージの処理件数と処理時間"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0      # 処理にかかった時間
+        self.blocked_seconds = 0.0   # 次のステージのキューが空くのを待った時間
+
+    def to_dict(self):
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'items_per_second': round(self.items_in / self.busy_seconds, 1) if self.busy_seconds else None,
+        }
+
+def _run_stage(stats, func, inbox, outbox, errors, batch_size=1, batch_wait=0.0):
+    """
+    inbox から取り出した要素を最大 batch_size 件ずつ func(batch, emit) で処理する
+    emit(item) で渡した要素は outbox に送られる（outbox が一杯の場合は空くまで待つ）
+    batch_wait 秒までは、後続の要素が届くのを待ってからまとめて処理する
+    func で発生したエラーは errors に追加する。前のステージが止まらないように、残りの要素の処理は続ける
+    """
+    def emit(item):
+        started = time.monotonic()
+        outbox.put(item)
+        stats.blocked_seconds += time.monotonic() - started
+        stats.items_out += 1
+
+    try:
+        finished = False
+        while not finished:
+            item = inbox.get()
+            if item is _STAGE_END:
+                break
+            batch = [item]
+            deadline = time.monotonic() + batch_wait
+            while len(batch) < batch_size:
+                try:
+                    item = inbox.get(timeout=max(deadline - time.monotonic(), 0)) if batch_wait else inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STAGE_END:
+                    finished = True
+                    break
+                batch.append(item)
+            stats.items_in += len(batch)
+            started = time.monotonic()
+            blocked_before = stats.blocked_seconds
+            try:
+                func(batch, emit)
+            except Exception as e:
+                logging.exception(f"{stats.name} ステージでエラーが発生しました。")
+                errors.append(f"{stats.name}: {e}")
+            stats.busy_seconds += time.monotonic() - started - (stats.blocked_seconds - blocked_before)
+    finally:
+        if outbox is not None:
+            outbox.put(_STAGE_END)
+        close_db()
+
+class FeedPipeline:
+    """
+    1回のフィード処理を fetch → parse → dedup → match → translate → deliver のステージに分け、
+    上限付きのキューでつないで、ステージごとのスレッドで並行して実行する
+    合致した記事は全フィードの取得を待たずに順次Slackへ送信される
+    """
+
+    STAGES = ('fetch', 'parse', 'dedup', 'match', 'translate', 'deliver')
+
+    def __init__(self, run, feed_states, matcher, slack_token, slack_channel, stats=None):
+        self.run = run
+        self.feed_states = feed_states
+        self.matcher = matcher
+        self.slack_token = slack_token
+        self.slack_channel = slack_channel
+        # 複数回に分けて借用したフィードを処理する場合は、同じ stats に集計する
+        self.stats = stats if stats is not None else {name: StageStats(name) for name in self.STAGES}
+        self.fetch_results = []         # 取得結果（本文を除く）
+        self.processed_links = set()    # 今回の実行で処理したURL
+        self.unmatched_links = []       # キーワードに合致しなかったURL（最後にまとめて送信済みにマークする）
+        self.new_counts = {}            # フィードごとの新しい記事の件数（ポーリング間隔の調整に使う）
+        self.translation_stats = {'hits': 0, 'misses': 0}
+        self.errors = []                # ステージで発生したエラー
+        self.feed_marks = get_feed_marks([state[0] for state in feed_states])
+
+    def execute(self):
+        """全ステージを実行する。いずれかのステージでエラーが発生した場合は、全ステージの終了後に RuntimeError を送出する"""
+        fetched, parsed, fresh, matched, translated = (queue.Queue(PIPELINE_QUEUE_SIZE) for _ in range(5))
+        threads = [
+            threading.Thread(target=self._fetch, args=(fetched,)),
+            threading.Thread(target=_run_stage, args=(self.stats['parse'], self._parse, fetched, parsed, self.errors)),
+            threading.Thread(target=_run_stage, args=(self.stats['dedup'], self._dedup, parsed, fresh, self.errors)),
+            threading.Thread(target=_run_stage, args=(self.stats['match'], self._match, fresh, matched, self.errors)),
+            threading.Thread(target=_run_stage, args=(self.stats['translate'], self._translate, matched, translated,
+                                                      self.errors, TRANSLATION_BATCH_SIZE, PIPELINE_TRANSLATE_WAIT)),
+            threading.Thread(target=_run_stage, args=(self.stats['deliver'], self._deliver, translated, None,
+                                                      self.errors, PIPELINE_DELIVER_BATCH)),
+        ]
+        for name, thread in zip(self.STAGES, threads):
+            thread.name = f'pipeline-{name}'
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise RuntimeError(f"パイプラインのステージでエラーが発生しました: {'; '.join(self.errors)}")
+
+    def _fetch(self, outbox):
+        stats = self.stats['fetch']
+        started = time.monotonic()
+        blocked_before = stats.blocked_seconds
+        try:
+            for result in fetch_feeds(self.feed_states):
+                stats.items_out += 1
+                self.run.feeds_fetched += 1
+                put_started = time.monotonic()
+                outbox.put(result)
+                stats.blocked_seconds += time.monotonic() - put_started
+        except Exception as e:
+            logging.exception("fetch ステージでエラーが発生しました。")
+            self.errors.append(f"fetch: {e}")
+        finally:
+            stats.items_in += len(self.feed_states)
+            stats.busy_seconds += time.monotonic() - started - (stats.blocked_seconds - blocked_before)
+            outbox.put(_STAGE_END)
+
+    def _parse(self, batch, emit):
+        for result in batch:
+            content = result.pop('content', None)
+            headers = result.pop('headers', {})
+            self.fetch_results.append(result)
+            url = result['url']
+            if result['error']:
+                logging.error(f"フィードの取得に失敗しました: {url} ({result['error']}, {result['elapsed_ms']:.0f} ms)")
+                continue
+            if result['status'] == 304:
+                logging.debug("フィードに更新はありません: %s (%.0f ms)", url, result['elapsed_ms'])
                 continue
-            summary = entry.summary if 'summary' in entry else ''
-            title = entry.title if 'title' in entry else ''
+            logging.debug("フィードを取得しました: %s (%.0f ms)", url, result['elapsed_ms'])
+            # feedparser はヘッダー名を小文字で参照する (Content-Type の charset)
+            # content-location をフィードの URL にして、相対リンクを絶対 URL に解決させる
+            response_headers = {name.lower(): value for name, value in headers.items()}
+            response_headers['content-location'] = url
+            feed = feedparser.parse(content, response_headers=response_headers)
+            entries = [(entry, entry_timestamp(entry), entry_id_hash(entry)) for entry in feed.entries if 'link' in entry]
+            timestamps = [timestamp for _, timestamp, _ in entries if timestamp is not None]
+            now = time.time()
+            if timestamps:
+                # フィードに残っている最も古い記事の期間（送信済みURLの保持期間の計算に使う）
+                result['history_window'] = max(now - min(timestamps), 0)
+                # 未来の公開時刻で以降の記事を見落とさないように、現在時刻を上限にする
+                result['high_water_mark'] = min(max(timestamps), now)
+            result['seen_entry_ids'] = b''.join(id_hash for _, _, id_hash in entries)
+            # フィードに残っている記事のURLは、保持期間を過ぎても送信済みURLから削除しない
+            result['seen_url_hashes'] = b''.join({url_hash(entry.link) for entry, _, _ in entries})
+            ENTRIES_PARSED.inc(len(entries))
+            emit((url, entries))
+
+    def _dedup(self, batch, emit):
+        for url, entries in batch:
+            high_water_mark, seen_ids = self.feed_marks.get(url, (None, set()))
+            unseen = []
+            for entry, timestamp, id_hash in entries:
+                # 前回の取得時にもフィードにあった記事は処理しない（並び順が変わっても判定できる）
+                if id_hash in seen_ids:
+                    ENTRIES_SEEN.inc()
+                    continue
+                # これまでに見た最新の記事より新しい記事は、送信済みURLと照合せずに新しい記事とみなす
+                # 公開時刻のない記事、過去の日付で追加された記事、フィードに再び現れた記事は送信済みURLと照合する
+                is_newer = high_water_mark is not None and timestamp is not None and timestamp > high_water_mark
+                unseen.append((entry, not is_newer))
+            # 照合が必要なURLは1回のクエリでまとめて確認する
+            check_links = {entry.link for entry, needs_check in unseen if needs_check} - self.processed_links
+            sent_links = get_sent_urls(check_links) if check_links else set()
+            DEDUP_CHECKS.inc(len(check_links))
+            for entry, needs_check in unseen:
+                link = entry.link
+                if link in sent_links or link in self.processed_links:
+                    DEDUP_HITS.inc()
+                    continue
+                self.processed_links.add(link)
+                self.new_counts[url] = self.new_counts.get(url, 0) + 1
+                self.run.entries_processed += 1
+                summary = entry.summary if 'summary' in entry else ''
+                title = entry.title if 'title' in entry else ''
+                emit((link, title, summary))
+
+    def _match(self, batch, emit):
+        for link, title, summary in batch:
+            # 記事ごとのログは件数が多いため DEBUG にし、無効な場合は文字列の組み立ても行わない
+            logging.debug("記事のURLを処理中: %s", link)
             content = f"{title} {summary}"
-            # 空文字のキーワードを除外
-            keywords_filtered = [kw for kw in keywords if kw]
-            matched_keywords = [kw for kw in keywords_filtered if kw in content]
+            matched_keywords = self.matcher.match(content)
             if matched_keywords:
                 matched_keywords_str = ', '.join(matched_keywords)
-                message_summary = summary
+                # 日本語が含まれていない場合は翻訳する
+                needs_translation = not contains_japanese(content)
+                self.run.matches += 1
+                KEYWORD_MATCHES.inc()
+                logging.debug("キーワードに合致しました: %s", matched_keywords_str)
+                emit((link, title, summary, matched_keywords_str, needs_translation))
+            else:
+                self.unmatched_links.append(link)
+                logging.debug("キーワードに合致しませんでした: %s", link)
 
-                # 日本語が含まれていない場合は翻訳
-                if not contains_japanese(content):
-                    logging.info("日本語が含まれていません。翻訳を実行します。")
-                    translated_summary = translate_to_japanese(summary)
-                    message_summary = translated_summary  # 翻訳した内容を使用
+    def _translate(self, batch, emit):
+        # 翻訳が必要な概要をまとめて翻訳する
+        translations = translate_texts((summary for _, _, summary, _, needs_translation in batch if needs_translation),
+                                       stats=self.translation_stats)
+        for link, title, summary, matched_keywords_str, needs_translation in batch:
+            message_summary = translations.get(summary, summary) if needs_translation else summary
+            message = f"*タイトル:* {title}\n*URL:* {link}\n*概要:* {message_summary}\n*合致したキーワード:* {matched_keywords_str}"
+            emit((link, message))
 
-                message = f"*タイトル:* {title}\n*URL:* {link}\n*概要:* {message_summary}\n*合致したキーワード:* {matched_keywords_str}"
-                new_items.append((link, message))
-                logging.info(f"キーワードに合致しました: {matched_keywords_str}")
-            else:
-                logging.info("キーワードに合致しませんでした。")
-            # URLを送信済みにマーク（ここを変更）
-            mark_url_as_sent(link)
-    # 全てのフィードを処理した後、Slackに送信する
-    for link, message in new_items:
-        send_to_slack(message, slack_token, slack_channel)
+    def _deliver(self, batch, emit):
+        # 送信待ちキューへの追加と送信済みマークを同時に行ってから送信する
+        enqueue_slack_messages(batch)
+        self.run.messages_sent += drain_slack_queue(self.slack_token, self.slack_channel)
+
+def process_feeds(due_only=False, run=None):
+    """
+    RSSフィードを取得してキーワードと照合し、合致した記事をSlackに送信する
+    due_only=True の場合は、次回の取得時刻を過ぎたフィードのみを処理する
+    1回に借用できるのは FEED_CLAIM_LIMIT 件までなので、対象のフィードがなくなるまで借用と処理を繰り返す
+    進捗は run (FeedRun) に記録する。二重実行を防ぐ場合は start_feed_run() を使う
+    """
+    if run is None:
+        run = FeedRun('direct')
+    settings = get_settings()
+    if not settings:
+        logging.error("Slackの設定が未設定です。")
+        run.error = "Slackの設定が未設定です。"
+        return
+    slack_token, slack_channel, schedule_interval, _ = settings
+    claimed_since = time.time()
+    # 処理したフィードは次回の取得時刻が先になるため、due_only=True の場合は再び借用されない
+    checked_before = None if due_only else claimed_since
+    feed_states = claim_feeds(due_only=due_only, checked_before=checked_before)
+    if due_only and not feed_states:
+        return
+    started = time.monotonic()
+    logging.info("========== フィード処理開始 ==========")
+    matcher = get_keyword_matcher()
+    logging.info(f"キーワード: {len(matcher.keywords)} 件")
+    logging.debug("読み込んだキーワード: %s", matcher.keywords)
+
+    run.stages = {name: StageStats(name) for name in FeedPipeline.STAGES}
+    new_entries = 0
+    translation_stats = {'hits': 0, 'misses': 0}
+    while True:
+        run.feeds_total += len(feed_states)
+        logging.info(f"処理するRSSフィード: {len(feed_states)} 件")
+        logging.debug("読み込んだRSSフィードのURL: %s", [state[0] for state in feed_states])
+
+        pipeline = FeedPipeline(run, feed_states, matcher, slack_token, slack_channel, run.stages)
+        try:
+            pipeline.execute()
+            # 全ての記事を送信待ちキューに追加できた後で、キーワードに合致しなかったURLの送信済みマークと
+            # 既読の目印（ETag / high_water_mark / seen_entry_ids）を同じトランザクションで保存する
+            with transaction():
+                mark_urls_as_sent(pipeline.unmatched_links)
+                update_feed_fetch_states(pipeline.fetch_results)
+        except Exception:
+            # 一部の記事を処理できなかったため、既読の目印や次回の取得時刻を進めずに借用を解除する
+            # 送信済みの記事は送信済みURLに記録されているので、次回の実行で処理し直しても重複して送信されない
+            release_feeds([state[0] for state in feed_states])
+            raise
+        update_feed_schedules(pipeline.fetch_results, pipeline.new_counts, schedule_interval or 30)
+        new_entries += len(pipeline.processed_links)
+        for key in translation_stats:
+            translation_stats[key] += pipeline.translation_stats[key]
+
+        if len(feed_states) < FEED_CLAIM_LIMIT:
+            break
+        feed_states = claim_feeds(due_only=due_only, checked_before=checked_before)
+        if not feed_states:
+            break
+
+    prune_sent_urls()
     update_last_run_time()
+
+    logging.info(f"新規の記事: {new_entries} 件")
+    logging.info(f"翻訳キャッシュ: ヒット {translation_stats['hits']} 件 / ミス {translation_stats['misses']} 件")
+    logging.info(f"Slackに送信したメッセージ: {run.messages_sent} 件")
+    RUN_DURATION_SECONDS.observe(time.monotonic() - started)
+    for name, stats in run.stages.items():
+        STAGE_ITEMS.inc(stats.items_in, stage=name)
+        STAGE_BUSY_SECONDS.inc(stats.busy_seconds, stage=name)
+        logging.info(f"ステージ {name}: 入力 {stats.items_in} 件 / 出力 {stats.items_out} 件 / "
+                     f"処理時間 {stats.busy_seconds:.2f} 秒 / 待ち時間 {stats.blocked_seconds:.2f} 秒")
     logging.info("========== フィード処理終了 ==========\n")
 
 # スケジューラを設定する
 scheduler = BackgroundScheduler()
 
+@closing_db
+def process_due_feeds():
+    """スケジューラから定期的に呼び出し、取得時刻になったフィードのみを処理する"""
+    run, claimed = _claim_run('schedule')
+    if not claimed:
+        logging.info("前回のフィード処理が実行中のため、今回の定期実行はスキップします。")
+        return
+    _execute_run(run, due_only=True)
+
 def update_scheduler(interval_minutes):
-    scheduler.remove_all_jobs()
-    scheduler.add_job(process_feeds, 'interval', minutes=interval_minutes)
-    logging.info(f"スケジュールを更新しました。次回実行までの間隔: {interval_minutes} 分")
+    # 各フィードの取得間隔は更新頻度に合わせて自動で調整される。
+    # interval_minutes はまだ取得履歴のないフィードの初期間隔として使う。
+    scheduler.add_job(process_due_feeds, 'interval', minutes=FEED_SCHEDULER_TICK_MINUTES,
+                      id='process_feeds', replace_existing=True)
+    logging.info(f"スケジュールを更新しました。基準のポーリング間隔: {interval_minutes} 分")
 
 # 初期設定のスケジュールを開始
 initial_settings = get_settings()
@@ -208,18 +1663,50 @@ if initial_settings and initial_settings[2]:
     update_scheduler(initial_settings[2])
 else:
     update_scheduler(30)  # デフォルトは30分
+# 送信に失敗したメッセージを再送する
+scheduler.add_job(drain_slack_queue_job, 'interval', minutes=1, id='drain_slack_queue', replace_existing=True)
 
 scheduler.start()
 
 # Flaskアプリケーションを作成する
 app = Flask(__name__)
 
+@app.teardown_appcontext
+def close_request_db(exception=None):
+    # 開発サーバーはリクエストごとにスレッドを作成するため、リクエストの終了時に接続を閉じる
+    close_db()
+
+def _uploaded_text(field):
+    """アップロードされたファイル（なければフォームのテキスト）の内容を返す"""
+    upload = request.files.get('file')
+    if upload and upload.filename:
+        return upload.read().decode('utf-8-sig', errors='replace')
+    return request.form.get(field, '')
+
 @app.route('/')
 def index():
     settings = get_settings()
-    keywords = get_keywords()
-    rss_urls = get_rss_urls()
-    return render_template('index.html', settings=settings, keywords=keywords, rss_urls=rss_urls)
+    # キーワードとフィードは検索条件で絞り込み、1ページ分だけ表示する
+    keywords = paginate(get_keywords(), request.args.get('kw_q', '').strip(), request.args.get('kw_page', 1, type=int))
+    rss_urls = paginate(get_rss_urls(), request.args.get('feed_q', '').strip(), request.args.get('feed_page', 1, type=int))
+
+    def page_url(**changes):
+        # もう一方の一覧の検索条件・ページを保ったままリンクを作る
+        args = request.args.to_dict()
+        args.update(changes)
+        return url_for('index', **args)
+
+    return render_template('index.html', settings=settings, keywords=keywords, rss_urls=rss_urls, page_url=page_url)
+
+@app.route('/api/keywords')
+def list_keywords():
+    return jsonify(paginate(get_keywords(), request.args.get('q', '').strip(),
+                            request.args.get('page', 1, type=int), request.args.get('per_page', ADMIN_PAGE_SIZE, type=int)))
+
+@app.route('/api/rss_urls')
+def list_rss_urls():
+    return jsonify(paginate(get_rss_urls(), request.args.get('q', '').strip(),
+                            request.args.get('page', 1, type=int), request.args.get('per_page', ADMIN_PAGE_SIZE, type=int)))
 
 @app.route('/update_settings', methods=['POST'])
 def update_settings():
@@ -265,21 +1752,102 @@ def delete_rss_url_route():
     delete_rss_url(url)
     return redirect(url_for('index'))
 
-@app.route('/process_feeds')
+@app.route('/import_keywords', methods=['POST'])
+def import_keywords_route():
+    keywords = parse_keyword_list(_uploaded_text('keywords'))
+    if not keywords:
+        return 'インポートするキーワードがありません。<br><a href="/">戻る</a>', 400
+    added, removed = import_keywords(keywords, replace=bool(request.form.get('replace')))
+    logging.info(f"キーワードをインポートしました（{len(keywords)}件中 {added}件を追加、{removed}件を削除）")
+    return redirect(url_for('index'))
+
+@app.route('/export_keywords')
+def export_keywords_route():
+    return Response(''.join(f'{keyword}\n' for keyword in get_keywords()), mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=keywords.txt'})
+
+@app.route('/import_rss_urls', methods=['POST'])
+def import_rss_urls_route():
+    try:
+        urls = parse_feed_list(_uploaded_text('rss_urls'))
+    except ValueError as e:
+        return f'{e}<br><a href="/">戻る</a>', 400
+    if not urls:
+        return 'インポートするRSS URLがありません。<br><a href="/">戻る</a>', 400
+    added, removed = import_rss_urls(urls, replace=bool(request.form.get('replace')))
+    logging.info(f"RSS URLをインポートしました（{len(urls)}件中 {added}件を追加、{removed}件を削除）")
+    return redirect(url_for('index'))
+
+@app.route('/export_rss_urls')
+def export_rss_urls_route():
+    feed_format = request.args.get('format', 'csv')
+    if feed_format not in ('csv', 'opml'):
+        return jsonify({'error': 'format must be csv or opml'}), 400
+    mimetype = 'text/x-opml' if feed_format == 'opml' else 'text/csv'
+    return Response(export_feed_list(feed_format), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=feeds.{feed_format}'})
+
+@app.route('/process_feeds', methods=['GET', 'POST'])
 def process_feeds_api():
-    process_feeds()
-    return 'Feeds processed', 200
+    # 処理はバックグラウンドで実行し、進捗は /runs/<run_id> で確認する
+    run, started = start_feed_run('manual')
+    return jsonify({
+        'run_id': run.id,
+        'status': run.status,
+        'already_running': not started,
+        'status_url': url_for('run_status', run_id=run.id),
+    }), 202
+
+@app.route('/metrics')
+def metrics():
+    # 送信待ちキューの件数は他のプロセスも更新するため、出力するたびにデータベースから読み込む
+    for status, count in get_slack_queue_counts().items():
+        SLACK_QUEUE_MESSAGES.set(count, status=status)
+    # フィードごとの取得時間も保存済みの値から作り直し、削除したフィードの系列を残さない
+    FEED_FETCH_LAST_SECONDS.replace([(round(last_fetch_ms / 1000, 6), {'feed_id': feed_id}) for feed_id, last_fetch_ms in
+                                     db_query('SELECT id, last_fetch_ms FROM rss_urls WHERE last_fetch_ms IS NOT NULL')])
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/admin/storage')
+def storage_stats():
+    return jsonify(get_storage_stats())
+
+@app.route('/admin/slack_queue/requeue', methods=['POST'])
+def requeue_slack_queue():
+    return jsonify({'requeued': requeue_dead_slack_messages()})
+
+@app.route('/runs/<run_id>')
+def run_status(run_id):
+    run = get_feed_run(run_id)
+    if run is None:
+        return jsonify({'error': 'run not found'}), 404
+    return jsonify(run.to_dict())
 
 if __name__ == '__main__':
-    # テンプレートフォルダのパスを設定
-    app.template_folder = os.path.join(os.path.dirname(__file__), 'templates')
-    # 静的ファイルのパスを設定
-    app.static_folder = os.path.join(os.path.dirname(__file__), 'static')
-    # Flaskアプリを別スレッドで実行する
-    threading.Thread(target=app.run, kwargs={'use_reloader': False}).start()
+    parser = argparse.ArgumentParser(description='RSSフィードを取得してSlackに通知するボット')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='フィードを処理するプロセス数（2以上の場合は管理画面のないワーカープロセスを追加で起動する）')
+    parser.add_argument('--worker', action='store_true', help='管理画面を起動せず、フィード処理のみを行う')
+    args = parser.parse_args()
+
+    # ワーカープロセスは app.db を共有し、フィードを借用しながら分担して処理する
+    workers = []
+    if not args.worker:
+        for _ in range(args.processes - 1):
+            workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker']))
+        # テンプレートフォルダのパスを設定
+        app.template_folder = os.path.join(os.path.dirname(__file__), 'templates')
+        # 静的ファイルのパスを設定
+        app.static_folder = os.path.join(os.path.dirname(__file__), 'static')
+        # Flaskアプリを別スレッドで実行する
+        threading.Thread(target=app.run, kwargs={'use_reloader': False}, daemon=True).start()
     # メインスレッドを維持する（CPU使用率を下げるために変更）
     try:
         threading.Event().wait()
     except (KeyboardInterrupt, SystemExit):
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
         scheduler.shutdown()
-        conn.close()
\ No newline at end of file
+        close_db_connections()
\ No newline at end of file
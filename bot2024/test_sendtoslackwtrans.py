@@ -0,0 +1,384 @@
+"""
+sendtoslackwtrans.py の既読判定（dedup）・送信待ちキュー・キーワード照合のテスト
+
+フィードの取得・Slackへの送信・翻訳は差し替え、データベースはテストごとに一時ディレクトリに作成する
+実行方法: python -m pytest -q bot2024
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import pytest
+
+# インポート時にカレントディレクトリの app.db を初期化するため、一時ディレクトリで読み込む
+_import_dir = tempfile.mkdtemp(prefix='bot2024_test_')
+_cwd = os.getcwd()
+os.chdir(_import_dir)
+try:
+    import sendtoslackwtrans as bot
+finally:
+    os.chdir(_cwd)
+bot.scheduler.shutdown(wait=False)
+bot.close_db()
+
+FEED_URL = 'http://feeds.example.com/rss'
+
+
+def rss(items):
+    """(記事ID, 公開日) のリストからRSSを作成する（タイトルには常にキーワードを含める）"""
+    body = ''.join(
+        f'<item><title>python {item_id}</title><link>http://example.com/{item_id}</link>'
+        f'<guid>{item_id}</guid><description>about {item_id}</description>'
+        f'<pubDate>{published} 00:00:00 GMT</pubDate></item>'
+        for item_id, published in items)
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>t</title>{body}</channel></rss>'.encode()
+
+
+class FakeTranslator:
+    def translate_batch(self, texts):
+        return [f'訳: {text}' for text in texts]
+
+
+@pytest.fixture
+def feeds(tmp_path, monkeypatch):
+    """フィードの本文を保持する辞書を返す（キー: URL、値: 本文 または (本文, レスポンスヘッダー)）"""
+    monkeypatch.setattr(bot, 'DB_PATH', str(tmp_path / 'app.db'))
+    bot.init_db()
+    bot.invalidate_list_cache('settings', 'keywords', 'rss_urls')
+    bot.set_settings('token', 'channel', 30)
+    bot.add_keyword('python')
+    bot.add_rss_url(FEED_URL)
+
+    contents = {}
+
+    def fake_fetch_feed(url, etag=None, last_modified=None):
+        content, headers = contents[url] if isinstance(contents[url], tuple) else (contents[url], {})
+        return {'url': url, 'status': 200, 'etag': None, 'last_modified': None, 'content': content,
+                'headers': headers, 'elapsed_ms': 1.0, 'error': None}
+
+    monkeypatch.setattr(bot, 'fetch_feed', fake_fetch_feed)
+    monkeypatch.setattr(bot, 'SLACK_MIN_INTERVAL', 0)
+    bot.set_translation_backend(FakeTranslator())
+    yield contents
+    bot.set_translation_backend(None)
+    bot.close_db_connections()
+    bot.close_db()
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    """Slackに送信したメッセージの本文のリスト"""
+    messages = []
+
+    def fake_post_to_slack(data, slack_token):
+        if 'blocks' in data:
+            messages.extend(block['text']['text'] for block in data['blocks'] if block['type'] == 'section')
+        else:
+            messages.append(data['text'])
+        return True, None, None
+
+    monkeypatch.setattr(bot, '_post_to_slack', fake_post_to_slack)
+    return messages
+
+
+def posted_ids(messages):
+    return sorted(message.split('http://example.com/')[1].split()[0] for message in messages)
+
+
+def test_new_entries_are_sent_once(feeds, posted):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024')])
+    bot.process_feeds()
+    bot.process_feeds()
+    assert posted_ids(posted) == ['a', 'b']
+
+
+def test_reordered_entries_are_not_resent(feeds, posted):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024'), ('c', 'Wed, 03 Jan 2024')])
+    bot.process_feeds()
+    # 並び順だけが変わった場合は、送信済みURLを参照しなくても既読と判定される
+    feeds[FEED_URL] = rss([('c', 'Wed, 03 Jan 2024'), ('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024')])
+    bot.db_execute('DELETE FROM sent_urls')
+    bot.process_feeds()
+    assert posted_ids(posted) == ['a', 'b', 'c']
+
+
+def test_backdated_entry_is_sent(feeds, posted):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('c', 'Wed, 03 Jan 2024')])
+    bot.process_feeds()
+    # 最新の公開時刻より古い日付で追加された記事も新しい記事として送信する
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024'), ('c', 'Wed, 03 Jan 2024')])
+    bot.process_feeds()
+    bot.process_feeds()
+    assert posted_ids(posted) == ['a', 'b', 'c']
+
+
+def test_reappearing_entry_is_not_resent(feeds, posted):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024')])
+    bot.process_feeds()
+    feeds[FEED_URL] = rss([('b', 'Tue, 02 Jan 2024')])
+    bot.process_feeds()
+    # フィードから一度消えた記事が再び現れた場合は、送信済みURLと照合する
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024')])
+    bot.process_feeds()
+    assert posted_ids(posted) == ['a', 'b']
+
+
+def test_dropped_entries_do_not_advance_marks(feeds, posted, monkeypatch):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024'), ('b', 'Tue, 02 Jan 2024')])
+    enqueue = bot.enqueue_slack_messages
+
+    def locked(messages):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(bot, 'enqueue_slack_messages', locked)
+    with pytest.raises(RuntimeError, match='database is locked'):
+        bot.process_feeds()
+    # 送信待ちキューに追加できなかった記事があるため、既読の目印を保存せず、借用も解除する
+    assert bot.db_query('SELECT high_water_mark, seen_entry_ids, lease_owner FROM rss_urls') == [(None, None, None)]
+    assert posted == []
+
+    monkeypatch.setattr(bot, 'enqueue_slack_messages', enqueue)
+    bot.process_feeds()
+    assert posted_ids(posted) == ['a', 'b']
+
+
+def test_relative_links_are_resolved_against_feed_url(feeds, posted):
+    feeds[FEED_URL] = (b'<?xml version="1.0"?><rss version="2.0"><channel><title>t</title>'
+                       b'<item><title>python a</title><link>/post/a</link><guid>a</guid></item>'
+                       b'<item><title>python b</title><link>/post/b</link><guid>b</guid></item>'
+                       b'</channel></rss>')
+    bot.process_feeds()
+    # 相対リンクはフィードの URL を基準に絶対 URL にして送信・記録する
+    assert sorted(message.split('http://feeds.example.com/post/')[1].split()[0] for message in posted) == ['a', 'b']
+    assert bot.db_query('SELECT COUNT(*) FROM sent_urls') == [(2,)]
+
+
+def test_charset_from_response_headers(feeds, posted):
+    body = rss([('a', 'Mon, 01 Jan 2024')]).decode().replace('about a', '日本語の説明')
+    feeds[FEED_URL] = (body.encode('shift_jis'), {'Content-Type': 'application/rss+xml; charset=Shift_JIS'})
+    bot.process_feeds()
+    assert len(posted) == 1 and '日本語の説明' in posted[0]
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    """Slackへの送信結果を差し替える（results に (成功したか, Retry-After, エラー) を積むと順に返す）"""
+    calls = []
+    results = []
+
+    def fake_post_to_slack(data, slack_token):
+        calls.append(data['text'])
+        return results.pop(0) if results else (True, None, None)
+
+    monkeypatch.setattr(bot, '_post_to_slack', fake_post_to_slack)
+    return calls, results
+
+
+def queue_rows():
+    return bot.db_query('SELECT link, attempts, status, last_error FROM slack_queue ORDER BY id')
+
+
+def test_enqueued_messages_are_drained(feeds, slack):
+    calls, _ = slack
+    assert bot.enqueue_slack_messages([('http://example.com/a', 'a'), ('http://example.com/b', 'b')]) == 2
+    # 送信済みにマークしたURLは再び追加しない
+    assert bot.enqueue_slack_messages([('http://example.com/a', 'a')]) == 0
+    assert bot.drain_slack_queue('token', 'channel') == 2
+    assert calls == ['a', 'b']
+    assert queue_rows() == []
+
+
+def test_failed_message_is_retried_after_backoff(feeds, slack):
+    calls, results = slack
+    results.append((False, None, 'internal_error'))
+    bot.enqueue_slack_messages([('http://example.com/a', 'a')])
+    before = time.time()
+    assert bot.drain_slack_queue('token', 'channel') == 0
+    assert queue_rows() == [('http://example.com/a', 1, 'pending', 'internal_error')]
+    next_attempt_at = bot.db_query_one('SELECT next_attempt_at FROM slack_queue')[0]
+    assert before + bot.SLACK_BACKOFF_BASE <= next_attempt_at <= time.time() + bot.SLACK_BACKOFF_BASE
+    # 再送時刻までは送信しない
+    assert bot.drain_slack_queue('token', 'channel') == 0
+    assert calls == ['a']
+
+    bot.db_execute('UPDATE slack_queue SET next_attempt_at = 0')
+    assert bot.drain_slack_queue('token', 'channel') == 1
+    assert queue_rows() == []
+
+
+def test_exhausted_message_is_kept_as_dead_letter(feeds, slack):
+    calls, results = slack
+    results.extend([(False, None, 'internal_error')] * bot.SLACK_MAX_ATTEMPTS)
+    bot.enqueue_slack_messages([('http://example.com/a', 'a')])
+    for _ in range(bot.SLACK_MAX_ATTEMPTS):
+        bot.db_execute('UPDATE slack_queue SET next_attempt_at = 0')
+        bot.drain_slack_queue('token', 'channel')
+    assert queue_rows() == [('http://example.com/a', bot.SLACK_MAX_ATTEMPTS, 'dead', 'internal_error')]
+
+    # dead のメッセージは送信せず、件数を /metrics と /admin/storage で確認できる
+    bot.db_execute('UPDATE slack_queue SET next_attempt_at = 0')
+    assert bot.drain_slack_queue('token', 'channel') == 0
+    assert len(calls) == bot.SLACK_MAX_ATTEMPTS
+    client = bot.app.test_client()
+    assert 'rss_slack_queue_messages{status="dead"} 1' in client.get('/metrics').get_data(as_text=True)
+    assert client.get('/admin/storage').get_json()['slack_queue'] == {'pending': 0, 'dead': 1,
+                                                                      'last_error': 'internal_error'}
+
+    assert client.post('/admin/slack_queue/requeue').get_json() == {'requeued': 1}
+    assert bot.drain_slack_queue('token', 'channel') == 1
+    assert calls[-1] == 'a'
+
+
+def test_message_error_is_dead_lettered_immediately(feeds, slack):
+    _, results = slack
+    results.append((False, None, 'msg_too_long'))
+    bot.enqueue_slack_messages([('http://example.com/a', 'a')])
+    bot.drain_slack_queue('token', 'channel')
+    assert queue_rows() == [('http://example.com/a', 1, 'dead', 'msg_too_long')]
+
+
+def test_config_error_stops_drain_without_using_attempts(feeds, slack):
+    calls, results = slack
+    results.append((False, None, 'invalid_auth'))
+    bot.enqueue_slack_messages([('http://example.com/a', 'a'), ('http://example.com/b', 'b')])
+    assert bot.drain_slack_queue('token', 'channel') == 0
+    # 残りのメッセージは送信せず、試行回数も増やさない
+    assert calls == ['a']
+    assert queue_rows() == [('http://example.com/a', 0, 'pending', 'invalid_auth'),
+                            ('http://example.com/b', 0, 'pending', None)]
+    assert 'rss_slack_delivery_blocked 1' in bot.render_metrics()
+
+    # 設定を直すと次の送信で再開する
+    assert bot.drain_slack_queue('token', 'channel') == 2
+    assert 'rss_slack_delivery_blocked 0' in bot.render_metrics()
+
+
+def naive_match(keywords, text, ignore_case=False, word_boundary=False):
+    """KeywordMatcher と比較するための素朴な照合（キーワードごとに全ての出現位置を調べる）"""
+    def is_word_char(ch):
+        return ch.isascii() and (ch.isalnum() or ch == '_')
+
+    if ignore_case:
+        text = text.lower()
+    found = []
+    for keyword in dict.fromkeys(kw for kw in keywords if kw):
+        pattern = keyword.lower() if ignore_case else keyword
+        start = text.find(pattern)
+        while start != -1:
+            end = start + len(pattern)
+            if not word_boundary or ((start == 0 or not is_word_char(text[start - 1]))
+                                     and (end == len(text) or not is_word_char(text[end]))):
+                found.append(keyword)
+                break
+            start = text.find(pattern, start + 1)
+    return found
+
+
+def test_matcher_finds_overlapping_keywords():
+    matcher = bot.KeywordMatcher(['he', 'she', 'his', 'hers'])
+    assert matcher.match('ushers') == ['he', 'she', 'hers']
+    # 長いキーワードの途中で失敗しても、その接尾辞にあるキーワードは見つける
+    assert bot.KeywordMatcher(['abcd', 'bc']).match('abcx') == ['bc']
+    # 結果は登録順で、重複と空文字は除く
+    assert bot.KeywordMatcher(['b', '', 'a', 'b']).match('ab') == ['b', 'a']
+
+
+def test_matcher_case_folding():
+    assert bot.KeywordMatcher(['Python', 'rust']).match('PYTHON and Rust') == []
+    assert bot.KeywordMatcher(['Python', 'rust'], ignore_case=True).match('PYTHON and Rust') == ['Python', 'rust']
+
+
+def test_matcher_word_boundary():
+    matcher = bot.KeywordMatcher(['go', 'go lang', 'AI'], word_boundary=True)
+    assert matcher.match('going') == []
+    assert matcher.match('go_lang') == []
+    assert matcher.match('(go)') == ['go']
+    # 最初の出現が単語の一部でも、後の出現が単語として現れれば合致する
+    assert matcher.match('going to go') == ['go']
+    assert matcher.match('go language') == ['go']
+    # 日本語の文字は単語の区切りとみなす
+    assert matcher.match('AI技術とgoの記事') == ['go', 'AI']
+
+
+def test_matcher_japanese_text():
+    matcher = bot.KeywordMatcher(['機械学習', '学習', '深層学習'])
+    assert matcher.match('深層学習と機械学習の比較') == ['機械学習', '学習', '深層学習']
+    assert matcher.match('学校の授業') == []
+    assert bot.KeywordMatcher(['学習'], word_boundary=True).match('機械学習') == ['学習']
+
+
+def test_matcher_agrees_with_naive_matching():
+    rng = random.Random(0)
+    alphabet = 'abAB_ 学習'
+    for _ in range(500):
+        keywords = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        for ignore_case in (False, True):
+            for word_boundary in (False, True):
+                matcher = bot.KeywordMatcher(keywords, ignore_case=ignore_case, word_boundary=word_boundary)
+                assert matcher.match(text) == naive_match(keywords, text, ignore_case, word_boundary), \
+                    (keywords, text, ignore_case, word_boundary)
+
+
+class CountingTranslator:
+    """翻訳したテキストを記録する翻訳バックエンド"""
+
+    def __init__(self):
+        self.requests = []
+
+    def translate_batch(self, texts):
+        self.requests.append(list(texts))
+        return [f'訳: {text}' for text in texts]
+
+
+def test_translations_are_cached(feeds):
+    backend = CountingTranslator()
+    bot.set_translation_backend(backend)
+    stats = {'hits': 0, 'misses': 0}
+    assert bot.translate_texts(['one', 'two', 'one'], stats) == {'one': '訳: one', 'two': '訳: two'}
+    assert stats == {'hits': 0, 'misses': 2}
+    # キャッシュにないテキストだけをバックエンドに送る
+    assert bot.translate_texts(['two', 'three'], stats) == {'two': '訳: two', 'three': '訳: three'}
+    assert stats == {'hits': 1, 'misses': 3}
+    assert backend.requests == [['one', 'two'], ['three']]
+
+
+def test_translation_falls_back_to_original_text(feeds, posted, monkeypatch):
+    def broken_backend():
+        raise ImportError("No module named 'googletrans'")
+
+    monkeypatch.setattr(bot, 'get_translation_backend', broken_backend)
+    assert bot.translate_texts(['one']) == {}
+    assert bot.translate_to_japanese('one') == 'one'
+    # 翻訳できなかった結果はキャッシュしない
+    assert bot.db_query('SELECT COUNT(*) FROM translation_cache') == [(0,)]
+
+    # フィードの処理も止めずに、翻訳前の概要で送信する
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024')])
+    bot.process_feeds()
+    assert len(posted) == 1 and '*概要:* about a' in posted[0]
+
+
+def test_failed_translation_batch_is_not_cached(feeds):
+    class FailingTranslator:
+        def translate_batch(self, texts):
+            raise RuntimeError('service unavailable')
+
+    bot.set_translation_backend(FailingTranslator())
+    assert bot.translate_texts(['one']) == {}
+    bot.set_translation_backend(CountingTranslator())
+    assert bot.translate_texts(['one']) == {'one': '訳: one'}
+
+
+def test_fetch_time_metric_is_labelled_by_feed_id(feeds, posted):
+    feeds[FEED_URL] = rss([('a', 'Mon, 01 Jan 2024')])
+    bot.process_feeds()
+    feed_id = bot.db_query_one('SELECT id FROM rss_urls WHERE url = ?', (FEED_URL,))[0]
+    client = bot.app.test_client()
+    assert f'rss_feed_fetch_last_seconds{{feed_id="{feed_id}"}} 0.001' in client.get('/metrics').get_data(as_text=True)
+
+    # 削除したフィードの系列は出力しない
+    bot.delete_rss_url(FEED_URL)
+    assert 'rss_feed_fetch_last_seconds{' not in client.get('/metrics').get_data(as_text=True)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+check_google_api_key.py のベンチマーク
+
+mock_google_api.py のモックサーバーを起動し、既定のモードと --test_all_methods で
+check_google_api_key.py を別プロセスで実行して、次の値を表示する
+- 経過時間 (秒) / 1 秒あたりのプローブ数 / ピークメモリ (最大 RSS, MB)
+--json_output を指定すると、結果を JSON Lines で追記する (変更ごとのスループットの推移を追う場合)
+
+使い方:
+  python benchmark.py --apis 50 --methods 40 --latency 0.02 --repeat 3 --json_output bench.jsonl
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_google_api import add_mock_arguments, mock_from_args, serve
+
+CHECKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "check_google_api_key.py")
+BENCH_API_KEY = "AIzaBenchmarkKey"
+SCENARIOS = {
+    "default": [],
+    "test_all_methods": ["--test_all_methods"],
+}
+
+
+def max_rss_mb(rusage):
+    """wait4 の ru_maxrss を MB にする (Linux は KB、macOS は byte 単位)"""
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_checker(args, log_path):
+    """check_google_api_key.py を実行し、(終了コード, 経過時間, ピークメモリ) を返す"""
+    with open(log_path, "w", encoding="utf-8") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, CHECKER] + args, stdout=log, stderr=subprocess.STDOUT)
+        # Popen.wait() ではなく wait4 で、このプロセスだけの最大 RSS を取得する
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, elapsed, max_rss_mb(rusage)
+
+
+def run_scenario(mock, discovery_url, name, extra_args, args, work_dir):
+    """シナリオを repeat 回実行し、中央値を返す (Discovery ドキュメントのキャッシュは事前に作成しておく)"""
+    cache_dir = os.path.join(work_dir, "cache")
+    output = os.path.join(work_dir, f"{name}.json")
+    log_path = os.path.join(work_dir, f"{name}.log")
+    checker_args = [BENCH_API_KEY, "--discovery_url", discovery_url, "--cache_dir", cache_dir,
+                    "--output", output, "--concurrency", str(args.concurrency), "--rate", str(args.rate),
+                    "--limit_methods", str(args.limit_methods)] + extra_args + args.checker_args
+
+    runs = []
+    for _ in range(args.repeat):
+        mock.reset_stats()
+        returncode, elapsed, peak_mb = run_checker(checker_args, log_path)
+        if returncode != 0:
+            with open(log_path, encoding="utf-8") as f:
+                print(f.read()[-2000:])
+            raise SystemExit(f"ERROR: {name} が終了コード {returncode} で失敗しました。")
+        stats = mock.snapshot()
+        runs.append({"wall_seconds": elapsed, "probes": stats["probes"], "throttled": stats["throttled"],
+                     "peak_rss_mb": peak_mb})
+
+    wall = statistics.median(run["wall_seconds"] for run in runs)
+    probes = statistics.median(run["probes"] for run in runs)
+    return {
+        "scenario": name,
+        "wall_seconds": round(wall, 3),
+        "probes": probes,
+        "probes_per_second": round(probes / wall, 1) if wall else None,
+        "throttled": statistics.median(run["throttled"] for run in runs),
+        "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+        "runs": len(runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check_google_api_key.py のベンチマーク")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="実行するシナリオ (複数指定可。デフォルト: すべて)")
+    parser.add_argument("--repeat", type=int, default=3, help="シナリオごとの実行回数 (中央値を表示。デフォルト: 3)")
+    parser.add_argument("--concurrency", type=int, default=8, help="check_google_api_key.py の --concurrency")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="check_google_api_key.py の --rate (モックは 1 ホストなのでデフォルトは 0 (無制限))")
+    parser.add_argument("--limit_methods", type=int, default=0, help="check_google_api_key.py の --limit_methods")
+    parser.add_argument("--checker_args", nargs=argparse.REMAINDER, default=[],
+                        help="check_google_api_key.py にそのまま渡す引数 (最後に指定する)")
+    parser.add_argument("--json_output", help="結果を JSON Lines で追記するファイル")
+    parser.add_argument("--keep_work_dir", action="store_true", help="出力やログを残す (場所を表示する)")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_args(args)
+    server = serve(mock)
+    discovery_url = f"http://127.0.0.1:{server.server_address[1]}/discovery/v1/apis"
+    work_dir = tempfile.mkdtemp(prefix="gapi_bench_")
+    results = []
+    try:
+        # キャッシュを作成する (Discovery ドキュメントの取得は計測に含めない)
+        run_checker([BENCH_API_KEY, "--discovery_url", discovery_url, "--cache_dir", os.path.join(work_dir, "cache"),
+                     "--output", os.path.join(work_dir, "warmup.json"), "--rate", "0", "--limit_methods", "1"],
+                    os.path.join(work_dir, "warmup.log"))
+        for name in args.scenario or sorted(SCENARIOS):
+            results.append(run_scenario(mock, discovery_url, name, SCENARIOS[name], args, work_dir))
+    finally:
+        server.shutdown()
+        if args.keep_work_dir:
+            print(f"出力とログ: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"APIs: {args.apis} / methods: {args.methods} / latency: {args.latency}s / "
+          f"concurrency: {args.concurrency} / rate: {args.rate} / repeat: {args.repeat}")
+    print(f"{'scenario':<18}{'wall(s)':>10}{'probes':>10}{'probes/s':>12}{'429':>8}{'peak RSS(MB)':>15}")
+    for result in results:
+        print(f"{result['scenario']:<18}{result['wall_seconds']:>10.3f}{result['probes']:>10}"
+              f"{result['probes_per_second'] or 0:>12.1f}{result['throttled']:>8}{result['peak_rss_mb']:>15.1f}")
+
+    if args.json_output:
+        params = {key: getattr(args, key) for key in ("apis", "methods", "description_bytes", "latency", "jitter",
+                                                     "error_mix", "disabled_ratio", "throttle_ratio", "concurrency",
+                                                     "rate", "limit_methods", "repeat")}
+        with open(args.json_output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(dict(result, timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"), params=params,
+                                        checker_args=args.checker_args), ensure_ascii=False) + "\n")
+        print(f"結果を {args.json_output} に追記しました。")
+
+
+if __name__ == "__main__":
+    main()
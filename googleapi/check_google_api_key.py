@@ -1,30 +1,345 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+import hashlib
 import json
+import os
+import sqlite3
 import time
 import requests
 import sys
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse, parse_qs
 import re
 
-def fetch_discovery_apis():
+DISCOVERY_APIS_URL = "https://www.googleapis.com/discovery/v1/apis"
+DEFAULT_CACHE_DIR = ".discovery_cache"
+DEFAULT_CACHE_MAX_AGE = 24 * 60 * 60  # この秒数以内にキャッシュしたドキュメントは再検証せずに使う
+DEFAULT_DISCOVERY_WORKERS = 8
+PLAN_FORMAT_VERSION = 1         # プローブ計画のキャッシュの形式。変更した場合は古いキャッシュを使わない
+DEFAULT_CONCURRENCY = 8         # 同時に送信するプローブ数
+DEFAULT_RATE_PER_HOST = 10.0    # ホスト (rootUrl) ごとの 1 秒あたりのリクエスト数の上限
+DEFAULT_MAX_RETRIES = 3         # 429/503 が返った場合に再送する回数
+BACKOFF_BASE = 1.0              # Retry-After がない場合の待ち時間 (秒)。再送するごとに倍にする
+BACKOFF_MAX = 60.0              # 再送までの待ち時間の上限 (秒)
+RETRY_STATUS_CODES = (429, 503)
+STORE_BATCH_SIZE = 500          # --history_db に書き込む行数の単位 (1 トランザクション)
+REDACTED_KEY = "REDACTED"       # --keys_file の結果で API キーの代わりに記録する文字列
+RESPONSE_BODY_MODES = ("classify", "full", "truncate", "hash", "none")
+DEFAULT_MAX_RESPONSE_CHARS = 2000   # --response_body truncate / classify の場合に残す文字数
+DEFAULT_MAX_SAMPLES = 50            # --response_body classify の場合に、エラー形式でないボディを残す件数
+MAX_MESSAGE_TEMPLATE_CHARS = 200    # 分類に使うエラーメッセージの文字数
+OUTCOME_FIELDS = ("status_code", "status", "reason", "domain", "message")
+# エラーメッセージからプロジェクト番号や URL などを除き、同じ種類のエラーを 1 つの分類にまとめる
+MESSAGE_TEMPLATE_PATTERNS = (
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"\d+"), "<n>"),
+)
+SIGNAL_SCAN_CHARS = 4096            # 打ち切りの判定でレスポンスの先頭から調べる文字数
+
+# 返ってきたらキー全体・API 全体で結果が変わらないエラー (残りのメソッドを試さずに打ち切る)
+# (reason または message に含まれる文字列, 打ち切る範囲, 記録する reason)
+DEFINITIVE_SIGNALS = (
+    ("API_KEY_INVALID", "key", "API_KEY_INVALID"),
+    ("API key not valid", "key", "API_KEY_INVALID"),
+    ("API key expired", "key", "API_KEY_EXPIRED"),
+    ("API_KEY_HTTP_REFERRER_BLOCKED", "key", "API_KEY_HTTP_REFERRER_BLOCKED"),
+    ("API_KEY_IP_ADDRESS_BLOCKED", "key", "API_KEY_IP_ADDRESS_BLOCKED"),
+    ("API_KEY_ANDROID_APP_BLOCKED", "key", "API_KEY_ANDROID_APP_BLOCKED"),
+    ("API_KEY_IOS_APP_BLOCKED", "key", "API_KEY_IOS_APP_BLOCKED"),
+    ("SERVICE_DISABLED", "api", "SERVICE_DISABLED"),
+    ("accessNotConfigured", "api", "SERVICE_DISABLED"),
+    ("has not been used in project", "api", "SERVICE_DISABLED"),
+    ("API_KEY_SERVICE_BLOCKED", "api", "API_KEY_SERVICE_BLOCKED"),
+)
+
+# 履歴がないメソッドの優先度 (200/400 が返る見込み)。履歴があればその成功率を使う
+PRIOR_PARAMETERLESS_LIST = 0.6  # 必須パラメータのない GET の list
+PRIOR_PARAMETERLESS_GET = 0.5   # 必須パラメータのない GET
+PRIOR_LIST = 0.4                # 必須パラメータのある list (親リソースの ID などにダミー値を入れる)
+PRIOR_GET = 0.3                 # 必須パラメータのある GET
+PRIOR_OTHER = 0.1               # POST など
+
+
+class DiscoveryCacheMiss(Exception):
+    """オフラインモードでキャッシュにドキュメントがない場合に送出する"""
+
+
+class DiscoveryCache:
+    """
+    Discovery ドキュメントをディスクにキャッシュする
+
+    - キャッシュは URL の SHA-256 をファイル名にして cache_dir に保存する
+    - max_age 秒を過ぎたキャッシュは ETag (If-None-Match) で再検証し、304 ならそのまま使う
+    - 200 が返ってもドキュメントの revision が同じ場合はキャッシュを使い続ける
+    - offline=True の場合はネットワークに接続せず、キャッシュのみを使う
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_age=DEFAULT_CACHE_MAX_AGE, offline=False):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.offline = offline
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, url):
+        """キャッシュのエントリ {"url", "etag", "revision", "fetched_at", "document"} を返す (なければ None)"""
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def save(self, url, etag, document):
+        if not self.cache_dir:
+            return
+        entry = {
+            "url": url,
+            "etag": etag,
+            "revision": document.get("revision"),
+            "fetched_at": time.time(),
+            "document": document,
+        }
+        # 書き込み途中のファイルを他のプロセスが読まないように、一時ファイルに書いてから置き換える
+        path = self._path(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _plan_path(self, url):
+        return os.path.join(self.cache_dir, "plans", hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def load_plan(self, url):
+        """
+        URL の Discovery ドキュメントから作成したプローブ計画 ([MethodPlan]) を返す
+        max_age 秒を過ぎた場合 (オフラインを除く) やキャッシュがない場合は None
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._plan_path(url), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or entry.get("format") != PLAN_FORMAT_VERSION:
+            return None
+        if not self.offline and time.time() - entry.get("saved_at", 0) >= self.max_age:
+            return None
+        return [MethodPlan.from_list(values) for values in entry["methods"]]
+
+    def save_plan(self, url, revision, plans):
+        if not self.cache_dir:
+            return
+        path = self._plan_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": url,
+                "format": PLAN_FORMAT_VERSION,
+                "revision": revision,
+                "saved_at": time.time(),
+                "methods": [plan.to_list() for plan in plans],
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def touch(self, url, entry):
+        """再検証できたキャッシュの取得時刻を更新する"""
+        self.save(url, entry.get("etag"), entry["document"])
+
+    def get(self, url, session=None):
+        """
+        URL のドキュメントを返す (キャッシュが有効ならネットワークに接続しない)
+        取得に失敗した場合は requests.RequestException、オフラインでキャッシュがない場合は DiscoveryCacheMiss を送出する
+        """
+        entry = self.load(url)
+        if self.offline:
+            if entry is None:
+                raise DiscoveryCacheMiss(f"キャッシュにありません: {url}")
+            return entry["document"]
+        if entry is not None and time.time() - entry.get("fetched_at", 0) < self.max_age:
+            return entry["document"]
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        resp = (session or requests).get(url, headers=headers, timeout=30)
+        if resp.status_code == 304 and entry is not None:
+            self.touch(url, entry)
+            return entry["document"]
+        resp.raise_for_status()
+        document = resp.json()
+        if entry is not None and document.get("revision") and document.get("revision") == entry.get("revision"):
+            # ETag が変わっても内容の revision が同じならキャッシュを使う
+            self.touch(url, entry)
+            return entry["document"]
+        self.save(url, resp.headers.get("ETag"), document)
+        return document
+
+
+def create_session(pool_size=DEFAULT_DISCOVERY_WORKERS):
+    """スレッド間で共有するコネクションプール付きのセッションを作成する"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def fetch_discovery_apis(cache=None, session=None, discovery_url=None):
     """
     Google Discovery Service から公開されているすべての API 一覧を取得する
+    discovery_url: API 一覧の URL (デフォルト: DISCOVERY_APIS_URL。ローカルのモックサーバーを使う場合など)
     """
-    url = "https://www.googleapis.com/discovery/v1/apis"
-    resp = requests.get(url, timeout=30)
+    discovery_url = discovery_url or DISCOVERY_APIS_URL
+    if cache is not None:
+        return cache.get(discovery_url, session).get("items", [])
+    resp = requests.get(discovery_url, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     return data.get("items", [])
 
-def fetch_discovery_document(discovery_rest_url):
+def fetch_discovery_document(discovery_rest_url, cache=None, session=None):
     """
     ある API の Discovery ドキュメント(JSON)を取得する
     """
+    if cache is not None:
+        return cache.get(discovery_rest_url, session)
     resp = requests.get(discovery_rest_url, timeout=30)
     resp.raise_for_status()
     return resp.json()
 
+def ordered_map(executor, func, items, window):
+    """
+    items を executor で並列に func で処理し、items の順に結果を返す
+    結果が溜まりすぎないように、先読みするのは window 件までにする
+    """
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            break
+    while pending:
+        future = pending.popleft()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            break
+        yield future.result()
+
+def load_method_plans(discovery_rest_url, cache=None, session=None):
+    """
+    API のプローブ計画 ([MethodPlan]) を返す
+    キャッシュに計画があれば Discovery ドキュメントは読み込まない
+    """
+    if cache is not None:
+        plans = cache.load_plan(discovery_rest_url)
+        if plans is not None:
+            return plans
+    discovery_doc = fetch_discovery_document(discovery_rest_url, cache, session)
+    plans = compile_method_plans(discovery_doc)
+    if cache is not None:
+        cache.save_plan(discovery_rest_url, discovery_doc.get("revision"), plans)
+    return plans
+
+def fetch_method_plans(api_items, cache=None, session=None, workers=DEFAULT_DISCOVERY_WORKERS):
+    """
+    複数の API のプローブ計画を並列に用意し、api_items の順に (api_item, [MethodPlan], error) を返す
+    """
+    def fetch(api_item):
+        try:
+            return api_item, load_method_plans(api_item.get("discoveryRestUrl"), cache, session), None
+        except (requests.RequestException, ValueError, DiscoveryCacheMiss) as e:
+            return api_item, None, e
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from ordered_map(executor, fetch, api_items, workers * 2)
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限
+    rate が 0 以下の場合は制限しない (pause() による一時停止のみ行う)
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを 1 つ取得する (なければ補充されるまで待つ)"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """429/503 が返った場合に、seconds 秒の間すべてのリクエストを止める"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # 停止中に溜まったトークンで再開直後にまとめて送信しないようにする
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+class HostRateLimiter:
+    """ホスト (rootUrl) ごとにトークンバケットを持つレート制限"""
+
+    def __init__(self, rate=DEFAULT_RATE_PER_HOST):
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate)
+            return bucket
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    def backoff(self, url, seconds):
+        self.bucket(url).pause(seconds)
+
+
+def retry_delay(resp, attempt):
+    """Retry-After ヘッダ (秒) があればそれを、なければ指数バックオフの待ち時間を返す"""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+
 def extract_all_methods(discovery_doc):
     """
     Discovery ドキュメントから全てのメソッドを抽出する
@@ -54,13 +369,52 @@ def extract_all_methods(discovery_doc):
 
     return methods
 
-def build_test_request_url(discovery_doc, method_info, api_key):
+def method_id(method_info):
+    """--resume でメソッドを識別するための ID (Discovery の id、なければ HTTP メソッドとパス)"""
+    return method_info.get("id") or f"{method_info.get('httpMethod')} {method_info.get('path')}"
+
+
+class MethodPlan:
     """
-    メソッド情報(httpMethod, path など)を使ってテスト用のURLを構築する
-    - path に必須パラメータがある場合はダミー値を入れる
-    - query パラメータに key=API_KEY を付与
+    1 メソッド分のプローブ計画
+
+    URL は "key=" の直前まで組み立てておき、プローブ時は API キーを連結するだけにする
+    (urljoin や re.sub、送信パラメータの記録のための URL の再解析をプローブごとに行わない)
+    to_list() / from_list() でディスクに保存し、実行やキーをまたいで使い回せる
     """
 
+    __slots__ = ("method_id", "http_method", "url_prefix", "query", "required_params")
+
+    def __init__(self, method_id, http_method, url_prefix, query=None, required_params=()):
+        self.method_id = method_id
+        self.http_method = http_method
+        self.url_prefix = url_prefix            # 例: "https://example.googleapis.com/v1/files/test?key="
+        self.query = query or {}                # key 以外のクエリパラメータ
+        self.required_params = required_params  # 必須パラメータ名 (パスパラメータはダミー値を入れる)
+
+    def request_url(self, api_key):
+        if self.url_prefix is None:
+            return None
+        return self.url_prefix + api_key
+
+    def request_params(self, api_key):
+        """記録用の送信パラメータ"""
+        if self.http_method == "GET":
+            return {"query": dict(self.query, key=[api_key])}
+        if self.http_method == "POST":
+            return {"json": {}}
+        return None
+
+    def to_list(self):
+        return [self.method_id, self.http_method, self.url_prefix, self.query, list(self.required_params)]
+
+    @classmethod
+    def from_list(cls, values):
+        method_id, http_method, url_prefix, query, required_params = values
+        return cls(method_id, http_method, url_prefix, query, tuple(required_params))
+
+def service_base_url(discovery_doc):
+    """メソッドの path を結合する基準の URL (取得できない場合は None)"""
     base_url = discovery_doc.get("rootUrl")
     service_path = discovery_doc.get("servicePath")
 
@@ -69,25 +423,54 @@ def build_test_request_url(discovery_doc, method_info, api_key):
         base_url = discovery_doc.get("baseUrl")
         if not base_url:
             return None  # 取得不可の場合
+    return urljoin(base_url, service_path)
 
-    # 例: path = "files/{fileId}"
-    path = method_info["path"]
-    # {xxx} 形式のパスパラメータをダミー値に置換
-    path_replaced = re.sub(r"\{[^}]+\}", "test", path)
+def compile_method_plan(method_info, base_url):
+    """
+    メソッド情報(httpMethod, path など)からプローブ計画を作成する
+    - path に必須パラメータがある場合はダミー値を入れる
+    - query パラメータの key=API_KEY はプローブ時に付与する
+    """
+    url_prefix = None
+    query = {}
+    if base_url:
+        # 例: path = "files/{fileId}"
+        # {xxx} 形式のパスパラメータをダミー値に置換
+        path_replaced = re.sub(r"\{[^}]+\}", "test", method_info["path"])
+        # URL を結合
+        combined_path = urljoin(base_url, path_replaced)
+        url_prefix = combined_path + ("&key=" if "?" in combined_path else "?key=")
+        query = parse_qs(urlparse(combined_path).query)
+    required_params = tuple(name for name, param in (method_info.get("parameters") or {}).items()
+                            if param.get("required"))
+    return MethodPlan(method_id(method_info), method_info.get("httpMethod"), url_prefix, query, required_params)
 
-    # URL を結合
-    combined_path = urljoin(urljoin(base_url, service_path), path_replaced)
+def compile_method_plans(discovery_doc):
+    """Discovery ドキュメントの全メソッドのプローブ計画を作成する"""
+    base_url = service_base_url(discovery_doc)
+    return [compile_method_plan(method_info, base_url) for method_info in extract_all_methods(discovery_doc)]
 
-    # key=API_KEY をクエリに付与
-    if "?" in combined_path:
-        test_url = f"{combined_path}&key={api_key}"
-    else:
-        test_url = f"{combined_path}?key={api_key}"
-    return test_url
+def build_test_request_url(discovery_doc, method_info, api_key):
+    """
+    メソッド情報(httpMethod, path など)を使ってテスト用のURLを構築する
+    - path に必須パラメータがある場合はダミー値を入れる
+    - query パラメータに key=API_KEY を付与
+    """
+    return compile_method_plan(method_info, service_base_url(discovery_doc)).request_url(api_key)
 
-def test_method(api_key, discovery_doc, method_info):
+def test_method(api_key, discovery_doc, method_info, session=None, limiter=None, max_retries=0):
     """
     実際に API キーを使ってリクエストを投げ、ステータスコードやレスポンスを返す
+    (戻り値は probe_method() と同じ)
+    """
+    plan = compile_method_plan(method_info, service_base_url(discovery_doc))
+    return probe_method(api_key, plan, session, limiter, max_retries)
+
+def probe_method(api_key, plan, session=None, limiter=None, max_retries=0):
+    """
+    プローブ計画 (MethodPlan) に API キーを入れてリクエストを投げ、ステータスコードやレスポンスを返す
+    limiter (HostRateLimiter) を指定した場合は、送信前にホストごとのレート制限を待ち、
+    429/503 が返った場合はホスト全体を止めてから max_retries 回まで再送する
 
     戻り値 (dict):
       {
@@ -97,11 +480,12 @@ def test_method(api_key, discovery_doc, method_info):
         "response_text": str,  # レスポンスボディ (text)
         "http_method": str,    # 実行したHTTPメソッド (GET/POST/...)
         "request_params": dict or None, # 実際に送信したパラメータ
+        "signal": str or None,  # キー全体・API 全体に当てはまるエラーの場合は "key:REASON" / "api:REASON"
       }
     """
 
-    method = method_info["httpMethod"]
-    url = build_test_request_url(discovery_doc, method_info, api_key)
+    method = plan.http_method
+    url = plan.request_url(api_key)
 
     if not url:
         return {
@@ -110,26 +494,23 @@ def test_method(api_key, discovery_doc, method_info):
             "request_url": None,
             "response_text": None,
             "http_method": method,
-            "request_params": None
+            "request_params": None,
+            "signal": None
         }
 
     # 送信パラメータを格納する変数
     request_params = None
+    http = session or requests
 
     # 実際のHTTPリクエスト
     try:
         if method == "GET":
-            parsed_url = urlparse(url)
-            query_dict = parse_qs(parsed_url.query)  # {"key": ["YOUR_API_KEY"], ...}
-            request_params = {"query": query_dict}
-
-            resp = requests.get(url, timeout=10)
+            request_params = plan.request_params(api_key)  # {"query": {"key": ["YOUR_API_KEY"], ...}}
+            send = lambda: http.get(url, timeout=10)
 
         elif method == "POST":
-            payload = {}
-            request_params = {"json": payload}
-            resp = requests.post(url, json=payload, timeout=10)
-
+            request_params = plan.request_params(api_key)
+            send = lambda: http.post(url, json=request_params["json"], timeout=10)
         else:
             # 他のメソッド (PUT, DELETE, PATCH...) は必要に応じて追加
             return {
@@ -138,8 +519,20 @@ def test_method(api_key, discovery_doc, method_info):
                 "request_url": url,
                 "response_text": f"Not tested (unsupported method: {method})",
                 "http_method": method,
-                "request_params": None
+                "request_params": None,
+                "signal": None
             }
+
+        for attempt in range(max_retries + 1):
+            if limiter is not None:
+                limiter.acquire(url)
+            resp = send()
+            if resp.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                break
+            if limiter is not None:
+                limiter.backoff(url, retry_delay(resp, attempt))
+            else:
+                time.sleep(retry_delay(resp, attempt))
     except requests.RequestException as e:
         return {
             "ok": False,
@@ -147,11 +540,14 @@ def test_method(api_key, discovery_doc, method_info):
             "request_url": url,
             "response_text": f"Request error: {e}",
             "http_method": method,
-            "request_params": request_params
+            "request_params": request_params,
+            "signal": None
         }
 
     status_code = resp.status_code
-    ok = (status_code == 200 or status_code == 400)
+    signal = detect_definitive_signal(status_code, resp.text)
+    # "API key not valid" などの 400 はキーが受け付けられていないので、利用可能とはみなさない
+    ok = (status_code == 200 or status_code == 400) and signal is None
 
     return {
         "ok": ok,
@@ -159,32 +555,944 @@ def test_method(api_key, discovery_doc, method_info):
         "request_url": url,
         "response_text": resp.text,
         "http_method": method,
-        "request_params": request_params
+        "request_params": request_params,
+        "signal": signal
     }
 
+def detect_definitive_signal(status_code, response_text):
+    """
+    キー全体・API 全体に当てはまるエラーなら "key:REASON" / "api:REASON" を返す (それ以外は None)
+    例: "API key not valid" (キーが無効) / "API has not been used in project" (プロジェクトで API が無効)
+    """
+    if status_code not in (400, 401, 403) or not response_text:
+        return None
+    head = response_text[:SIGNAL_SCAN_CHARS]
+    for marker, scope, reason in DEFINITIVE_SIGNALS:
+        if marker in head:
+            return f"{scope}:{reason}"
+    return None
+
+def probe_signature(http_method, url):
+    """履歴と照合するためのメソッドの識別子 (ホストとクエリ文字列を除いたパス)"""
+    return http_method, urlparse(url).path
+
+class ProbePrioritizer:
+    """
+    既定のモード (最初に 200/400 が返ったら打ち切り) で、見込みの高いメソッドから試すように並べ替える
+    - 過去の結果ファイルがあれば、同じメソッドの成功率 (200/400 が返った割合) の高い順
+    - 履歴がなければ、必須パラメータのない GET (特に list) → 必須パラメータのある list/GET → その他 の順
+    - 同じ優先度の場合は Discovery ドキュメントの順
+    """
+
+    def __init__(self, history=None):
+        self.history = history or {}    # probe_signature -> [成功数, 試行数]
+
+    @classmethod
+    def from_files(cls, paths):
+        """過去の結果ファイル (JSON / JSON Lines、--keys_file の結果も可) から履歴を読み込む"""
+        prioritizer = cls()
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                if path.endswith(".jsonl"):
+                    records = [json.loads(line) for line in f if line.strip()]
+                else:
+                    records = json.load(f)
+            for record in records:
+                prioritizer.add_record(record)
+        return prioritizer
+
+    def add(self, http_method, url, ok):
+        if not http_method or not url:
+            return
+        counts = self.history.setdefault(probe_signature(http_method, url), [0, 0])
+        counts[0] += 1 if ok else 0
+        counts[1] += 1
+
+    def add_record(self, record):
+        if record.get("type") == "key":
+            for result in record.get("results") or []:
+                self.add_record(result)
+        elif "methods" in record:
+            # --test_all_methods の結果
+            for method_result in record["methods"]:
+                self.add(method_result.get("http_method"), method_result.get("request_url"), method_result.get("ok"))
+        elif record.get("type") == "method":
+            self.add(record.get("http_method"), record.get("request_url"), record.get("ok"))
+        elif record.get("request_url") and record.get("usable", True):
+            # 既定のモードの結果 (最初に 200/400 が返ったメソッドのみ)
+            self.add(record.get("http_method"), record.get("request_url"), True)
+
+    def score(self, plan):
+        if plan.url_prefix is not None:
+            counts = self.history.get(probe_signature(plan.http_method, plan.url_prefix))
+            if counts:
+                # 試行数の少ないメソッドが 1 回の結果で極端な値にならないようにならす
+                return (counts[0] + 1) / (counts[1] + 2)
+        is_list = plan.method_id.endswith(".list")
+        if plan.http_method != "GET":
+            return PRIOR_OTHER
+        if not plan.required_params:
+            return PRIOR_PARAMETERLESS_LIST if is_list else PRIOR_PARAMETERLESS_GET
+        return PRIOR_LIST if is_list else PRIOR_GET
+
+    def order(self, plans):
+        """plans を見込みの高い順に並べ替えたリストを返す"""
+        return sorted(plans, key=self.score, reverse=True)
+
+def shape_response_text(text, mode="full", max_chars=DEFAULT_MAX_RESPONSE_CHARS):
+    """
+    記録するレスポンスボディを mode に応じて整形する
+    - full: そのまま / truncate: 先頭 max_chars 文字 / hash: SHA-256 / none: 記録しない
+    """
+    if text is None or mode == "full":
+        return text
+    if mode == "truncate":
+        if len(text) <= max_chars:
+            return text
+        return f"{text[:max_chars]}...(truncated {len(text) - max_chars} chars)"
+    if mode == "hash":
+        return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return None
+
+def message_template(message):
+    """エラーメッセージの数値や URL を <n> / <url> に置き換える"""
+    if not isinstance(message, str):
+        return None
+    for pattern, placeholder in MESSAGE_TEMPLATE_PATTERNS:
+        message = pattern.sub(placeholder, message)
+    return message[:MAX_MESSAGE_TEMPLATE_CHARS]
+
+def parse_error_envelope(response_text):
+    """
+    Google のエラー形式のボディから (status, reason, domain, message のテンプレート) を取り出す
+    エラー形式でない場合は None
+    - reason / domain は details の ErrorInfo (例: API_KEY_INVALID) を優先し、なければ errors[0] のもの
+    """
+    if not response_text or not response_text.lstrip().startswith("{"):
+        return None
+    try:
+        body = json.loads(response_text)
+    except ValueError:
+        return None
+    error = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error, str):
+        # OAuth の形式: {"error": "invalid_request", "error_description": "..."}
+        return error, None, None, message_template(body.get("error_description"))
+    if not isinstance(error, dict):
+        return None
+    reason = domain = None
+    for detail in error.get("details") or []:
+        if isinstance(detail, dict) and detail.get("reason"):
+            reason, domain = detail.get("reason"), detail.get("domain")
+            break
+    else:
+        errors = error.get("errors") or []
+        if errors and isinstance(errors[0], dict):
+            reason, domain = errors[0].get("reason"), errors[0].get("domain")
+    return error.get("status"), reason, domain, message_template(error.get("message"))
+
+def outcome_key(outcome):
+    return tuple(outcome.get(field) for field in OUTCOME_FIELDS)
+
+def summarize_outcomes(counts):
+    """outcome_key ごとの件数から、API ごとの分類の一覧 (件数の多い順) を作成する"""
+    return [dict(zip(OUTCOME_FIELDS, key), count=count) for key, count in counts.most_common()]
+
+class ResponseClassifier:
+    """
+    レスポンスを Google のエラー形式 (ステータスコード, status, reason, domain, message) で分類する
+
+    同じ分類には同じ dict を返すので、メソッドごとにほぼ同じエラーの JSON を持たなくてよい
+    エラー形式でないボディ (200 のデータ、HTML など) は sample() で、最初の max_samples 件
+    (同じボディは 1 件と数える) だけ先頭 max_chars 文字を残し、それ以降は SHA-256 のみを残す
+    """
+
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES, max_chars=DEFAULT_MAX_RESPONSE_CHARS):
+        self.max_samples = max_samples
+        self.max_chars = max_chars
+        self._outcomes = {}
+        self._sampled = set()
+        self._lock = threading.Lock()
+
+    def classify(self, status_code, response_text):
+        """(分類, エラー形式でないボディなら True) を返す"""
+        fields = parse_error_envelope(response_text)
+        unusual = fields is None
+        key = (status_code,) + (fields or (None, None, None, None))
+        outcome = self._outcomes.get(key)
+        if outcome is None:
+            outcome = self._outcomes.setdefault(key, dict(zip(OUTCOME_FIELDS, key)))
+        return outcome, unusual
+
+    def sample(self, response_text):
+        """エラー形式でないボディの、記録する内容 (先頭の一部 または SHA-256)"""
+        if not response_text:
+            return response_text
+        digest = shape_response_text(response_text, "hash")
+        with self._lock:
+            if digest in self._sampled or len(self._sampled) >= self.max_samples:
+                return digest
+            self._sampled.add(digest)
+        return shape_response_text(response_text, "truncate", self.max_chars)
+
+class ResultStream:
+    """
+    結果を 1 行 1 レコードの JSON Lines で逐次書き出す (中断した場合のチェックポイントを兼ねる)
+
+    レコードの種類 (type):
+      - "method": --test_all_methods の場合のメソッドごとの結果
+      - "api": API の検証が終わったことを表す (既定のモードでは最初に 200/400 が返ったメソッドの結果を含む)
+      - "key": --keys_file の場合のキーごとの結果
+    resume=True の場合は既存のレコードを読み込み、記録済みのものを done に入れてから追記する
+    store を指定した場合は、書き出したレコードを ScanStore にも記録する
+    (resume=True の場合は読み込んだレコードも記録し直す。中断前に ScanStore に書き込まれなかった行を補う)
+    """
+
+    def __init__(self, path, resume=False, store=None):
+        self.path = path
+        self.store = store
+        self.done = set()
+        self.usable_apis = set()    # 1 つでも 200/400 が返ったメソッドがある (name, version)
+        self.key_records = []       # 記録済みのキーごとの (key_fingerprint, usable_apis)
+        self.outcomes = {}          # (name, version) -> メソッドの結果の分類ごとの件数
+        if resume and os.path.exists(path):
+            self._load()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    @staticmethod
+    def record_id(record):
+        if record.get("type") == "key":
+            return "key", record["key_fingerprint"]
+        if record.get("type") == "method":
+            return "method", record["name"], record["version"], record["method_id"]
+        return "api", record["name"], record["version"]
+
+    def _remember(self, record):
+        self.done.add(self.record_id(record))
+        if record.get("type") == "key":
+            self.key_records.append((record["key_fingerprint"], set(record["usable_apis"])))
+            return
+        if record.get("ok") or (record.get("type") == "api" and record.get("usable")):
+            self.usable_apis.add((record["name"], record["version"]))
+        if record.get("type") == "method" and record.get("outcome"):
+            counts = self.outcomes.setdefault((record["name"], record["version"]), Counter())
+            counts[outcome_key(record["outcome"])] += 1
+
+    def outcome_summary(self, name, version):
+        """API ごとの、メソッドの結果の分類の一覧"""
+        return summarize_outcomes(self.outcomes.get((name, version), Counter()))
+
+    def _load(self):
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._remember(record)
+                except (ValueError, KeyError):
+                    break   # 書き込み途中で中断した行以降は捨てる
+                valid_size += len(line)
+                if self.store is not None:
+                    # 記録済みの行は results の一意キーで無視される
+                    self.store.add_record(record)
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_size)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self._remember(record)
+        if self.store is not None:
+            self.store.add_record(record)
+
+    def close(self):
+        self.file.close()
+        if self.store is not None:
+            self.store.flush()
+
+    def records(self):
+        """記録したレコードを先頭から順に返す"""
+        self.file.flush()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+def write_json_result(stream, output_file, test_all_methods=False):
+    """
+    JSON Lines の結果を従来の JSON 形式 (1 つの配列) に変換して保存し、件数を返す
+    - 既定のモード: 利用可能性ありの API ごとに、最初に 200/400 が返ったメソッドの結果
+    - --test_all_methods: API ごとに全メソッドの結果
+    """
+    result = []
+    if test_all_methods:
+        apis = {}
+        for record in stream.records():
+            if record.get("type") != "method":
+                continue
+            api_id = (record["name"], record["version"])
+            if api_id not in apis:
+                apis[api_id] = {"name": record["name"], "version": record["version"],
+                                "discovery_url": record["discovery_url"], "usable": False, "methods": []}
+                result.append(apis[api_id])
+            apis[api_id]["usable"] = apis[api_id]["usable"] or record["ok"]
+            apis[api_id]["methods"].append({k: record.get(k) for k in
+                                            ("method_id", "http_method", "request_url", "status_code", "outcome",
+                                             "response_text", "request_params", "ok")})
+        for (name, version), api in apis.items():
+            api["outcomes"] = stream.outcome_summary(name, version)
+    else:
+        for record in stream.records():
+            if record.get("type") == "api" and record.get("usable"):
+                result.append({k: v for k, v in record.items() if k not in ("type", "usable")})
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return len(result)
+
+
+SCAN_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    mode TEXT NOT NULL,
+    output TEXT,
+    options TEXT
+);
+CREATE TABLE IF NOT EXISTS run_keys (
+    run_id INTEGER NOT NULL,
+    key_fingerprint TEXT NOT NULL,
+    signal TEXT,
+    PRIMARY KEY (run_id, key_fingerprint)
+);
+CREATE TABLE IF NOT EXISTS run_apis (
+    run_id INTEGER NOT NULL,
+    api_name TEXT NOT NULL,
+    api_version TEXT NOT NULL,
+    PRIMARY KEY (run_id, api_name, api_version)
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    key_fingerprint TEXT NOT NULL,
+    api_name TEXT NOT NULL,
+    api_version TEXT NOT NULL,
+    method_id TEXT,
+    http_method TEXT,
+    usable INTEGER NOT NULL,
+    status_code INTEGER,
+    status TEXT,
+    reason TEXT,
+    signal TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_key ON results(key_fingerprint, api_name, api_version);
+CREATE INDEX IF NOT EXISTS idx_results_api ON results(api_name, api_version, usable);
+CREATE INDEX IF NOT EXISTS idx_results_status ON results(status_code, reason);
+CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id, usable);
+"""
+# 再開時に同じ結果を記録し直しても重複しないようにする一意キー (既定のモードの API ごとの行は method_id が NULL)
+RESULTS_UNIQUE_INDEX = ("CREATE UNIQUE INDEX IF NOT EXISTS idx_results_unique "
+                        "ON results(run_id, key_fingerprint, api_name, api_version, COALESCE(method_id, ''))")
+
+def now_text():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+class ScanStore:
+    """
+    スキャン結果の履歴 (SQLite)
+
+    - runs: 実行ごとの情報 / run_keys, run_apis: その実行で検証したキー・API
+    - results: キー × API (--test_all_methods の場合はキー × メソッド) ごとの結果
+    キーは key_fingerprint のみを記録し、キーそのものや key= を含む URL は記録しない
+    行は batch_size 件ずつ 1 トランザクションでまとめて書き込む
+    (実行・キー・API・メソッドが同じ行は INSERT OR IGNORE で 1 行にする)
+    """
+
+    def __init__(self, path, batch_size=STORE_BATCH_SIZE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCAN_STORE_SCHEMA)
+        self._create_unique_index()
+        self.batch_size = batch_size
+        self.run_id = None
+        self.key_fingerprint = None     # 1 キーの場合のキー (レコードにキーが含まれないため)
+        self.pending = []
+        self.pending_keys = {}
+
+    def _create_unique_index(self):
+        """
+        results の一意キーを作成する
+        一意キーのない古いファイルは、先に全ての列が同じ行 (再開で記録し直した行) を 1 行にする
+        以前の --keys_file --test_all_methods の行は method_id がないため、残った重複は削除せずに
+        method_id を "unknown:<rowid>" にして区別する
+        """
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_results_unique'"
+                             ).fetchone():
+            return
+        with self.conn:
+            self.conn.execute("DELETE FROM results WHERE rowid NOT IN (SELECT MIN(rowid) FROM results GROUP BY "
+                              "run_id, key_fingerprint, api_name, api_version, method_id, http_method, usable, "
+                              "status_code, status, reason, signal)")
+            self.conn.execute("""
+                UPDATE results SET method_id = 'unknown:' || rowid
+                WHERE method_id IS NULL AND (run_id, key_fingerprint, api_name, api_version) IN (
+                    SELECT run_id, key_fingerprint, api_name, api_version FROM results WHERE method_id IS NULL
+                    GROUP BY run_id, key_fingerprint, api_name, api_version HAVING COUNT(*) > 1)""")
+            self.conn.execute(RESULTS_UNIQUE_INDEX)
+
+    def start_run(self, mode, output, options, resume=False):
+        """
+        実行を開始して run_id を返す
+        resume=True の場合は、同じ output で終わっていない最後の実行を続ける
+        """
+        if resume:
+            row = self.conn.execute("SELECT id FROM runs WHERE output = ? AND finished_at IS NULL "
+                                    "ORDER BY id DESC LIMIT 1", (output,)).fetchone()
+            if row is not None:
+                self.run_id = row[0]
+                return self.run_id
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO runs (started_at, mode, output, options) VALUES (?, ?, ?, ?)",
+                                    (now_text(), mode, output, json.dumps(options, ensure_ascii=False)))
+        self.run_id = cur.lastrowid
+        return self.run_id
+
+    def add_scope(self, key_fingerprints, apis):
+        """この実行で検証するキーと API ((name, version)) を記録する (結果がない組み合わせは利用不可とみなす)"""
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO run_keys (run_id, key_fingerprint) VALUES (?, ?)",
+                                  [(self.run_id, fingerprint) for fingerprint in key_fingerprints])
+            self.conn.executemany("INSERT OR IGNORE INTO run_apis (run_id, api_name, api_version) VALUES (?, ?, ?)",
+                                  [(self.run_id, name, version) for name, version in apis])
+
+    def _add_result(self, key_fingerprint, name, version, result, usable):
+        outcome = result.get("outcome") or {}
+        self.pending.append((self.run_id, key_fingerprint, name, version, result.get("method_id"),
+                             result.get("http_method"), 1 if usable else 0, result.get("status_code"),
+                             outcome.get("status"), outcome.get("reason"), result.get("signal")))
+
+    def add_record(self, record):
+        """ResultStream のレコードを results の行にする"""
+        kind = record.get("type")
+        if kind == "key":
+            fingerprint = record["key_fingerprint"]
+            self.pending_keys[fingerprint] = record.get("signal")
+            for result in record["results"]:
+                if "methods" in result:
+                    for method_result in result["methods"]:
+                        self._add_result(fingerprint, result["name"], result["version"], method_result,
+                                         method_result["ok"])
+                else:
+                    # 既定のモードでは利用可能性ありの API のみが記録されている
+                    self._add_result(fingerprint, result["name"], result["version"], result, True)
+        elif kind == "method":
+            self._add_result(self.key_fingerprint, record["name"], record["version"], record, record["ok"])
+        elif kind == "api" and "methods" not in record and ("request_url" in record or "signal" in record):
+            # 既定のモードの API ごとの結果 (--test_all_methods の場合はメソッドごとの行がある)
+            self._add_result(self.key_fingerprint, record["name"], record["version"], record, record["usable"])
+            if (record.get("signal") or "").startswith("key:"):
+                self.pending_keys[self.key_fingerprint] = record["signal"]
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending and not self.pending_keys:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO results (run_id, key_fingerprint, api_name, api_version, "
+                                  "method_id, http_method, usable, status_code, status, reason, signal) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+            self.conn.executemany("INSERT OR REPLACE INTO run_keys (run_id, key_fingerprint, signal) VALUES (?, ?, ?)",
+                                  [(self.run_id, fingerprint, signal)
+                                   for fingerprint, signal in self.pending_keys.items()])
+        self.pending = []
+        self.pending_keys = {}
+
+    def finish_run(self):
+        self.flush()
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (now_text(), self.run_id))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    # ---- 照会 ----
+
+    def runs(self, limit=20):
+        return self.conn.execute("""
+            SELECT r.id, r.started_at, r.finished_at, r.mode,
+                   (SELECT COUNT(*) FROM run_keys k WHERE k.run_id = r.id),
+                   (SELECT COUNT(*) FROM run_apis a WHERE a.run_id = r.id),
+                   (SELECT COUNT(*) FROM (SELECT DISTINCT key_fingerprint, api_name, api_version FROM results
+                                          WHERE run_id = r.id AND usable = 1))
+            FROM runs r ORDER BY r.id DESC LIMIT ?""", (limit,)).fetchall()
+
+    def query(self, key_fingerprint=None, api_name=None, api_version=None, status_code=None, reason=None,
+              usable=None, run_id=None, limit=100):
+        conditions, params = [], []
+        for column, value in (("key_fingerprint", key_fingerprint), ("api_name", api_name),
+                              ("api_version", api_version), ("status_code", status_code), ("reason", reason),
+                              ("run_id", run_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if usable is not None:
+            conditions.append("usable = ?")
+            params.append(1 if usable else 0)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.conn.execute(f"""
+            SELECT run_id, key_fingerprint, api_name, api_version, method_id, usable, status_code, reason, signal
+            FROM results {where} ORDER BY run_id DESC, key_fingerprint, api_name, api_version LIMIT ?""",
+                                 params + [limit]).fetchall()
+
+    def latest_run_ids(self, before=None):
+        """終わった実行の ID を新しい順に返す (before を指定した場合はその日時より前に開始したもののみ)"""
+        if before is None:
+            rows = self.conn.execute("SELECT id FROM runs WHERE finished_at IS NOT NULL ORDER BY id DESC")
+        else:
+            rows = self.conn.execute("SELECT id FROM runs WHERE finished_at IS NOT NULL AND started_at < ? "
+                                     "ORDER BY id DESC", (before,))
+        return [row[0] for row in rows]
+
+    def diff(self, from_run, to_run):
+        """
+        2 つの実行で、両方で検証したキーと API について (利用可能になったもの, 利用できなくなったもの) を返す
+        それぞれ [(key_fingerprint, api_name, api_version)]
+        """
+        def usable(run_id):
+            return set(self.conn.execute("SELECT DISTINCT key_fingerprint, api_name, api_version FROM results "
+                                         "WHERE run_id = ? AND usable = 1", (run_id,)))
+
+        def scope(run_id):
+            keys = {row[0] for row in self.conn.execute("SELECT key_fingerprint FROM run_keys WHERE run_id = ?",
+                                                        (run_id,))}
+            apis = set(self.conn.execute("SELECT api_name, api_version FROM run_apis WHERE run_id = ?", (run_id,)))
+            return keys, apis
+
+        from_keys, from_apis = scope(from_run)
+        to_keys, to_apis = scope(to_run)
+        keys, apis = from_keys & to_keys, from_apis & to_apis
+        before = {row for row in usable(from_run) if row[0] in keys and row[1:] in apis}
+        after = {row for row in usable(to_run) if row[0] in keys and row[1:] in apis}
+        return sorted(after - before), sorted(before - after)
+
+
+class ProbeEngine:
+    """
+    スレッドプールでプローブを並列に実行する
+    - 同時に送信するのは concurrency 件まで
+    - ホスト (rootUrl) ごとに rate 件/秒のトークンバケットでレートを制限する
+    - 429/503 が返った場合はそのホストへの送信を止めて再送する
+    - レスポンスは ResponseClassifier で分類して結果の outcome に入れる
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE_PER_HOST, max_retries=DEFAULT_MAX_RETRIES,
+                 session=None, response_body="classify", max_response_chars=DEFAULT_MAX_RESPONSE_CHARS,
+                 max_samples=DEFAULT_MAX_SAMPLES):
+        self.concurrency = max(1, concurrency)
+        self.limiter = HostRateLimiter(rate)
+        self.max_retries = max_retries
+        self.session = session or create_session(self.concurrency)
+        self.response_body = response_body
+        self.max_response_chars = max_response_chars
+        self.classifier = ResponseClassifier(max_samples, max_response_chars)
+
+    def probe(self, api_key, plan):
+        result = probe_method(api_key, plan, session=self.session, limiter=self.limiter, max_retries=self.max_retries)
+        result["outcome"], unusual = self.classifier.classify(result["status_code"], result["response_text"])
+        # 大きなレスポンスをメモリや出力に溜め込まないように、記録する前に切り詰める
+        if self.response_body == "classify":
+            # エラー形式のボディは outcome に分類済みなので残さない
+            result["response_text"] = self.classifier.sample(result["response_text"]) if unusual else None
+        else:
+            result["response_text"] = shape_response_text(result["response_text"], self.response_body,
+                                                          self.max_response_chars)
+        return result
+
+    def map(self, func, items):
+        """items を並列に func で処理し、items の順に結果を返す"""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="probe") as executor:
+            yield from ordered_map(executor, func, items, self.concurrency * 4)
+
+
+def find_first_usable_method(engine, api_key, api_item, plans, method_limit=0, key_state=None):
+    """
+    従来の動作: メソッドを順に試し、最初に 200/400 が返ったメソッドの結果を返す
+    戻り値は (結果 または None, 打ち切った場合の signal)
+    - "api:..." が返った場合は、その API の残りのメソッドを試さない
+    - "key:..." が返った場合は key_state["signal"] に記録し、同じ key_state を渡した他の API も試さない
+    """
+    if key_state is None:
+        key_state = {}
+    for tested_count, plan in enumerate(plans, start=1):
+        if key_state.get("signal"):
+            return None, key_state["signal"]
+        test_result = engine.probe(api_key, plan)
+        signal = test_result["signal"]
+        if signal is not None:
+            if signal.startswith("key:"):
+                key_state["signal"] = signal
+            return None, signal
+        if test_result["ok"]:
+            return {
+                "name": api_item.get("name"),
+                "version": api_item.get("version"),
+                "discovery_url": api_item.get("discoveryRestUrl"),
+                "method_id": plan.method_id,
+                "http_method": test_result["http_method"],
+                "request_url": test_result["request_url"],
+                "status_code": test_result["status_code"],
+                "outcome": test_result["outcome"],
+                "response_text": test_result["response_text"],
+                "request_params": test_result["request_params"],
+            }, None
+        if method_limit > 0 and tested_count >= method_limit:
+            break
+    return None, None
+
+def build_all_methods_result(api_item, method_results):
+    """--test_all_methods の場合の API ごとの結果 (全メソッドの結果を含む) を作成する"""
+    return {
+        "name": api_item.get("name"),
+        "version": api_item.get("version"),
+        "discovery_url": api_item.get("discoveryRestUrl"),
+        # このAPIで 1つでも ok==True のメソッドがあれば "usable": True
+        "usable": any(m["ok"] for m in method_results),
+        "methods": [{
+            "method_id": mres.get("method_id"),
+            "http_method": mres["http_method"],
+            "request_url": mres["request_url"],
+            "status_code": mres["status_code"],
+            "outcome": mres["outcome"],
+            "response_text": mres["response_text"],
+            "request_params": mres["request_params"],
+            "ok": mres["ok"]
+        } for mres in method_results],  # 各メソッドの結果をすべて入れる
+        # 結果の分類ごとの件数
+        "outcomes": summarize_outcomes(Counter(outcome_key(m["outcome"]) for m in method_results)),
+    }
+
+def key_fingerprint(api_key):
+    """API キーの指紋 (SHA-256 の先頭 12 文字)。キーそのものを出さずに結果を区別するために使う"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+def redact_api_key(value, api_key, placeholder=REDACTED_KEY):
+    """結果 (dict / list / 文字列) に含まれる API キー (request_url の key= や request_params) を placeholder に置き換える"""
+    if isinstance(value, str):
+        return value.replace(api_key, placeholder)
+    if isinstance(value, dict):
+        return {k: redact_api_key(v, api_key, placeholder) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_api_key(v, api_key, placeholder) for v in value]
+    return value
+
+def read_api_keys(path):
+    """
+    ファイル (path が "-" の場合は標準入力) から API キーを 1 行 1 つ読み込む
+    空行と # で始まる行は無視し、重複は除く
+    """
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        keys = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return list(dict.fromkeys(keys))
+
+def plan_apis(method_plans, method_limit=0, prioritizer=None):
+    """
+    全てのキーで使い回す [(api_item, [MethodPlan])] を返す
+    method_plans: fetch_method_plans() の戻り値
+    prioritizer: 指定した場合は、見込みの高いメソッドから method_limit 件を残す
+    """
+    plans = []
+    for api_item, methods, error in method_plans:
+        if error is not None:
+            print(f"  ! {api_item.get('name')} ({api_item.get('version')}) の Discovery ドキュメント取得失敗: {error}")
+            continue
+        if prioritizer is not None:
+            methods = prioritizer.order(methods)
+        if method_limit > 0:
+            methods = methods[:method_limit]
+        if methods:
+            plans.append((api_item, methods))
+    return plans
+
+def scan_keys(engine, api_keys, plans, method_limit=0, test_all_methods=False):
+    """
+    全てのキーで plans の API を試し、キーごとに (api_key, [API ごとの結果], signal) を api_keys の順に返す
+    signal は既定のモードでキー全体に当てはまるエラー ("key:API_KEY_INVALID" など) が返った場合のみ
+    (key, API) または (key, API, メソッド) を 1 つのタスク列にして、共有のスレッドプールで並列に実行する
+    API ごとの結果の形式は 1 キーの場合と同じ
+    """
+    def tasks():
+        for api_key in api_keys:
+            state = {"api_key": api_key, "remaining": len(plans), "results": [None] * len(plans), "signal": None}
+            if not plans:
+                yield state, None, None
+            for index, (api_item, methods) in enumerate(plans):
+                if test_all_methods:
+                    state["results"][index] = [None] * len(methods)
+                    for method_index, method_info in enumerate(methods):
+                        yield state, index, method_index
+                else:
+                    yield state, index, None
+
+    def run_task(task):
+        state, index, method_index = task
+        if index is None:
+            return state, None, None, None
+        api_item, methods = plans[index]
+        if method_index is None:
+            # キーが無効と分かったら、そのキーの残りの API は試さない
+            detail, _ = find_first_usable_method(engine, state["api_key"], api_item, methods, method_limit, state)
+            return state, index, None, detail
+        # 同じ API のメソッドの結果を区別できるように method_id を付ける (--history_db の一意キーにも使う)
+        plan = methods[method_index]
+        return state, index, method_index, dict(engine.probe(state["api_key"], plan), method_id=plan.method_id)
+
+    for state, index, method_index, value in engine.map(run_task, tasks()):
+        if index is not None:
+            if method_index is None:
+                state["results"][index] = value
+                state["remaining"] -= 1
+            else:
+                method_results = state["results"][index]
+                method_results[method_index] = value
+                if method_index == len(method_results) - 1:
+                    # タスクは順に返るので、最後のメソッドが返った時点で API の結果がそろう
+                    state["results"][index] = build_all_methods_result(plans[index][0], method_results)
+                    state["remaining"] -= 1
+            if state["remaining"]:
+                continue
+        yield state["api_key"], [r for r in state["results"] if r is not None], state["signal"]
+
+def write_key_matrix(path, key_usable_apis, api_names):
+    """キー × API の表 (利用可能性ありなら 1) を CSV で保存する"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["key_fingerprint"] + api_names)
+        for fingerprint, usable in key_usable_apis:
+            writer.writerow([fingerprint] + ["1" if name in usable else "" for name in api_names])
+
+def run_batch(engine, api_keys, plans, output_file, matrix_file, method_limit=0, test_all_methods=False, resume=False,
+              store=None, store_raw_keys=False):
+    """
+    複数のキーをまとめて検証する
+    - キーごとの結果は終わった順に output_file へ JSON Lines (1 行 1 キー) で書き出す
+    - キーは key_fingerprint のみを記録し、結果の request_url などに含まれるキーも伏せる
+      (store_raw_keys=True の場合のみ、キーそのものを "key" に記録し、結果もそのまま残す)
+    - resume=True の場合は output_file に記録済みのキーを飛ばして追記する
+    - キー × API の表を matrix_file に CSV で保存する
+    - store を指定した場合は、結果を ScanStore にも記録する
+    """
+    if store is not None:
+        store.add_scope([key_fingerprint(api_key) for api_key in api_keys],
+                        [(api_item.get("name"), api_item.get("version")) for api_item, _ in plans])
+    stream = ResultStream(output_file, resume, store)
+    pending_keys = [api_key for api_key in api_keys if ("key", key_fingerprint(api_key)) not in stream.done]
+    if len(pending_keys) < len(api_keys):
+        print(f"記録済みの {len(api_keys) - len(pending_keys)} 件のキーを飛ばします。")
+    try:
+        for i, (api_key, api_results, signal) in enumerate(scan_keys(engine, pending_keys, plans, method_limit,
+                                                                     test_all_methods), start=1):
+            fingerprint = key_fingerprint(api_key)
+            if test_all_methods:
+                usable = [f"{r['name']}:{r['version']}" for r in api_results if r["usable"]]
+            else:
+                usable = [f"{r['name']}:{r['version']}" for r in api_results]
+            record = {"type": "key"}
+            if store_raw_keys:
+                record["key"] = api_key
+            else:
+                api_results = redact_api_key(api_results, api_key)
+            record.update({
+                "key_fingerprint": fingerprint,
+                "usable_apis": usable,
+                "results": api_results,
+                "signal": signal,
+            })
+            stream.write(record)
+            print(f"[{i}/{len(pending_keys)}] キー {fingerprint}: 利用可能性ありの API {len(usable)} 件"
+                  + (f" ({', '.join(usable)})" if usable else "")
+                  + (f" (打ち切り: {signal})" if signal else ""))
+    finally:
+        stream.close()
+    if store is not None:
+        store.finish_run()
+    key_usable_apis = stream.key_records
+
+    # どのキーでも使えなかった API は表から除く
+    api_names = [f"{api_item.get('name')}:{api_item.get('version')}" for api_item, _ in plans]
+    api_names = [name for name in api_names if any(name in usable for _, usable in key_usable_apis)]
+    write_key_matrix(matrix_file, key_usable_apis, api_names)
+    print(f"\n==== 結果 ====\n検証したキー: {len(key_usable_apis)} 件 / "
+          f"いずれかのキーで利用可能性ありの API: {len(api_names)} 件")
+    print(f"キーごとの結果は {output_file}、キー × API の表は {matrix_file} に保存しました。")
+
+def history_main(argv):
+    """
+    history サブコマンド: --history_db に記録したスキャン結果を照会する (再度プローブはしない)
+      runs: 実行の一覧 / query: 条件に一致する結果 / diff: 2 つの実行の差分
+    """
+    parser = argparse.ArgumentParser(prog="check_google_api_key.py history",
+                                     description="--history_db に記録したスキャン結果を照会する")
+    parser.add_argument("db", help="--history_db で指定した SQLite ファイル")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    runs_parser = subparsers.add_parser("runs", help="実行の一覧 (新しい順)")
+    runs_parser.add_argument("--limit", type=int, default=20)
+    query_parser = subparsers.add_parser("query", help="条件に一致する結果")
+    query_parser.add_argument("--key", help="キー または key_fingerprint")
+    query_parser.add_argument("--api", help="API 名 (name または name:version)")
+    query_parser.add_argument("--status", type=int, help="ステータスコード")
+    query_parser.add_argument("--reason", help="エラーの reason (例: SERVICE_DISABLED)")
+    query_parser.add_argument("--usable", action="store_true", help="利用可能性ありの結果のみ")
+    query_parser.add_argument("--run", type=int, help="実行の ID")
+    query_parser.add_argument("--limit", type=int, default=100)
+    diff_parser = subparsers.add_parser("diff", help="2 つの実行で利用可能になった・利用できなくなったキー × API")
+    diff_parser.add_argument("--from", dest="from_run", type=int, help="比較元の実行の ID (デフォルト: 1 つ前の実行)")
+    diff_parser.add_argument("--to", dest="to_run", type=int, help="比較先の実行の ID (デフォルト: 最後の実行)")
+    diff_parser.add_argument("--since", help="この日時 (例: 2024-01-01) より前の最後の実行を比較元にする")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"ERROR: {args.db} がありません。")
+        sys.exit(1)
+    store = ScanStore(args.db)
+    try:
+        if args.command == "runs":
+            print("id\tstarted_at\tfinished_at\tmode\tkeys\tapis\tusable")
+            for row in store.runs(args.limit):
+                print("\t".join("" if value is None else str(value) for value in row))
+
+        elif args.command == "query":
+            key = args.key
+            if key and not re.fullmatch(r"[0-9a-f]{12}", key):
+                key = key_fingerprint(key)
+            name, _, version = (args.api or "").partition(":")
+            rows = store.query(key, name or None, version or None, args.status, args.reason,
+                               True if args.usable else None, args.run, args.limit)
+            print("run\tkey_fingerprint\tapi\tmethod_id\tusable\tstatus_code\treason\tsignal")
+            for run_id, fingerprint, api_name, api_version, method, usable, status_code, reason, signal in rows:
+                print("\t".join("" if value is None else str(value) for value in
+                                (run_id, fingerprint, f"{api_name}:{api_version}", method, usable, status_code,
+                                 reason, signal)))
+
+        else:
+            to_run = args.to_run
+            if to_run is None:
+                run_ids = store.latest_run_ids()
+                to_run = run_ids[0] if run_ids else None
+            from_run = args.from_run
+            if from_run is None:
+                candidates = store.latest_run_ids(args.since) if args.since else store.latest_run_ids()
+                candidates = [run_id for run_id in candidates if to_run is not None and run_id < to_run]
+                from_run = candidates[0] if candidates else None
+            if from_run is None or to_run is None:
+                print("ERROR: 比較する実行がありません (終わった実行が 2 つ以上必要です)。")
+                sys.exit(1)
+            gained, lost = store.diff(from_run, to_run)
+            print(f"実行 {from_run} → {to_run}")
+            print(f"利用可能になった: {len(gained)} 件")
+            for fingerprint, api_name, api_version in gained:
+                print(f"  + {fingerprint}\t{api_name}:{api_version}")
+            print(f"利用できなくなった: {len(lost)} 件")
+            for fingerprint, api_name, api_version in lost:
+                print(f"  - {fingerprint}\t{api_name}:{api_version}")
+    finally:
+        store.close()
+
 def main():
-    parser = argparse.ArgumentParser(description="Google API キー検証ツール")
-    parser.add_argument("api_key", help="テスト対象の Google API キー")
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        return history_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Google API キー検証ツール",
+                                     epilog="記録したスキャン結果の照会: %(prog)s history <db> {runs,query,diff}")
+    parser.add_argument("api_key", nargs="?", help="テスト対象の Google API キー")
+    parser.add_argument("--keys_file",
+                        help="複数のキーをまとめて検証する場合の、1 行 1 キーのファイル (- の場合は標準入力)")
     parser.add_argument("--api_name", help="単一APIを指定するときの API 名 (例: 'calendar')")
     parser.add_argument("--api_version", help="単一APIを指定するときのバージョン (例: 'v3')")
-    parser.add_argument("--output", default="api_check_result.json",
-                        help="結果を保存する JSON ファイルのパス (デフォルト: api_check_result.json)")
+    parser.add_argument("--output",
+                        help="結果を保存する JSON ファイルのパス (デフォルト: api_check_result.json、"
+                             "--keys_file の場合は JSON Lines で api_check_result.jsonl)。"
+                             ".jsonl の場合は検証が終わった順に JSON Lines で書き出す")
+    parser.add_argument("--history_db",
+                        help="スキャン結果を追記する SQLite ファイル (history サブコマンドで照会できる)")
+    parser.add_argument("--resume", action="store_true",
+                        help="中断したスキャンを再開する (記録済みの API・メソッド・キーを飛ばす)")
+    parser.add_argument("--response_body", choices=RESPONSE_BODY_MODES, default="classify",
+                        help="記録するレスポンスボディ (classify: エラー形式のボディは outcome の分類のみ (デフォルト), "
+                             "full: そのまま, truncate: 先頭のみ, hash: SHA-256, none: 記録しない)")
+    parser.add_argument("--max_samples", type=int, default=DEFAULT_MAX_SAMPLES,
+                        help="--response_body classify の場合に、エラー形式でないボディを先頭 --max_response_chars 文字まで"
+                             f"残す件数 (それ以降は SHA-256。デフォルト: {DEFAULT_MAX_SAMPLES})")
+    parser.add_argument("--max_response_chars", type=int, default=DEFAULT_MAX_RESPONSE_CHARS,
+                        help=f"--response_body truncate の場合に残す文字数 (デフォルト: {DEFAULT_MAX_RESPONSE_CHARS})")
+    parser.add_argument("--store_raw_keys", action="store_true",
+                        help="--keys_file の場合に、キーそのものを結果に記録する "
+                             "(デフォルトは key_fingerprint のみを記録し、request_url などのキーも伏せる)")
+    parser.add_argument("--matrix_output",
+                        help="--keys_file の場合に、キー × API の表を保存する CSV ファイルのパス "
+                             "(デフォルト: <output>.matrix.csv)")
     parser.add_argument("--limit_methods", type=int, default=0,
                         help="各 API についてテストするメソッド数の上限 (0 の場合は上限なし)")
-    parser.add_argument("--sleep", type=float, default=0.5,
-                        help="各メソッドの呼び出し間で待機する秒数 (短いとリクエスト過多になる場合があります)")
+    parser.add_argument("--sleep", type=float, default=None,
+                        help="(互換用) 各メソッドの呼び出し間で待機する秒数。指定した場合は --rate 1/sleep と同じ")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"同時に送信するリクエスト数 (デフォルト: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_HOST,
+                        help=f"ホストごとの 1 秒あたりのリクエスト数の上限 (デフォルト: {DEFAULT_RATE_PER_HOST}、0 で無制限)")
+    parser.add_argument("--max_retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"429/503 が返った場合に再送する回数 (デフォルト: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--history", action="append", default=[],
+                        help="過去の結果ファイル (JSON / JSON Lines)。成功したことのあるメソッドから試す (複数指定可)")
+    parser.add_argument("--no_prioritize", action="store_true",
+                        help="メソッドを並べ替えず、Discovery ドキュメントの順に試す")
     parser.add_argument("--test_all_methods", action="store_true",
                         help="すべてのメソッドをテストし、結果をすべて記録する。指定しない場合は最初に200/400が返った時点で打ち切り。")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Discovery ドキュメントのキャッシュディレクトリ (デフォルト: {DEFAULT_CACHE_DIR}、空文字でキャッシュしない)")
+    parser.add_argument("--cache_max_age", type=float, default=DEFAULT_CACHE_MAX_AGE,
+                        help="この秒数以内にキャッシュしたドキュメントは再検証せずに使う (0 の場合は毎回 ETag で再検証)")
+    parser.add_argument("--discovery_url", default=None,
+                        help=f"API 一覧を取得する Discovery の URL (デフォルト: {DISCOVERY_APIS_URL})")
+    parser.add_argument("--offline", action="store_true",
+                        help="Discovery ドキュメントをキャッシュのみから読み込む (ネットワークに接続しない)")
+    parser.add_argument("--discovery_workers", type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                        help=f"Discovery ドキュメントを並列に取得する数 (デフォルト: {DEFAULT_DISCOVERY_WORKERS})")
     args = parser.parse_args()
 
+    if bool(args.api_key) == bool(args.keys_file):
+        print("ERROR: api_key か --keys_file のどちらか一方を指定してください。")
+        sys.exit(1)
     api_key = args.api_key
-    output_file = args.output
+    api_keys = None
+    if args.keys_file:
+        api_keys = read_api_keys(args.keys_file)
+        if not api_keys:
+            print("ERROR: --keys_file にキーがありません。")
+            sys.exit(1)
+    output_file = args.output or ("api_check_result.jsonl" if api_keys else "api_check_result.json")
+    if api_keys and not output_file.endswith(".jsonl"):
+        print(f"WARNING: --keys_file の結果は JSON Lines で書き出します。--output の拡張子は .jsonl にしてください ({output_file})。")
     method_limit = args.limit_methods
-    sleep_time = args.sleep
+    rate = args.rate
+    if args.sleep is not None:
+        rate = 1 / args.sleep if args.sleep > 0 else 0
     test_all_methods = args.test_all_methods
 
+    if args.offline and not args.cache_dir:
+        print("ERROR: --offline を指定する場合は --cache_dir が必要です。")
+        sys.exit(1)
+    cache = DiscoveryCache(args.cache_dir, max_age=args.cache_max_age, offline=args.offline)
+    session = create_session(args.discovery_workers)
+
     print("==== Google Discovery API から API リストを取得中 ====")
-    all_apis = fetch_discovery_apis()
+    try:
+        all_apis = fetch_discovery_apis(cache, session, args.discovery_url)
+    except DiscoveryCacheMiss:
+        print("ERROR: API リストがキャッシュにありません。一度オンラインで実行してください。")
+        sys.exit(1)
     print(f"取得した API 数: {len(all_apis)}")
 
     # 単一 API を指定している場合は、name & version でフィルター
@@ -209,121 +1517,165 @@ def main():
         print("ERROR: --api_name と --api_version はセットで指定してください。")
         sys.exit(1)
 
-    result = []
-    for i, api_item in enumerate(all_apis, start=1):
-        name = api_item.get("name")
-        version = api_item.get("version")
-        discovery_url = api_item.get("discoveryRestUrl")
+    engine = ProbeEngine(args.concurrency, rate, args.max_retries,
+                         response_body=args.response_body, max_response_chars=args.max_response_chars,
+                         max_samples=args.max_samples)
+    # 最初の成功で打ち切る既定のモードでは、見込みの高いメソッドから試す
+    # (--test_all_methods では全メソッドを試すので、出力を Discovery ドキュメントの順に保つ)
+    prioritizer = None
+    if not test_all_methods and not args.no_prioritize:
+        prioritizer = ProbePrioritizer.from_files(args.history)
 
-        print(f"[{i}/{len(all_apis)}] {name} ({version}) のチェックを開始...")
+    store = None
+    if args.history_db:
+        store = ScanStore(args.history_db)
+        options = {k: v for k, v in vars(args).items() if k not in ("api_key", "keys_file")}
+        store.start_run("test_all_methods" if test_all_methods else "default", output_file, options, args.resume)
 
-        try:
-            discovery_doc = fetch_discovery_document(discovery_url)
-        except requests.RequestException as e:
-            print(f"  ! Discovery ドキュメント取得失敗: {e}")
-            continue
+    if api_keys:
+        # 複数のキーの場合は、メソッドの抽出を 1 回だけ行ってから全てのキーで使い回す
+        print(f"==== {len(api_keys)} 件のキーをまとめて検証します ====")
+        plans = plan_apis(fetch_method_plans(all_apis, cache, session, args.discovery_workers), method_limit,
+                          prioritizer)
+        print(f"検証する API 数: {len(plans)} / メソッド数: {sum(len(methods) for _, methods in plans)}")
+        run_batch(engine, api_keys, plans, output_file, args.matrix_output or f"{output_file}.matrix.csv",
+                  method_limit, test_all_methods, args.resume, store, args.store_raw_keys)
+        if store is not None:
+            store.close()
+        return
 
-        # メソッド一覧の取得
-        methods = extract_all_methods(discovery_doc)
-        if not methods:
-            print("  ! メソッド情報が見つからないためスキップ")
-            continue
+    # 結果は検証が終わった順に JSON Lines で書き出し、中断しても --resume で続きから再開できるようにする
+    # JSON で保存する場合は、最後に JSON Lines から変換する
+    jsonl_output = output_file.endswith(".jsonl")
+    stream_file = output_file if jsonl_output else f"{output_file}.partial.jsonl"
+    if store is not None:
+        store.key_fingerprint = key_fingerprint(api_key)
+        store.add_scope([store.key_fingerprint], [(api.get("name"), api.get("version")) for api in all_apis])
+    stream = ResultStream(stream_file, args.resume, store)
+    if args.resume:
+        pending_apis = [api for api in all_apis if ("api", api.get("name"), api.get("version")) not in stream.done]
+        print(f"記録済みの {len(all_apis) - len(pending_apis)} 件の API を飛ばして再開します。")
+        all_apis = pending_apis
+    method_plans = fetch_method_plans(all_apis, cache, session, args.discovery_workers)
 
-        # =================================================================
-        # test_all_methods が true なら、全メソッドをチェックして
-        # すべての結果を記録する。
-        # test_all_methods が false なら、最初に 200/400 が返ったら打ち切り。
-        # =================================================================
+    def print_api_header(index, api_item):
+        print(f"[{index}/{len(all_apis)}] {api_item.get('name')} ({api_item.get('version')}) のチェック結果")
+
+    # =================================================================
+    # test_all_methods が true なら、全メソッドをチェックして
+    # すべての結果を記録する。
+    # test_all_methods が false なら、最初に 200/400 が返ったら打ち切り。
+    # どちらも並列に実行し、結果は API の順に出力する。
+    # =================================================================
+    try:
         if test_all_methods:
-            method_results = []
-            tested_count = 0
+            # 全 API のメソッドを 1 つのタスク列にして並列に試し、メソッドごとに記録する
+            def method_tasks():
+                for i, (api_item, methods, error) in enumerate(method_plans, start=1):
+                    methods = methods or []
+                    if method_limit > 0:
+                        methods = methods[:method_limit]
+                    name, version = api_item.get("name"), api_item.get("version")
+                    # --resume の場合は記録済みのメソッドを飛ばす
+                    pending = [m for m in methods if ("method", name, version, m.method_id) not in stream.done]
+                    api = {"index": i, "item": api_item, "error": error, "has_methods": bool(methods),
+                           "remaining": len(pending)}
+                    if not pending:
+                        yield api, None
+                    for plan in pending:
+                        yield api, plan
 
-            for method_info in methods:
-                tested_count += 1
-                tr = test_method(api_key, discovery_doc, method_info)
-                method_results.append(tr)
+            def run_method_task(task):
+                api, plan = task
+                if plan is None:
+                    return api, None, None
+                return api, plan, engine.probe(api_key, plan)
 
-                if method_limit > 0 and tested_count >= method_limit:
-                    break
+            for api, plan, test_result in engine.map(run_method_task, method_tasks()):
+                api_item = api["item"]
+                if test_result is not None:
+                    stream.write(dict({
+                        "type": "method",
+                        "name": api_item.get("name"),
+                        "version": api_item.get("version"),
+                        "discovery_url": api_item.get("discoveryRestUrl"),
+                        "method_id": plan.method_id,
+                    }, **test_result))
+                    api["remaining"] -= 1
+                    if api["remaining"]:
+                        continue
+                print_api_header(api["index"], api_item)
+                if api["error"] is not None:
+                    print(f"  ! Discovery ドキュメント取得失敗: {api['error']}")
+                    continue
+                if not api["has_methods"]:
+                    print("  ! メソッド情報が見つからないためスキップ")
+                    continue
+                usable = (api_item.get("name"), api_item.get("version")) in stream.usable_apis
+                stream.write({"type": "api", "name": api_item.get("name"), "version": api_item.get("version"),
+                              "discovery_url": api_item.get("discoveryRestUrl"), "usable": usable,
+                              "outcomes": stream.outcome_summary(api_item.get("name"), api_item.get("version"))})
 
-                time.sleep(sleep_time)
+                # ログ出力用メッセージ
+                if usable:
+                    print("  => 利用可能性あり (少なくとも 1 メソッドで 200 or 400 を確認)")
+                else:
+                    print("  => 利用可能性なし (該当メソッドなし)")
 
-            # このAPIで 1つでも ok==True のメソッドがあれば "usable": True
-            usable = any(m["ok"] for m in method_results)
+        else:
+            # 従来の動作: API ごとにメソッドを順に試し、最初に 200/400 が返ったメソッドのみを保存
+            # キーが無効と分かった時点で、残りの API は試さない
+            key_state = {}
 
-            api_result = {
-                "name": name,
-                "version": version,
-                "discovery_url": discovery_url,
-                "usable": usable,
-                "methods": []  # 各メソッドの結果をすべて入れる
-            }
+            def run_api_task(task):
+                i, (api_item, methods, error) = task
+                if not methods:
+                    return i, api_item, error, False, None, None
+                if prioritizer is not None:
+                    methods = prioritizer.order(methods)
+                detail, signal = find_first_usable_method(engine, api_key, api_item, methods, method_limit, key_state)
+                return i, api_item, None, True, detail, signal
 
-            # method_results を整形して格納
-            for mres in method_results:
-                api_result["methods"].append({
-                    "http_method": mres["http_method"],
-                    "request_url": mres["request_url"],
-                    "status_code": mres["status_code"],
-                    "response_text": mres["response_text"],
-                    "request_params": mres["request_params"],
-                    "ok": mres["ok"]
-                })
-
-            # ログ出力用メッセージ
-            if usable:
-                print("  => 利用可能性あり (少なくとも 1 メソッドで 200 or 400 を確認)")
-            else:
-                print("  => 利用可能性なし (該当メソッドなし)")
-            
-            result.append(api_result)
+            for i, api_item, error, has_methods, detail_for_this_api, signal in engine.map(
+                    run_api_task, enumerate(method_plans, start=1)):
+                print_api_header(i, api_item)
+                if error is not None:
+                    print(f"  ! Discovery ドキュメント取得失敗: {error}")
+                    continue
+                if not has_methods:
+                    print("  ! メソッド情報が見つからないためスキップ")
+                    continue
+                if detail_for_this_api is not None:
+                    print("  => 利用可能性あり (少なくとも 1 メソッドで 200 or 400 を確認)")
+                    stream.write(dict({"type": "api", "usable": True}, **detail_for_this_api))
+                else:
+                    print("  => 利用可能性なし (該当メソッドなし)" if signal is None else f"  => 利用可能性なし (打ち切り: {signal})")
+                    stream.write({"type": "api", "usable": False, "name": api_item.get("name"),
+                                  "version": api_item.get("version"), "discovery_url": api_item.get("discoveryRestUrl"),
+                                  "signal": signal})
 
+        if jsonl_output:
+            count = sum(1 for record in stream.records() if record.get("type") == "api"
+                        and (test_all_methods or record.get("usable")))
         else:
-            # 従来の動作: 最初に 200/400 が返ったメソッドのみを保存
-            valid_endpoint_found = False
-            tested_count = 0
-            detail_for_this_api = None
-
-            for method_info in methods:
-                tested_count += 1
-                test_result = test_method(api_key, discovery_doc, method_info)
-                if test_result["ok"]:
-                    valid_endpoint_found = True
-                    detail_for_this_api = {
-                        "name": name,
-                        "version": version,
-                        "discovery_url": discovery_url,
-                        "http_method": test_result["http_method"],
-                        "request_url": test_result["request_url"],
-                        "status_code": test_result["status_code"],
-                        "response_text": test_result["response_text"],
-                        "request_params": test_result["request_params"],
-                    }
-                    break
-
-                if method_limit > 0 and tested_count >= method_limit:
-                    break
-
-                time.sleep(sleep_time)
-
-            if valid_endpoint_found and detail_for_this_api is not None:
-                print("  => 利用可能性あり (少なくとも 1 メソッドで 200 or 400 を確認)")
-                result.append(detail_for_this_api)
-            else:
-                print("  => 利用可能性なし (該当メソッドなし)")
-
-    # 結果を JSON 保存
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-
-    # test_all_methods の場合は result が配列の中に APIごとの情報を入れている。
-    # 従来の場合も従来通りの形で1 API 1エントリ (成功時のみ) を入れている。
+            # 結果を JSON 保存
+            # test_all_methods の場合は result が配列の中に APIごとの情報を入れている。
+            # 従来の場合も従来通りの形で1 API 1エントリ (成功時のみ) を入れている。
+            count = write_json_result(stream, output_file, test_all_methods)
+    finally:
+        stream.close()
+    if store is not None:
+        store.finish_run()
+        store.close()
+    if not jsonl_output:
+        # 変換が終わったらチェックポイントは不要
+        os.remove(stream_file)
 
     # 最終ログ表示
     if test_all_methods:
-        print(f"\n==== 結果 ====\n検証した API 数: {len(result)} 件 (全メソッドの結果を記録)")
+        print(f"\n==== 結果 ====\n検証した API 数: {count} 件 (全メソッドの結果を記録)")
     else:
-        print(f"\n==== 結果 ====\n利用可能性ありと判定された API: {len(result)} 件 (最初の成功のみ記録)")
+        print(f"\n==== 結果 ====\n利用可能性ありと判定された API: {count} 件 (最初の成功のみ記録)")
     print(f"結果は {output_file} に保存しました。")
 
 if __name__ == "__main__":
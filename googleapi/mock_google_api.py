@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+check_google_api_key.py の動作確認・ベンチマーク用の、ローカルの Google API のモックサーバー
+
+- /discovery/v1/apis: API 一覧 (--apis 件)
+- /discovery/v1/apis/<name>/<version>/rest: Discovery ドキュメント (--methods 件のメソッド、ETag 付き)
+- それ以外: メソッドのエンドポイント。Google のエラー形式のレスポンスを --error_mix の割合で返す
+- /_stats: 受け付けたリクエスト数など
+
+使い方:
+  python mock_google_api.py --port 8080 --apis 50 --methods 40 --latency 0.05
+  python check_google_api_key.py AIxx --discovery_url http://127.0.0.1:8080/discovery/v1/apis --rate 0
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ERROR_MIX = "ok:1,bad_request:4,not_found:3,permission_denied:1,unauthenticated:1"
+PROJECT_NUMBER = "123456789012"
+# メソッドの種類 (動詞, HTTP メソッド, path の末尾, 必須のパスパラメータがあるか)
+METHOD_KINDS = (
+    ("list", "GET", "", False),
+    ("get", "GET", "/{name}", True),
+    ("create", "POST", "", False),
+    ("patch", "PATCH", "/{name}", True),
+    ("delete", "DELETE", "/{name}", True),
+    ("search", "GET", ":search", False),
+)
+
+
+def error_body(code, status, message, reason=None, domain="googleapis.com", errors_reason=None, service=None):
+    """Google のエラー形式のボディ"""
+    error = {"code": code, "message": message, "status": status}
+    if errors_reason:
+        error["errors"] = [{"message": message, "domain": "global", "reason": errors_reason}]
+    if reason:
+        error["details"] = [{
+            "@type": "type.googleapis.com/google.rpc.ErrorInfo",
+            "reason": reason,
+            "domain": domain,
+            "metadata": {"service": service or "example.googleapis.com", "consumer": f"projects/{PROJECT_NUMBER}"},
+        }]
+    return {"error": error}
+
+
+def outcome_response(outcome, service):
+    """--error_mix の種類ごとの (ステータスコード, ボディ)"""
+    if outcome == "ok":
+        return 200, {"kind": f"{service}#list", "items": []}
+    if outcome == "bad_request":
+        return 400, error_body(400, "INVALID_ARGUMENT", "Request contains an invalid argument.",
+                               errors_reason="badRequest")
+    if outcome == "not_found":
+        return 404, error_body(404, "NOT_FOUND", "Requested entity was not found.", errors_reason="notFound")
+    if outcome == "permission_denied":
+        return 403, error_body(403, "PERMISSION_DENIED", "The caller does not have permission",
+                               errors_reason="forbidden")
+    if outcome == "unauthenticated":
+        return 401, error_body(401, "UNAUTHENTICATED",
+                               "API keys are not supported by this API. Expected OAuth2 access token or other "
+                               "authentication credentials that assert a principal. "
+                               "See https://cloud.google.com/docs/authentication",
+                               reason="CREDENTIALS_MISSING", service=service)
+    raise ValueError(f"unknown outcome: {outcome}")
+
+
+def service_disabled_response(service):
+    message = (f"{service} API has not been used in project {PROJECT_NUMBER} before or it is disabled. "
+               f"Enable it by visiting https://console.developers.google.com/apis/api/{service}/overview"
+               f"?project={PROJECT_NUMBER} then retry. If you enabled this API recently, wait a few minutes "
+               "for the action to propagate to our systems and retry.")
+    body = error_body(403, "PERMISSION_DENIED", message, reason="SERVICE_DISABLED", service=service)
+    body["error"]["errors"] = [{"message": message, "domain": "usageLimits", "reason": "accessNotConfigured",
+                                "extendedHelp": "https://console.developers.google.com"}]
+    return 403, body
+
+
+def api_key_invalid_response(service):
+    return 400, error_body(400, "INVALID_ARGUMENT", "API key not valid. Please pass a valid API key.",
+                           reason="API_KEY_INVALID", service=service)
+
+
+def rate_limited_response(service):
+    return 429, error_body(429, "RESOURCE_EXHAUSTED",
+                           f"Quota exceeded for quota metric 'Queries' and limit 'Queries per minute' of service "
+                           f"'{service}' for consumer 'project_number:{PROJECT_NUMBER}'.",
+                           reason="RATE_LIMIT_EXCEEDED", service=service)
+
+
+def parse_error_mix(text):
+    """"ok:1,bad_request:4" の形式を [(種類, 累積の割合)] にする"""
+    weights = []
+    for item in text.split(","):
+        name, _, weight = item.strip().partition(":")
+        outcome_response(name, "example")   # 種類名の確認
+        weights.append((name, float(weight or 1)))
+    total = sum(weight for _, weight in weights)
+    if total <= 0:
+        raise ValueError("error_mix の割合の合計が 0 です")
+    cumulative, mix = 0.0, []
+    for name, weight in weights:
+        cumulative += weight / total
+        mix.append((name, cumulative))
+    return mix
+
+
+def stable_fraction(*parts):
+    """parts から決まる [0, 1) の値 (同じ API・メソッド・キーには毎回同じ結果を返すため)"""
+    digest = hashlib.sha256("\n".join(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class MockGoogleAPI:
+    """
+    モックサーバーの設定と統計
+
+    apis: API 数 / methods: API ごとのメソッド数 / description_bytes: メソッドごとの description の長さ
+    latency, jitter: メソッドのエンドポイントの応答までの秒数 (latency + 0〜jitter)
+    error_mix: メソッドの結果の割合 / disabled_ratio: SERVICE_DISABLED を返す API の割合
+    throttle_ratio: 429 を返す割合 / retry_after: 429 の Retry-After (秒)
+    invalid_keys: API_KEY_INVALID を返すキー
+    """
+
+    def __init__(self, apis=20, methods=30, description_bytes=200, latency=0.0, jitter=0.0,
+                 error_mix=DEFAULT_ERROR_MIX, disabled_ratio=0.2, throttle_ratio=0.0, retry_after=0,
+                 invalid_keys=(), seed=0):
+        self.apis = apis
+        self.methods = methods
+        self.description_bytes = description_bytes
+        self.latency = latency
+        self.jitter = jitter
+        self.error_mix = parse_error_mix(error_mix)
+        self.disabled_ratio = disabled_ratio
+        self.throttle_ratio = throttle_ratio
+        self.retry_after = retry_after
+        self.invalid_keys = set(invalid_keys)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"discovery": 0, "probes": 0, "throttled": 0, "by_status": {}}
+        self._documents = {}
+
+    def api_names(self):
+        return [f"mockapi{i}" for i in range(self.apis)]
+
+    def discovery_list(self, base_url):
+        return {
+            "kind": "discovery#directoryList",
+            "discoveryVersion": "v1",
+            "items": [{
+                "kind": "discovery#directoryItem",
+                "id": f"{name}:v1",
+                "name": name,
+                "version": "v1",
+                "title": f"Mock API {name}",
+                "discoveryRestUrl": f"{base_url}/discovery/v1/apis/{name}/v1/rest",
+                "preferred": True,
+            } for name in self.api_names()],
+        }
+
+    def discovery_document(self, base_url, name):
+        """Discovery ドキュメントと ETag (ポートごとに作成して使い回す)"""
+        key = (base_url, name)
+        if key not in self._documents:
+            resources = {}
+            for i in range(self.methods):
+                verb, http_method, suffix, has_path_param = METHOD_KINDS[i % len(METHOD_KINDS)]
+                resource = f"resource{i // len(METHOD_KINDS)}"
+                parameters = {"pageSize": {"type": "integer", "location": "query"}}
+                if has_path_param:
+                    parameters["name"] = {"type": "string", "location": "path", "required": True}
+                resources.setdefault(resource, {"methods": {}})["methods"][verb] = {
+                    "id": f"{name}.{resource}.{verb}",
+                    "httpMethod": http_method,
+                    "path": f"v1/{resource}{suffix}",
+                    "parameters": parameters,
+                    "description": "x" * self.description_bytes,
+                }
+            document = {
+                "kind": "discovery#restDescription",
+                "name": name,
+                "version": "v1",
+                "revision": "20240101",
+                "rootUrl": f"{base_url}/",
+                "servicePath": f"{name}/",
+                "resources": resources,
+            }
+            body = json.dumps(document).encode("utf-8")
+            self._documents[key] = (body, '"' + hashlib.md5(body).hexdigest() + '"')
+        return self._documents[key]
+
+    def probe_response(self, path, api_key):
+        """メソッドのエンドポイントへのリクエストの (ステータスコード, ボディ, ヘッダー)"""
+        name = path.strip("/").split("/", 1)[0]
+        service = f"{name}.googleapis.com"
+        with self.lock:
+            throttled = self.random.random() < self.throttle_ratio
+        if not api_key:
+            return 403, error_body(403, "PERMISSION_DENIED", "The request is missing a valid API key."), {}
+        if api_key in self.invalid_keys:
+            return (*api_key_invalid_response(service), {})
+        if throttled:
+            return (*rate_limited_response(service), {"Retry-After": str(self.retry_after)})
+        if stable_fraction("disabled", name) < self.disabled_ratio:
+            return (*service_disabled_response(service), {})
+        fraction = stable_fraction(path, api_key)
+        for outcome, cumulative in self.error_mix:
+            if fraction < cumulative:
+                break
+        return (*outcome_response(outcome, service), {})
+
+    def count(self, kind, status):
+        with self.lock:
+            self.stats[kind] += 1
+            if status == 429:
+                self.stats["throttled"] += 1
+            self.stats["by_status"][str(status)] = self.stats["by_status"].get(str(status), 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"discovery": 0, "probes": 0, "throttled": 0, "by_status": {}}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None     # serve() でサーバーごとに設定する
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.handle_request()
+
+    do_PATCH = do_POST
+    do_DELETE = do_GET
+
+    def handle_request(self):
+        mock = self.mock
+        base_url = f"http://{self.headers.get('Host')}"
+        path, _, query = self.path.partition("?")
+        if path == "/_stats":
+            return self.send_body(200, mock.snapshot())
+        if path == "/discovery/v1/apis":
+            mock.count("discovery", 200)
+            return self.send_body(200, mock.discovery_list(base_url))
+        m = re.match(r"^/discovery/v1/apis/([^/]+)/v1/rest$", path)
+        if m:
+            if m.group(1) not in mock.api_names():
+                mock.count("discovery", 404)
+                return self.send_body(404, error_body(404, "NOT_FOUND", "Requested entity was not found."))
+            body, etag = mock.discovery_document(base_url, m.group(1))
+            mock.count("discovery", 200)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            return self.send_body(200, body, {"ETag": etag})
+
+        if mock.latency or mock.jitter:
+            time.sleep(mock.latency + random.uniform(0, mock.jitter))
+        key = re.search(r"(?:^|&)key=([^&]*)", query)
+        status, body, headers = mock.probe_response(path, key.group(1) if key else None)
+        mock.count("probes", status)
+        self.send_body(status, body, headers)
+
+
+def serve(mock, host="127.0.0.1", port=0):
+    """別スレッドでモックサーバーを起動し、サーバーを返す (port=0 の場合は空いているポート)"""
+    handler = type("BoundMockHandler", (MockHandler,), {"mock": mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-google-api", daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser):
+    """MockGoogleAPI の設定のコマンドライン引数 (benchmark.py と共通)"""
+    parser.add_argument("--apis", type=int, default=20, help="API 数 (デフォルト: 20)")
+    parser.add_argument("--methods", type=int, default=30, help="API ごとのメソッド数 (デフォルト: 30)")
+    parser.add_argument("--description_bytes", type=int, default=200,
+                        help="Discovery ドキュメントのメソッドごとの description の長さ (デフォルト: 200)")
+    parser.add_argument("--latency", type=float, default=0.0, help="メソッドの応答までの秒数 (デフォルト: 0)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency に加える最大の秒数 (デフォルト: 0)")
+    parser.add_argument("--error_mix", default=DEFAULT_ERROR_MIX,
+                        help="メソッドの結果の割合 (ok, bad_request, not_found, permission_denied, unauthenticated。"
+                             f"デフォルト: {DEFAULT_ERROR_MIX})")
+    parser.add_argument("--disabled_ratio", type=float, default=0.2,
+                        help="SERVICE_DISABLED を返す API の割合 (デフォルト: 0.2)")
+    parser.add_argument("--throttle_ratio", type=float, default=0.0, help="429 を返す割合 (デフォルト: 0)")
+    parser.add_argument("--retry_after", type=int, default=0, help="429 の Retry-After の秒数 (デフォルト: 0)")
+    parser.add_argument("--invalid_keys", default="",
+                        help="API_KEY_INVALID を返すキー (カンマ区切り)")
+    parser.add_argument("--seed", type=int, default=0, help="429 を返すかどうかの乱数のシード")
+
+
+def mock_from_args(args):
+    return MockGoogleAPI(
+        apis=args.apis, methods=args.methods, description_bytes=args.description_bytes,
+        latency=args.latency, jitter=args.jitter, error_mix=args.error_mix,
+        disabled_ratio=args.disabled_ratio, throttle_ratio=args.throttle_ratio, retry_after=args.retry_after,
+        invalid_keys=[key for key in args.invalid_keys.split(",") if key], seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Google API のモックサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(mock_from_args(args), args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"モックサーバーを起動しました: --discovery_url http://{host}:{port}/discovery/v1/apis", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
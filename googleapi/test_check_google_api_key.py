@@ -0,0 +1,82 @@
+"""
+check_google_api_key.py の --history_db (ScanStore) のテスト
+
+mock_google_api.py のモックサーバーを起動し、check_google_api_key.py を別プロセスで実行する
+実行方法: python -m pytest -q googleapi
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from check_google_api_key import SCAN_STORE_SCHEMA, ScanStore
+from mock_google_api import MockGoogleAPI, serve
+
+CHECKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "check_google_api_key.py")
+
+
+@pytest.fixture(scope="module")
+def discovery_url():
+    server = serve(MockGoogleAPI(apis=4, methods=12))
+    yield f"http://127.0.0.1:{server.server_address[1]}/discovery/v1/apis"
+    server.shutdown()
+
+
+def run_checker(tmp_path, discovery_url, *args):
+    subprocess.run([sys.executable, CHECKER, "--discovery_url", discovery_url, "--cache_dir", str(tmp_path / "cache"),
+                    "--rate", "0"] + list(args), check=True, stdout=subprocess.DEVNULL)
+
+
+def test_batch_all_methods_stores_one_row_per_method(tmp_path, discovery_url):
+    keys_file = tmp_path / "keys.txt"
+    keys_file.write_text("AIzaKeyOne\nAIzaKeyTwo\n", encoding="utf-8")
+    output = tmp_path / "result.jsonl"
+    db_path = tmp_path / "scans.db"
+    run_checker(tmp_path, discovery_url, "--keys_file", str(keys_file), "--test_all_methods",
+                "--output", str(output), "--history_db", str(db_path))
+
+    method_rows = set()
+    usable_pairs = set()
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            for api in record["results"]:
+                for method in api["methods"]:
+                    method_rows.add((record["key_fingerprint"], api["name"], api["version"], method["method_id"]))
+                if api["usable"]:
+                    usable_pairs.add((record["key_fingerprint"], api["name"], api["version"]))
+    assert len(method_rows) == 2 * 4 * 12
+
+    db = sqlite3.connect(db_path)
+    rows = set(db.execute("SELECT key_fingerprint, api_name, api_version, method_id FROM results").fetchall())
+    usable = set(db.execute("SELECT DISTINCT key_fingerprint, api_name, api_version FROM results WHERE usable = 1"
+                            ).fetchall())
+    db.close()
+    assert rows == method_rows
+    assert usable == usable_pairs
+
+
+def test_unique_index_migration_keeps_distinct_rows(tmp_path):
+    db_path = tmp_path / "old.db"
+    db = sqlite3.connect(db_path)
+    db.executescript(SCAN_STORE_SCHEMA)
+    rows = [
+        # 再開で記録し直した同じ行
+        (1, "fp", "a", "v1", "a.files.list", "GET", 1, 200, None, None, None),
+        (1, "fp", "a", "v1", "a.files.list", "GET", 1, 200, None, None, None),
+        # method_id のない以前の --keys_file --test_all_methods の行 (メソッドごとに別の行)
+        (1, "fp", "b", "v1", None, "GET", 1, 200, None, None, None),
+        (1, "fp", "b", "v1", None, "GET", 0, 403, "PERMISSION_DENIED", None, None),
+        (1, "fp", "b", "v1", None, "POST", 0, 404, "NOT_FOUND", None, None),
+    ]
+    db.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    db.commit()
+    db.close()
+
+    store = ScanStore(str(db_path))
+    counts = dict(store.conn.execute("SELECT api_name, COUNT(*) FROM results GROUP BY api_name").fetchall())
+    store.close()
+    assert counts == {"a": 1, "b": 3}